@@ -3,24 +3,127 @@ import torch
 import json
 import logging
 import re
+import multiprocessing
+import numpy as np
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from src.utils.model_registry import model_registry
+from src.analysis.audio_split import find_split_points
 
 logger = logging.getLogger(__name__)
 
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE  # 16 kHz
+
+# === ВОРКЕР ДЛЯ ПАРАЛЛЕЛЬНОЙ ТРАНСКРИПЦИИ ===
+# У каждого процесса своя модель и свое фиксированное число потоков torch
+
+_worker_model = None
+
+
+def _init_worker(model_size, threads):
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = whisper.load_model(model_size, device="cpu")
+
+
+def _transcribe_chunk(audio_chunk, offset):
+    """Транскрибирует кусок и сдвигает все тайминги на его глобальное смещение."""
+    result = _worker_model.transcribe(audio_chunk, fp16=False, task="transcribe", word_timestamps=True)
+    return _shift_segments(result['segments'], offset)
+
+
+def _shift_segments(segments, offset):
+    for seg in segments:
+        seg['start'] += offset
+        seg['end'] += offset
+        for word in seg.get('words', []):
+            word['start'] += offset
+            word['end'] += offset
+    return segments
+
+
 class AudioProcessor:
-    def __init__(self, model_size="medium"):
+    def __init__(self, model_size="medium", workers=1, chunk_seconds=300):
+        """
+        Args:
+            model_size: Размер модели Whisper
+            workers: Сколько процессов транскрибируют куски параллельно (1 - как раньше)
+            chunk_seconds: Целевая длина куска при параллельной транскрипции
+        """
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         if torch.backends.mps.is_available():
              self.device = "cpu" 
-        
-        logger.info(f"👂 Loading Whisper model ('{model_size}') on {self.device}...")
-        self.model = whisper.load_model(model_size, device=self.device)
+
+        self.model_size = model_size
+        self.workers = max(1, int(workers))
+        self.chunk_seconds = chunk_seconds
+        self.model = None
+
+    def _load_model(self):
+        if self.model is None:
+            self.model = model_registry.get(
+                ("whisper", self.model_size, self.device),
+                self._create_model
+            )
+        return self.model
+
+    def _create_model(self):
+        logger.info(f"👂 Loading Whisper model ('{self.model_size}') on {self.device}...")
+        return whisper.load_model(self.model_size, device=self.device)
 
     def transcribe(self, audio_path):
         logger.info(f"🎙 Transcribing {audio_path} (word-level)...")
-        result = self.model.transcribe(str(audio_path), fp16=False, task="transcribe", word_timestamps=True)
+
+        # Параллельный режим имеет смысл только на CPU и для длинной записи
+        if self.workers > 1 and self.device == "cpu":
+            audio = whisper.load_audio(str(audio_path))
+            points = find_split_points(audio, chunk_seconds=self.chunk_seconds)
+            if points:
+                return self._transcribe_parallel(audio, points)
+
+        result = self._load_model().transcribe(str(audio_path), fp16=False, task="transcribe", word_timestamps=True)
         return result['segments']
 
+    def _transcribe_parallel(self, audio, points):
+        bounds = [0] + points + [len(audio)]
+        chunks = [(audio[a:b], a / SAMPLE_RATE) for a, b in zip(bounds[:-1], bounds[1:])]
+        workers = min(self.workers, len(chunks))
+        threads = max(1, torch.get_num_threads() // workers)
+
+        logger.info(f"✂️ Split voiceover into {len(chunks)} chunks at silences -> {workers} workers x {threads} threads")
+
+        # spawn: fork после инициализации torch ненадежен (особенно на macOS)
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(self.model_size, threads)
+        ) as pool:
+            futures = [pool.submit(_transcribe_chunk, chunk, offset) for chunk, offset in chunks]
+            # Склеиваем строго по порядку кусков: глобальные тайминги уже проставлены
+            segments = []
+            for future in futures:
+                segments.extend(future.result())
+
+        return segments
+
+    def align(self, audio_path, script_text_path, language=None):
+        """
+        Forced alignment: текст уже известен, восстанавливаем только тайминги слов.
+        Возвращает ту же структуру, что и transcribe().
+        """
+        from src.analysis.forced_aligner import ForcedAligner
+
+        logger.info(f"📐 Aligning known script {script_text_path} to {audio_path}...")
+        with open(script_text_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+
+        audio = whisper.load_audio(str(audio_path))
+        aligner = ForcedAligner(self._load_model(), language=language)
+        return aligner.align(audio, text)
+
     def syntax_segmentation(self, raw_segments):
         """
         Режет по знакам препинания (.,!?:;-), но не чаще чем раз в 3 слова.
@@ -135,9 +238,12 @@ class AudioProcessor:
 
         return batches
 
-    def process(self, audio_path, output_path):
-        # 1. Whisper
-        raw = self.transcribe(audio_path)
+    def process(self, audio_path, output_path, script_text_path=None):
+        # 1. Whisper (или выравнивание готового текста, если он есть)
+        if script_text_path:
+            raw = self.align(audio_path, script_text_path)
+        else:
+            raw = self.transcribe(audio_path)
         
         # 2. Syntax Cut + Gapless
         optimized = self.syntax_segmentation(raw)
@@ -0,0 +1,45 @@
+import numpy as np
+
+# Частота whisper.load_audio (whisper.audio.SAMPLE_RATE); сам whisper здесь не нужен
+SAMPLE_RATE = 16000
+
+
+def find_split_points(audio, chunk_seconds=300, min_silence=0.4, frame_ms=30):
+    """
+    Энергетический VAD: ищет точки разреза в тишине рядом с каждой
+    chunk_seconds-границей, чтобы не резать слово пополам.
+
+    Returns:
+        list: Индексы сэмплов, где резать (без 0 и конца)
+    """
+    frame = int(SAMPLE_RATE * frame_ms / 1000)
+    n_frames = len(audio) // frame
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    if n_frames == 0 or len(audio) <= chunk * 1.5:
+        return []
+
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    db = 20 * np.log10(np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-10)
+    # Порог тишины относительно конкретной записи: заметно тише речи
+    # и близко к "полу" шума (берем более строгий из двух)
+    threshold = min(np.percentile(db, 90) - 25, np.percentile(db, 10) + 8)
+    silent = db < threshold
+
+    # Центры всех пауз длиннее min_silence (в сэмплах)
+    min_frames = max(1, int(min_silence * 1000 / frame_ms))
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    long_pauses = (ends - starts) >= min_frames
+    candidates = ((starts[long_pauses] + ends[long_pauses]) // 2) * frame
+
+    points = []
+    position = 0
+    while len(audio) - position > chunk * 1.5:
+        target = position + chunk
+        window = candidates[(candidates > position + chunk // 2) & (candidates < position + chunk * 3 // 2)]
+        # Нет паузы рядом - режем жестко по границе
+        cut = int(window[np.argmin(np.abs(window - target))]) if len(window) else target
+        points.append(cut)
+        position = cut
+
+    return points
@@ -0,0 +1,116 @@
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Грубая оценка для Gemini/GPT-подобных токенизаторов: ~4 символа на токен
+CHARS_PER_TOKEN = 4
+
+# "Сильный" конец предложения (как в AudioProcessor.create_batches)
+SENTENCE_END = re.compile(r"[.!?][\"']?$")
+
+
+def estimate_tokens(text):
+    """Локальная оценка числа токенов без обращения к API."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def compact_segments(segments):
+    """
+    Сегменты в том виде, в каком их видит модель: только id и текст,
+    JSON без отступов. Тайминги и прочие поля модели не нужны.
+    """
+    payload = [{"segment_id": seg["segment_id"], "text": seg["text"]} for seg in segments]
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+class BatchPlanner:
+    """
+    Упаковывает сегменты в минимальное число запросов под бюджет контекста.
+
+    Батч закрывается только на конце предложения: предложения целиком
+    жадно складываются в текущий батч, пока оценка промпта + ответа
+    помещается в context_tokens.
+    """
+
+    def __init__(self, context_tokens=8000, prompt_overhead_tokens=0,
+                 output_tokens_per_segment=40, max_segments=80):
+        """
+        Args:
+            context_tokens: Бюджет на один запрос (вход + ожидаемый ответ)
+            prompt_overhead_tokens: Токены шаблона промпта без сегментов
+            output_tokens_per_segment: Оценка размера ответа на один сегмент
+            max_segments: Жесткий потолок сегментов в батче (длинный ответ чаще ломается)
+        """
+        self.context_tokens = context_tokens
+        self.prompt_overhead_tokens = prompt_overhead_tokens
+        self.output_tokens_per_segment = output_tokens_per_segment
+        self.max_segments = max_segments
+
+    def estimate_batch_tokens(self, segments):
+        """Оценка полного запроса (шаблон + сегменты + ответ) для списка сегментов."""
+        return (
+            self.prompt_overhead_tokens
+            + estimate_tokens(compact_segments(segments))
+            + self.output_tokens_per_segment * len(segments)
+        )
+
+    def _split_sentences(self, segments):
+        sentences = []
+        current = []
+        for seg in segments:
+            current.append(seg)
+            if SENTENCE_END.search(seg["text"].strip()):
+                sentences.append(current)
+                current = []
+        if current:
+            sentences.append(current)
+        return sentences
+
+    def plan(self, segments):
+        """
+        Returns:
+            list: Батчи в формате transcript.json ({batch_id, context_text, segments})
+        """
+        batches = []
+        current = []
+
+        for sentence in self._split_sentences(segments):
+            candidate = current + sentence
+            fits = (
+                self.estimate_batch_tokens(candidate) <= self.context_tokens
+                and len(candidate) <= self.max_segments
+            )
+            if current and not fits:
+                batches.append(current)
+                current = list(sentence)
+            else:
+                current = candidate
+
+        if current:
+            batches.append(current)
+
+        return [
+            {
+                "batch_id": i,
+                "context_text": " ".join(seg["text"] for seg in batch_segments),
+                "segments": batch_segments
+            }
+            for i, batch_segments in enumerate(batches)
+        ]
+
+    def report(self, before_batches, before_tokens, after_batches):
+        """Логирует число запросов и оценку токенов до/после планирования."""
+        after_tokens = sum(self.estimate_batch_tokens(b["segments"]) for b in after_batches)
+        logger.info(
+            f"🧮 Batch plan: {len(before_batches)} requests / ~{before_tokens} tokens "
+            f"-> {len(after_batches)} requests / ~{after_tokens} tokens "
+            f"(budget {self.context_tokens}/request)"
+        )
+        return {
+            "requests_before": len(before_batches),
+            "tokens_before": before_tokens,
+            "requests_after": len(after_batches),
+            "tokens_after": after_tokens
+        }
@@ -1,16 +1,51 @@
 import json
+import difflib
+import hashlib
 import logging
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from src.utils.gemini_client import GeminiClient
+from src.utils.rate_limiter import TokenBucket
+from src.analysis.batch_planner import BatchPlanner, compact_segments, estimate_tokens
+from src.analysis.shot_parser import salvage_json_objects, assign_shots, validate_shot
 
 logger = logging.getLogger(__name__)
 
+# Поля сегмента транскрипта; все остальное в шоте - "визуал" от модели
+SEGMENT_KEYS = {"segment_id", "start", "end", "duration", "text", "target_duration"}
+
+# Запрос-заглушка для батчей, которые модель не осилила
+FALLBACK_QUERY = "scene form movie"
+
+# Сколько соседних сегментов с каждой стороны показывать модели при частичной пересборке батча
+CONTEXT_NEIGHBOURS = 2
+
 class DirectorAgent:
-    def __init__(self, library_path):
+    def __init__(self, library_path, concurrency=4, requests_per_minute=60,
+                 context_tokens=8000, output_tokens_per_segment=40, repair_attempts=1):
+        """
+        Args:
+            library_path: Путь к библиотеке фильмов
+            concurrency: Сколько батчей одновременно "в полете"
+            requests_per_minute: Стартовый лимит запросов (адаптируется к 429)
+            context_tokens: Бюджет токенов на один запрос (None - батчи транскрипта как есть)
+            output_tokens_per_segment: Оценка размера ответа на один сегмент
+            repair_attempts: Сколько раз переспрашивать недостающие сегменты батча
+        """
         self.library_path = Path(library_path)
+        self.concurrency = max(1, int(concurrency))
+        self.context_tokens = context_tokens
+        self.output_tokens_per_segment = output_tokens_per_segment
+        self.repair_attempts = repair_attempts
+        self.repair_stats = {"requests": 0, "tokens_saved": 0}
+        self._journal_lock = threading.Lock()
         # Инициализируем нашего клиента с Retry-логикой
         try:
-            self.client = GeminiClient(model_name="gemini-2.0-flash")
+            self.client = GeminiClient(
+                model_name="gemini-2.0-flash",
+                rate_limiter=TokenBucket(requests_per_minute / 60.0, capacity=self.concurrency)
+            )
             self.ready = True
         except Exception as e:
             logger.error(f"❌ Director Agent failed to init Gemini: {e}")
@@ -29,12 +64,251 @@ class DirectorAgent:
                     # data = {"person_0": "Mikael", ...}
                     names = [n for n in data.values() if n != "Unknown"]
                     all_chars.update(names)
-        
-        return list(all_chars)
 
-    def process(self, transcript_path, output_path, sources):
+        # Сортируем: порядок должен быть стабильным между запусками (хэш журнала, кэш)
+        return sorted(all_chars)
+
+    def _build_prompt(self, batch, available_chars, context_text=None):
+        segments = batch['segments'] # Список фраз в этом батче
+
+        # Соседний текст при частичной пересборке: шоты для него уже есть
+        context = ""
+        if context_text:
+            context = f"""
+Surrounding text (context only, do NOT create shots for it): {json.dumps(context_text, ensure_ascii=False)}
+"""
+
+        # Модели нужны только id и текст сегментов, в компактном JSON:
+        # тайминги, отступы и дубль текста в "Input Text Block" - это лишние токены
+        return f"""Role: Expert Film Editor & Director.
+Task: Create a visual shot list for a video essay based on the provided text segments.
+Context: The video is about the movie(s) containing these characters: {json.dumps(available_chars, ensure_ascii=False)}.
+
+Segments to visualize (in order, read them as one continuous text):
+{compact_segments(segments)}
+{context}
+Instructions:
+1. For EACH segment, define the best visual shot.
+2. **Visual Query**: Describe the visual content for CLIP search (e.g., "man typing on laptop", "dark snowy street").
+3. **Shot Type**: Choose one [Close-Up, Medium Shot, Wide Angle, Extreme Close-Up]. VARY THEM! Don't use the same type 3 times in a row.
+4. **Character**: Choose a character from the list provided above IF relevant. If the text is abstract or about atmosphere, set "character": null (for B-Roll).
+5. **Mood**: One word (e.g., Tense, Calm, Dark, Happy).
+
+Output Format: Return ONLY a JSON list of objects matching the segments count.
+Example: [{{"segment_id":0,"visual_query":"Mikael Blomkvist smoking cigarette","shot_type":"Close-Up","character":"Mikael Blomkvist","mood":"Tense"}}]
+"""
+
+    def plan_batches(self, batches, available_chars):
+        """
+        Перепаковывает батчи транскрипта под бюджет контекста (BatchPlanner).
+        Шаблон промпта зависит от каста, поэтому планируем здесь, а не в AudioProcessor.
+        """
+        overhead = estimate_tokens(self._build_prompt({"segments": []}, available_chars))
+        planner = BatchPlanner(
+            context_tokens=self.context_tokens,
+            prompt_overhead_tokens=overhead,
+            output_tokens_per_segment=self.output_tokens_per_segment
+        )
+
+        segments = [seg for batch in batches for seg in batch['segments']]
+        planned = planner.plan(segments)
+
+        # "До": старый промпт слал полные сегменты с indent=2 + дубль текста батча
+        legacy_tokens = sum(
+            overhead
+            + estimate_tokens(json.dumps(b['segments'], indent=2))
+            + estimate_tokens(b.get('context_text', ''))
+            + self.output_tokens_per_segment * len(b['segments'])
+            for b in batches
+        )
+        planner.report(batches, legacy_tokens, planned)
+        return planned
+
+    # ------------------------------------------------------------------
+    # Journal (чекпоинты по батчам)
+    # ------------------------------------------------------------------
+
+    def _journal_path(self, output_path):
+        output_path = Path(output_path)
+        return output_path.with_name(f"{output_path.stem}.journal.jsonl")
+
+    def _batch_hash(self, prompt):
+        """Хэш входа батча: если текст/сегменты/каст поменялись - батч пересчитывается."""
+        return hashlib.sha256(f"{self.client.provider.name}:{self.client.model_name}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _load_journal(self, journal_path):
+        """{batch_id: {"input_hash": ..., "shots": [...]}} - последняя запись побеждает."""
+        journal = {}
+        if not journal_path.exists():
+            return journal
+
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    journal[entry["batch_id"]] = entry
+                except (ValueError, KeyError):
+                    # Оборванная последняя строка после падения - просто игнорируем
+                    continue
+        return journal
+
+    def _append_journal(self, journal_path, batch_id, input_hash, shots):
+        line = json.dumps({"batch_id": batch_id, "input_hash": input_hash, "shots": shots}, ensure_ascii=False)
+        with self._journal_lock:
+            with open(journal_path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+                f.flush()
+
+    # ------------------------------------------------------------------
+    # Incremental (переиспользование прошлого script.json)
+    # ------------------------------------------------------------------
+
+    def _normalize_text(self, text):
+        return " ".join(text.lower().split())
+
+    def _reuse_shots(self, segments, old_shots, available_chars):
+        """
+        Визуал старых шотов поверх актуальных сегментов (новые тайминги и id).
+        Шот проверяется по текущему касту: персонаж удаленного фильма -> B-Roll.
+        """
+        shots = []
+        for seg, old in zip(segments, old_shots):
+            merged = seg.copy()
+            visual = validate_shot(old, available_chars) or old
+            merged.update({k: v for k, v in visual.items() if k not in SEGMENT_KEYS})
+            shots.append(merged)
+        return shots
+
+    def align_previous(self, segments, previous_script, available_chars=None):
+        """
+        Выравнивает новые сегменты со старым сценарием по тексту (difflib).
+
+        Returns:
+            dict: {индекс нового сегмента: старый шот} для неизмененных сегментов
+                  (с валидным визуалом - невалидные шоты идут в модель заново)
+        """
+        if not previous_script:
+            return {}
+
+        old_texts = [self._normalize_text(shot.get("text", "")) for shot in previous_script]
+        new_texts = [self._normalize_text(seg["text"]) for seg in segments]
+
+        matcher = difflib.SequenceMatcher(None, old_texts, new_texts, autojunk=False)
+        matched = {}
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                for offset in range(i2 - i1):
+                    old_shot = previous_script[i1 + offset]
+                    # Заглушки прошлого запуска не переиспользуем - пусть модель попробует снова
+                    if old_shot.get("visual_query") == FALLBACK_QUERY:
+                        continue
+                    if available_chars is not None and validate_shot(old_shot, available_chars) is None:
+                        continue
+                    matched[j1 + offset] = old_shot
+
+        logger.info(f"🔁 Text alignment: {len(matched)}/{len(segments)} segments unchanged since last run.")
+        return matched
+
+    def _context_text(self, segments, indices, previous):
+        """Текст неизмененных соседей правок (CONTEXT_NEIGHBOURS с каждой стороны)."""
+        changed = [i for i in indices if i not in previous]
+        around = set()
+        for i in changed:
+            around.update(range(max(0, i - CONTEXT_NEIGHBOURS), min(len(segments), i + CONTEXT_NEIGHBOURS + 1)))
+        return " ".join(segments[i]['text'] for i in sorted(around) if i in previous)
+
+    def _load_previous_script(self, output_path):
+        output_path = Path(output_path)
+        if not output_path.exists():
+            return []
+        try:
+            with open(output_path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Previous script unreadable, full rerun: {e}")
+            return []
+
+    # ------------------------------------------------------------------
+    # Directing
+    # ------------------------------------------------------------------
+
+    def _request_shots(self, batch_id, prompt, segments, available_chars):
+        """Один запрос к модели -> {segment_id: валидный шот} (что удалось спасти)."""
+        def parse(text):
+            return assign_shots(segments, salvage_json_objects(self.client.parse_json(text)), available_chars)
+
+        try:
+            # В кэш попадают только ответы, покрывшие все сегменты: оборванный
+            # ответ не должен переигрываться при каждой пересборке
+            response = self.client.generate_content(prompt, validate=lambda text: len(parse(text)) == len(segments))
+            return parse(response.text)
+        except Exception as e:
+            logger.error(f"❌ Error directing batch {batch_id}: {e}")
+            return {}
+
+    def _direct_batch(self, batch, available_chars, prompt=None):
+        """
+        Один батч -> (список шотов, ok). Вызывается из пула потоков.
+
+        Валидные шоты спасаются даже из оборванного ответа. Недостающие или
+        невалидные сегменты уходят в модель одним маленьким повторным
+        запросом, а не всем батчем. ok=False означает, что хотя бы один
+        сегмент остался на fallback и батч не стоит журналировать.
+        """
+        batch_id = batch['batch_id']
+        segments = batch['segments']
+        if prompt is None:
+            prompt = self._build_prompt(batch, available_chars)
+
+        shots = self._request_shots(batch_id, prompt, segments, available_chars)
+        missing = [seg for seg in segments if seg['segment_id'] not in shots]
+
+        full_tokens = estimate_tokens(prompt)
+        repairs = 0
+        while missing and repairs < self.repair_attempts:
+            repairs += 1
+            repair_prompt = self._build_prompt({"segments": missing}, available_chars)
+            saved = full_tokens - estimate_tokens(repair_prompt)
+            logger.info(f"🩹 Batch {batch_id}: re-asking {len(missing)}/{len(segments)} segments (~{saved} tokens saved vs full resend)")
+            self._record_repair(saved)
+
+            shots.update(self._request_shots(batch_id, repair_prompt, missing, available_chars))
+            missing = [seg for seg in segments if seg['segment_id'] not in shots]
+
+        # Сохраняем оригинальные данные сегмента (таймкоды) + визуал.
+        # Fallback только для сегментов, которые так и не удалось получить (Матчер разберется)
+        merged_shots = []
+        for seg in segments:
+            merged = seg.copy()
+            if seg['segment_id'] in shots:
+                merged.update(shots[seg['segment_id']])
+            else:
+                merged["visual_query"] = FALLBACK_QUERY
+                merged["shot_type"] = "Medium Shot"
+            merged_shots.append(merged)
+
+        if missing:
+            logger.warning(f"⚠️ Batch {batch_id}: {len(missing)} segments fell back to generic shots.")
+            return merged_shots, False
+
+        logger.info(f"✅ Batch {batch_id} visualized.")
+        return merged_shots, True
+
+    def _record_repair(self, tokens_saved):
+        with self._journal_lock:
+            self.repair_stats["requests"] += 1
+            self.repair_stats["tokens_saved"] += max(0, tokens_saved)
+
+    def process(self, transcript_path, output_path, sources, should_stop=None):
+        """
+        should_stop - функция без аргументов: True - не отправлять новые батчи.
+        Готовые батчи остаются в журнале, следующий запуск продолжит с них.
+
+        Returns:
+            bool: True, если script.json записан
+        """
         if not self.ready:
-            return
+            return False
 
         transcript_path = Path(transcript_path)
         with open(transcript_path, 'r') as f:
@@ -44,75 +318,108 @@ class DirectorAgent:
         available_chars = self.get_available_characters(sources)
         logger.info(f"🎭 Director knows these actors: {available_chars}")
 
-        visual_script = []
-        
-        logger.info(f"🎬 Director is visualizing {len(batches)} batches...")
+        if self.context_tokens:
+            batches = self.plan_batches(batches, available_chars)
+
+        # 2. Прошлый сценарий (инкрементальная сборка) и журнал прерванного запуска:
+        # готовые батчи не трогаем, только обновляем им тайминги
+        segments = [seg for batch in batches for seg in batch['segments']]
+        previous = self.align_previous(segments, self._load_previous_script(output_path), available_chars)
+        journal_path = self._journal_path(output_path)
+        journal = self._load_journal(journal_path)
 
+        results = {}
+        pending = []
+        reused = restored = partial = 0
+        position = 0
         for batch in batches:
-            batch_id = batch['batch_id']
-            segments = batch['segments'] # Список фраз в этом батче
-            context_text = batch['context_text']
-
-            # 2. Формируем Промпт
-            prompt = f"""
-            Role: Expert Film Editor & Director.
-            Task: Create a visual shot list for a video essay based on the provided text segments.
-            
-            Context: The video is about the movie(s) containing these characters: {available_chars}.
-            
-            Input Text Block: "{context_text}"
-            
-            Segments to visualize:
-            {json.dumps(segments, indent=2)}
-            
-            Instructions:
-            1. For EACH segment, define the best visual shot.
-            2. **Visual Query**: Describe the visual content for CLIP search (e.g., "man typing on laptop", "dark snowy street").
-            3. **Shot Type**: Choose one [Close-Up, Medium Shot, Wide Angle, Extreme Close-Up]. VARY THEM! Don't use the same type 3 times in a row.
-            4. **Character**: Choose a character from the list provided above IF relevant. If the text is abstract or about atmosphere, set "character": null (for B-Roll).
-            5. **Mood**: One word (e.g., Tense, Calm, Dark, Happy).
-            
-            Output Format: Return ONLY a JSON list of objects matching the segments count.
-            Example:
-            [
-              {{
-                "segment_id": 0,
-                "visual_query": "Mikael Blomkvist smoking cigarette",
-                "shot_type": "Close-Up",
-                "character": "Mikael Blomkvist",
-                "mood": "Tense"
-              }},
-              ...
-            ]
-            """
-
-            try:
-                # Отправляем в Gemini
-                response = self.client.generate_content(prompt)
-                json_str = self.client.parse_json(response.text)
-                shot_list = json.loads(json_str)
-                
-                # Валидация: проверим, что кол-во шотов совпадает с кол-вом сегментов
-                # Если Gemini ошибся и вернул меньше/больше, мы просто привяжем по порядку
-                for i, shot in enumerate(shot_list):
-                    if i < len(segments):
-                        # Сохраняем оригинальные данные сегмента (таймкоды) + визуал
-                        merged = segments[i].copy()
-                        merged.update(shot)
-                        visual_script.append(merged)
-                
-                logger.info(f"✅ Batch {batch_id} visualized.")
-
-            except Exception as e:
-                logger.error(f"❌ Error directing batch {batch_id}: {e}")
-                # Fallback: Если ИИ сломался, добавляем сегмент без визуала (Матчер разберется)
-                for seg in segments:
-                    seg["visual_query"] = "scene form movie"
-                    seg["shot_type"] = "Medium Shot"
-                    visual_script.append(seg)
-
-        # 3. Сохраняем результат
+            batch_segments = batch['segments']
+            indices = range(position, position + len(batch_segments))
+            position += len(batch_segments)
+
+            if all(i in previous for i in indices):
+                results[batch['batch_id']] = self._reuse_shots(batch_segments, [previous[i] for i in indices], available_chars)
+                reused += 1
+                continue
+
+            # Правка пары фраз не пересобирает весь батч: в модель уходят только
+            # измененные сегменты (с соседями для контекста), остальное - старые шоты
+            kept = {
+                segments[i]['segment_id']: self._reuse_shots([segments[i]], [previous[i]], available_chars)[0]
+                for i in indices if i in previous
+            }
+            if kept:
+                changed = [segments[i] for i in indices if i not in previous]
+                target = {"batch_id": batch['batch_id'], "segments": changed}
+                prompt = self._build_prompt(target, available_chars, self._context_text(segments, indices, previous))
+                partial += 1
+            else:
+                target = batch
+                prompt = self._build_prompt(batch, available_chars)
+
+            input_hash = self._batch_hash(prompt)
+            entry = journal.get(batch['batch_id'])
+            if entry and entry.get("input_hash") == input_hash:
+                results[batch['batch_id']] = self._reuse_shots(batch_segments, entry["shots"], available_chars)
+                restored += 1
+            else:
+                pending.append((batch, target, kept, prompt, input_hash))
+
+        if reused or restored:
+            logger.info(
+                f"♻️ Reused {reused} batches from previous script, {restored} from journal, "
+                f"{len(pending)} to direct ({partial} of them only for changed segments)."
+            )
+
+        logger.info(f"🎬 Director is visualizing {len(pending)} batches ({self.concurrency} in flight)...")
+
+        # 3. Рассылаем батчи параллельно; TokenBucket в клиенте держит общий лимит.
+        # Каждый успешный батч сразу пишется в журнал.
+        def run(batch, target, kept, prompt, input_hash):
+            if should_stop and should_stop():
+                return None
+            directed, ok = self._direct_batch(target, available_chars, prompt)
+            # Собираем батч целиком в исходном порядке: новые шоты + сохраненные
+            by_id = dict(kept)
+            by_id.update((shot['segment_id'], shot) for shot in directed)
+            shots = [by_id[seg['segment_id']] for seg in batch['segments']]
+            if ok:
+                self._append_journal(journal_path, batch['batch_id'], input_hash, shots)
+            return shots
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {
+                pool.submit(run, *task): task[0]['batch_id']
+                for task in pending
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+        if should_stop and should_stop():
+            logger.warning("🛑 Director stopped on request, finished batches are kept in the journal")
+            return False
+
+        # Собираем обратно строго в порядке batch_id
+        visual_script = []
+        for batch_id in sorted(results):
+            visual_script.extend(results[batch_id])
+
+        if self.repair_stats["requests"]:
+            logger.info(
+                f"🩹 Repair requests: {self.repair_stats['requests']}, "
+                f"~{self.repair_stats['tokens_saved']} tokens saved vs whole-batch resends"
+            )
+
+        # 4. Сохраняем результат
         with open(output_path, 'w') as f:
             json.dump(visual_script, f, indent=2)
-            
-        logger.info(f"📜 Visual Script saved to {output_path}")
\ No newline at end of file
+
+        # Журнал нужен только до записи сценария: дальше инкрементальная сборка
+        # опирается на сам script.json, а append-only файл рос бы с каждой сборкой
+        try:
+            journal_path.unlink()
+        except FileNotFoundError:
+            pass
+
+        logger.info(f"📜 Visual Script saved to {output_path}")
+        return True
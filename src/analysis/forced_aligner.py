@@ -0,0 +1,166 @@
+import logging
+import torch
+import whisper
+from whisper.audio import N_FRAMES, N_SAMPLES, HOP_LENGTH, SAMPLE_RATE
+from whisper.timing import find_alignment
+from whisper.tokenizer import get_tokenizer
+
+from src.analysis.word_timing import group_by_script_words
+
+logger = logging.getLogger(__name__)
+
+# Кадров mel в секунду (100 при HOP_LENGTH=160)
+FRAMES_PER_SECOND = SAMPLE_RATE // HOP_LENGTH
+WINDOW_SECONDS = N_FRAMES / FRAMES_PER_SECOND  # 30 сек
+# Верхняя граница оценки темпа: быстрее дикторы не говорят, а бюджет окна от нее растет
+MAX_WORDS_PER_SECOND = 6.0
+
+
+class ForcedAligner:
+    """
+    Выравнивание заранее известного текста по аудио без декодирования.
+
+    Использует DTW по cross-attention Whisper (whisper.timing.find_alignment)
+    окнами по 30 секунд: в окно подается кусок текста с запасом, принимаются
+    только слова, надежно закончившиеся до конца окна, следующее окно
+    начинается с конца последнего принятого слова. Распознавание не
+    запускается, поэтому слова никогда не "ослышиваются".
+    """
+
+    def __init__(self, model, language=None, words_per_second=2.5, tail_margin=3.0):
+        """
+        Args:
+            model: Загруженная модель Whisper
+            language: Код языка текста (None - определить по первому окну)
+            words_per_second: Стартовая оценка темпа речи (дальше адаптируется)
+            tail_margin: Слова, заканчивающиеся ближе к концу окна, переносятся в следующее
+        """
+        self.model = model
+        self.language = language
+        self.words_per_second = words_per_second
+        self.tail_margin = tail_margin
+
+    def _tokenizer(self, mel_window):
+        language = self.language
+        if language is None and self.model.is_multilingual:
+            _, probs = self.model.detect_language(mel_window.to(self.model.device))
+            language = max(probs, key=probs.get)
+            self.language = language
+            logger.info(f"🌐 Script language detected: {language}")
+
+        return get_tokenizer(
+            self.model.is_multilingual,
+            num_languages=self.model.num_languages,
+            language=language,
+            task="transcribe"
+        )
+
+    def _absolute(self, word, window_start):
+        return {
+            "word": word["word"],
+            "start": round(window_start + word["start"], 3),
+            "end": round(window_start + word["end"], 3),
+            "probability": word["probability"]
+        }
+
+    def align(self, audio, text):
+        """
+        Args:
+            audio: float32 моно 16 kHz (whisper.load_audio)
+            text: Полный текст, который был зачитан
+
+        Returns:
+            list: Сегменты в формате model.transcribe(..., word_timestamps=True)
+        """
+        words = text.split()
+        if not words:
+            return []
+
+        mel = whisper.log_mel_spectrogram(audio, self.model.dims.n_mels, padding=N_SAMPLES)
+        content_frames = mel.shape[-1] - N_FRAMES
+        total_seconds = len(audio) / SAMPLE_RATE
+
+        tokenizer = self._tokenizer(whisper.pad_or_trim(mel[:, :N_FRAMES], N_FRAMES))
+        # find_alignment добавляет sot_sequence, no_timestamps и eot к токенам текста
+        max_text_tokens = self.model.dims.n_text_ctx - len(tokenizer.sot_sequence) - 2
+
+        segments = []
+        word_idx = 0
+        window_start = 0.0
+
+        while word_idx < len(words) and window_start < total_seconds:
+            frame = int(window_start * FRAMES_PER_SECOND)
+            num_frames = min(N_FRAMES, content_frames - frame)
+            if num_frames <= 0:
+                break
+
+            window_end = window_start + num_frames / FRAMES_PER_SECOND
+            is_last_window = window_end >= total_seconds - 0.01
+
+            # Текст с запасом ~30% к ожидаемому темпу; на последнем окне - вдвое больше
+            budget = int(self.words_per_second * WINDOW_SECONDS * 1.3) + 1
+            if is_last_window:
+                budget *= 2
+
+            # ...но не больше, чем влезет в контекст декодера (кириллица - несколько
+            # BPE-токенов на слово). Не влезшие слова уходят в следующее окно.
+            text_tokens = []
+            token_counts = []  # токенов на слово сценария - для склейки пунктуации
+            chunk_size = 0
+            for word in words[word_idx:word_idx + budget]:
+                word_tokens = tokenizer.encode(" " + word)
+                if len(text_tokens) + len(word_tokens) > max_text_tokens:
+                    break
+                text_tokens.extend(word_tokens)
+                token_counts.append(len(word_tokens))
+                chunk_size += 1
+            if chunk_size == 0:
+                # Одно "слово" длиннее всего контекста: выравнивать нечего, пропускаем
+                logger.warning(f"⚠️ Forced alignment: word too long for the decoder context, skipped: {words[word_idx][:40]}")
+                word_idx += 1
+                continue
+            truncated = word_idx + chunk_size < len(words) and chunk_size < budget
+            # Обрезанное последнее окно принимает слова как обычное: остаток выровняется дальше
+            accept_all = is_last_window and not truncated
+
+            mel_window = whisper.pad_or_trim(mel[:, frame:frame + N_FRAMES], N_FRAMES).to(self.model.device)
+
+            with torch.no_grad():
+                timings = find_alignment(self.model, tokenizer, text_tokens, mel_window, num_frames)
+
+            # Одна запись на слово сценария: иначе отдельные "," и "." сдвигали бы word_idx
+            aligned = group_by_script_words(timings, token_counts)
+
+            accepted = []
+            for word in aligned:
+                if not accept_all and word["end"] > WINDOW_SECONDS - self.tail_margin:
+                    break
+                accepted.append(self._absolute(word, window_start))
+
+            # Гарантируем прогресс, даже если окно целиком "съела" музыка/пауза
+            if not accepted and aligned:
+                accepted.append(self._absolute(aligned[0], window_start))
+
+            if not accepted:
+                window_start = window_end
+                continue
+
+            segments.append({
+                "start": accepted[0]["start"],
+                "end": accepted[-1]["end"],
+                "text": "".join(w["word"] for w in accepted),
+                "words": accepted
+            })
+
+            # Адаптируем темп речи по принятым словам
+            spoken = accepted[-1]["end"] - window_start
+            if spoken > 1.0:
+                self.words_per_second = min(MAX_WORDS_PER_SECOND, max(1.0, len(accepted) / spoken))
+
+            word_idx += len(accepted)
+            window_start = accepted[-1]["end"]
+
+        if word_idx < len(words):
+            logger.warning(f"⚠️ Forced alignment: {len(words) - word_idx} trailing words did not fit the audio.")
+
+        return segments
@@ -0,0 +1,117 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SHOT_TYPES = ["Close-Up", "Medium Shot", "Wide Angle", "Extreme Close-Up"]
+_SHOT_TYPES_LOWER = {s.lower(): s for s in SHOT_TYPES}
+
+
+def salvage_json_objects(text):
+    """
+    Достает все валидные JSON-объекты из ответа модели, даже если он
+    оборван посередине (лимит токенов, обрыв стрима) или обернут в мусор.
+
+    Returns:
+        list: Объекты (dict) в порядке появления
+    """
+    try:
+        data = json.loads(text)
+        if isinstance(data, list):
+            return [obj for obj in data if isinstance(obj, dict)]
+        if isinstance(data, dict):
+            # {"shots": [...]} и похожие обертки: сначала "shots", иначе первый
+            # список объектов (а не {"notes": ["..."]}, стоящий раньше)
+            shots = data.get("shots")
+            if isinstance(shots, list):
+                return [obj for obj in shots if isinstance(obj, dict)]
+            for value in data.values():
+                if isinstance(value, list) and any(isinstance(obj, dict) for obj in value):
+                    return [obj for obj in value if isinstance(obj, dict)]
+            return [data]
+    except ValueError:
+        pass
+
+    decoder = json.JSONDecoder()
+    objects = []
+    pos = 0
+    while True:
+        start = text.find("{", pos)
+        if start == -1:
+            break
+        try:
+            obj, end = decoder.raw_decode(text, start)
+        except ValueError:
+            # Оборванный объект - пробуем со следующей скобки
+            pos = start + 1
+            continue
+        if isinstance(obj, dict):
+            objects.append(obj)
+        pos = end
+
+    return objects
+
+
+def validate_shot(shot, available_chars):
+    """
+    Проверяет шот по схеме и мягко чинит то, что можно починить локально.
+
+    Returns:
+        dict | None: Нормализованный шот или None, если шот невалиден
+    """
+    query = shot.get("visual_query")
+    if not isinstance(query, str) or not query.strip():
+        return None
+
+    shot_type = shot.get("shot_type")
+    if not isinstance(shot_type, str) or not shot_type.strip():
+        return None
+
+    clean = dict(shot)
+    clean["visual_query"] = query.strip()
+    clean["shot_type"] = _SHOT_TYPES_LOWER.get(shot_type.strip().lower(), shot_type.strip())
+
+    # Персонаж вне каста дает -500 на каждой сцене в матчере -> считаем это B-Roll
+    character = shot.get("character")
+    if not isinstance(character, str) or character not in available_chars:
+        clean["character"] = None
+
+    if not isinstance(clean.get("mood"), str):
+        clean.pop("mood", None)
+
+    return clean
+
+
+def assign_shots(segments, objects, available_chars):
+    """
+    Раскладывает объекты ответа по сегментам.
+
+    Сначала по segment_id; объекты без (валидного) id раскладываются по
+    порядку, только если их ровно столько, сколько сегментов без шота.
+
+    Returns:
+        dict: {segment_id: валидный шот}
+    """
+    wanted = {seg["segment_id"] for seg in segments}
+    assigned = {}
+    anonymous = []
+
+    for obj in objects:
+        seg_id = obj.get("segment_id")
+        if isinstance(seg_id, int) and seg_id in wanted:
+            if seg_id not in assigned:
+                shot = validate_shot(obj, available_chars)
+                if shot is not None:
+                    assigned[seg_id] = shot
+        else:
+            anonymous.append(obj)
+
+    remaining = [seg for seg in segments if seg["segment_id"] not in assigned]
+    if anonymous and len(anonymous) == len(remaining):
+        for seg, obj in zip(remaining, anonymous):
+            shot = validate_shot(obj, available_chars)
+            if shot is not None:
+                shot["segment_id"] = seg["segment_id"]
+                assigned[seg["segment_id"]] = shot
+
+    return assigned
@@ -0,0 +1,37 @@
+def group_by_script_words(timings, token_counts):
+    """
+    Склеивает "слова" whisper.timing.find_alignment обратно в слова сценария.
+
+    find_alignment режет токены через split_tokens_on_spaces: знаки
+    препинания (",", ".", "—") приходят отдельными "словами", а склеивает
+    их только add_word_timestamps, которую выравнивание не вызывает. Слово
+    сценария кодируется отдельно (" " + word), поэтому его токены идут
+    подряд и число токенов на слово известно: по нему и собираем группы.
+
+    Args:
+        timings: WordTiming из find_alignment (поля word, tokens, start, end, probability)
+        token_counts: Число токенов каждого слова сценария, в том же порядке
+
+    Returns:
+        list: [{"word", "start", "end", "probability"}] - по слову сценария
+              (время в секундах от начала окна), как в model.transcribe
+    """
+    words = []
+    timings = iter(timings)
+    for count in token_counts:
+        group = []
+        taken = 0
+        while taken < count:
+            timing = next(timings, None)
+            if timing is None:
+                return words
+            group.append(timing)
+            taken += len(timing.tokens)
+
+        words.append({
+            "word": "".join(t.word for t in group),
+            "start": float(group[0].start),
+            "end": float(group[-1].end),
+            "probability": sum(float(t.probability) for t in group) / len(group)
+        })
+    return words
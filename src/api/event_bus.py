@@ -0,0 +1,144 @@
+import json
+import asyncio
+import logging
+import threading
+from collections import deque, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 500     # логов в очереди одного клиента
+DEFAULT_SEND_TIMEOUT = 5.0    # клиент, не принявший сообщение за это время, отключается
+DEFAULT_REPLAY_SIZE = 100     # сколько последних статусов (по alias) помнит шина
+
+
+class Subscriber:
+    """
+    Очередь одного WebSocket-клиента.
+
+    Логи - ограниченный deque: при переполнении теряются самые старые, о чем
+    клиент узнает сообщением {"type": "dropped"}. Прогресс не копится вовсе:
+    по каждой джобе хранится только последнее значение.
+    """
+
+    def __init__(self, buffer_size):
+        self.logs = deque(maxlen=buffer_size)
+        self.progress = {}   # job key -> последнее событие прогресса
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+    def push(self, progress_key, text):
+        if progress_key is not None:
+            self.progress[progress_key] = text
+        else:
+            if len(self.logs) == self.logs.maxlen:
+                self.dropped += 1
+            self.logs.append(text)
+        self.ready.set()
+
+    def drain(self):
+        messages = []
+        if self.dropped:
+            messages.append(json.dumps({"type": "dropped", "count": self.dropped}))
+            self.dropped = 0
+        messages.extend(self.logs)
+        messages.extend(self.progress.values())
+        self.logs.clear()
+        self.progress.clear()
+        self.ready.clear()
+        return messages
+
+
+class EventBus:
+    """
+    Широковещательная шина событий для /ws/logs.
+
+    publish() можно звать из любого потока (логгер, колбэки ingest/build):
+    события копятся в общем буфере, а в event loop уходит один
+    call_soon_threadsafe на пачку. Дальше каждое событие раскладывается
+    по очередям всех подписчиков - клиенты больше не делят одну очередь.
+    Последний прогресс каждого alias запоминается даже без подписчиков и
+    отдается новому клиенту сразу: переподключившийся UI не теряет
+    финальный статус ("done"/"failed"), пришедший, пока его не было.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, send_timeout=DEFAULT_SEND_TIMEOUT,
+                 replay_size=DEFAULT_REPLAY_SIZE):
+        self.buffer_size = buffer_size
+        self.send_timeout = send_timeout
+        self.replay_size = replay_size
+        self.subscribers = set()
+        self._last_status = OrderedDict()  # alias -> последнее событие прогресса (JSON)
+
+        self._loop = None
+        self._pending = deque()
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+
+    def attach(self, loop):
+        """Привязывает шину к event loop сервера (на старте приложения)."""
+        self._loop = loop
+
+    def publish(self, message):
+        """message - dict с полем "type" ("log", "progress", ...)."""
+        progress_key = message.get("alias") if message.get("type") == "progress" else None
+        loop = self._loop
+        if progress_key is None and (loop is None or not self.subscribers):
+            return
+
+        # Сериализуем один раз на событие, а не на каждого клиента
+        text = json.dumps(message)
+
+        with self._lock:
+            if progress_key is not None:
+                self._last_status[progress_key] = text
+                self._last_status.move_to_end(progress_key)
+                if len(self._last_status) > self.replay_size:
+                    self._last_status.popitem(last=False)
+            if loop is None or not self.subscribers:
+                return
+            self._pending.append((progress_key, text))
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+
+        try:
+            loop.call_soon_threadsafe(self._flush)
+        except RuntimeError:
+            # Loop уже закрыт (остановка сервера)
+            pass
+
+    def _flush(self):
+        with self._lock:
+            batch = self._pending
+            self._pending = deque()
+            self._flush_scheduled = False
+
+        for sub in self.subscribers:
+            for progress_key, text in batch:
+                sub.push(progress_key, text)
+
+    async def serve(self, send_text):
+        """
+        Отдает события одному клиенту до отключения.
+
+        Args:
+            send_text: корутина отправки строки (websocket.send_text)
+        """
+        sub = Subscriber(self.buffer_size)
+        # Под локом: статус, опубликованный между копией и подпиской, не потеряется
+        with self._lock:
+            for progress_key, text in self._last_status.items():
+                sub.push(progress_key, text)
+            self.subscribers.add(sub)
+        try:
+            while True:
+                await sub.ready.wait()
+                await asyncio.wait_for(self._send_all(send_text, sub.drain()), self.send_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("🐢 WebSocket client too slow, disconnecting")
+        finally:
+            self.subscribers.discard(sub)
+
+    async def _send_all(self, send_text, messages):
+        for text in messages:
+            await send_text(text)
@@ -0,0 +1,216 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from src.utils.job_registry import job_registry
+
+logger = logging.getLogger(__name__)
+
+IMAGES_URL = "http://localhost:8000/images"
+
+
+class LibraryCatalog:
+    """
+    Каталог библиотеки в памяти для GET /library.
+
+    snapshot() только отдает готовый список и ETag - без диска и локов на
+    время чтения. Перечитывает папки фоновый поток: сразу после событий
+    ingest/delete (invalidate) и раз в rescan_interval секунд по mtime
+    файлов (статус индексации, индекс, кэш постера, лица) - на случай
+    изменений в обход сервера. Постеры TMDB ищутся в фоновой очереди
+    TMDBClient и никогда не блокируют запрос.
+    """
+
+    def __init__(self, library_path, tmdb_client=None, rescan_interval=5.0, coalesce_delay=0.2):
+        """
+        Args:
+            library_path: Папка библиотеки
+            tmdb_client: TMDBClient для постеров (опционально)
+            rescan_interval: Период полной проверки mtime, сек
+            coalesce_delay: Пауза после invalidate, чтобы собрать пачку событий прогресса
+        """
+        self.library_path = library_path
+        self.tmdb_client = tmdb_client
+        self.rescan_interval = rescan_interval
+        self.coalesce_delay = coalesce_delay
+
+        self._entries = {}       # alias -> {"stamp", "data"}
+        self._dirty = set()      # alias, которые нужно перечитать вне очереди
+        self._etag = None
+        self._movies = []
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # один проход по диску за раз
+        self._wake = threading.Event()
+        self._worker = None
+
+    # === ПУБЛИЧНОЕ API ===
+
+    def start(self):
+        """Запускает фоновый поток обновления (первый проход - сразу)."""
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._refresh_loop, name="library-catalog", daemon=True)
+        self._worker.start()
+
+    def snapshot(self):
+        """Returns: (etag, список фильмов) - готовый ответ /library."""
+        with self._lock:
+            ready = self._etag is not None
+        if not ready:
+            # Запрос пришел раньше первого фонового прохода
+            self.refresh()
+        with self._lock:
+            return self._etag, self._movies
+
+    def invalidate(self, alias=None):
+        """Пометить фильм (или весь каталог) для перечитывания фоновым потоком."""
+        with self._lock:
+            if alias is None:
+                self._entries.clear()
+            else:
+                self._dirty.add(alias)
+        self._wake.set()
+
+    def refresh(self):
+        """Проверяет mtime папок библиотеки и перечитывает только изменившиеся."""
+        with self._refresh_lock:
+            folders = {}
+            if self.library_path.exists():
+                for folder in self.library_path.iterdir():
+                    if folder.is_dir() and not folder.name.startswith('.'):
+                        folders[folder.name] = folder
+
+            with self._lock:
+                dirty = self._dirty
+                self._dirty = set()
+                entries = dict(self._entries)
+
+            # Диск и job_registry читаются без self._lock: snapshot() не ждет
+            changed = False
+            for alias in list(entries):
+                if alias not in folders:
+                    del entries[alias]
+                    changed = True
+
+            for alias, folder in folders.items():
+                stamp = self._stamp(folder)
+                entry = entries.get(alias)
+                if entry is not None and entry["stamp"] == stamp and alias not in dirty:
+                    continue
+                entries[alias] = {"stamp": stamp, "data": self._read_movie(folder)}
+                changed = True
+
+            with self._lock:
+                if changed or self._etag is None:
+                    self._entries = entries
+                    self._publish()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"⚠️ Library catalog refresh failed: {e}")
+            if self._wake.wait(self.rescan_interval):
+                # Прогресс ingest приходит пачками: перечитываем один раз на пачку
+                time.sleep(self.coalesce_delay)
+            self._wake.clear()
+
+    # === ВНУТРЕННЕЕ ===
+
+    def _stamp(self, folder):
+        stamp = [self._mtime(folder)]
+        for name in (".ingest_status.json", "master_index.json", ".tmdb_cache", "faces"):
+            stamp.append(self._mtime(folder / name))
+        return tuple(stamp)
+
+    def _mtime(self, path):
+        try:
+            return path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _read_movie(self, folder):
+        has_index = (folder / "master_index.json").exists()
+
+        ingest_status = None
+        status_file = folder / ".ingest_status.json"
+        if status_file.exists():
+            try:
+                with open(status_file, 'r') as f:
+                    ingest_status = json.load(f)
+            except: pass
+
+        thumbnail_url = None
+        cache_file = folder / ".tmdb_cache"
+        if cache_file.exists():
+            try:
+                with open(cache_file, 'r') as f:
+                    thumbnail_url = f.read().strip()
+            except: pass
+
+        if not thumbnail_url:
+            self._schedule_poster(folder, has_index)
+
+            faces_dir = folder / "faces"
+            if faces_dir.exists():
+                images = sorted(faces_dir.glob("*.jpg"))
+                if images:
+                    target_img = images[min(5, len(images)-1)]
+                    thumbnail_url = f"{IMAGES_URL}/{folder.name}/faces/{target_img.name}"
+
+        movie_data = {
+            "alias": folder.name,
+            "ready": has_index,
+            "path": str(folder.absolute()),
+            "thumbnail": thumbnail_url
+        }
+
+        # Живой прогресс идущей индексации - из памяти (файл пишется только на смене стадий)
+        job = job_registry.find_active("ingest", folder.name)
+        if job is not None:
+            ingest_status = {"status": job.status_value(), "percent": job.percent, "progress_text": job.text}
+
+        if ingest_status:
+            movie_data["ingest_status"] = ingest_status.get("status", "unknown")
+            movie_data["percent"] = ingest_status.get("percent", 0)
+            movie_data["progress_text"] = ingest_status.get("progress_text", "")
+
+        return movie_data
+
+    def _publish(self):
+        # Вызывается под self._lock
+        self._movies = [self._entries[alias]["data"] for alias in sorted(self._entries)]
+        payload = json.dumps(self._movies, sort_keys=True).encode("utf-8")
+        self._etag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+
+    def _schedule_poster(self, folder, has_index):
+        # Поиск уходит в фоновую очередь TMDBClient; промахи кэшируются там же
+        if self.tmdb_client is None:
+            return
+        self.tmdb_client.prefetch(
+            folder.name,
+            lambda: self._poster_query(folder, has_index),
+            lambda alias, url: self._on_poster(folder, url)
+        )
+
+    def _poster_query(self, folder, has_index):
+        search_query = folder.name
+        if has_index:
+            try:
+                with open(folder / "master_index.json", 'r') as f:
+                    meta = json.load(f)
+                if isinstance(meta, dict):
+                    search_query = meta.get("movie_name", folder.name)
+            except: pass
+        return search_query
+
+    def _on_poster(self, folder, url):
+        if not url or not folder.exists():
+            return
+        with open(folder / ".tmdb_cache", 'w') as f:
+            f.write(url)
+        # Фоновый поток перечитает запись с новым постером
+        self.invalidate(folder.name)
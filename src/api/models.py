@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 class IngestRequest(BaseModel):
@@ -10,6 +10,15 @@ class BuildRequest(BaseModel):
     project_name: str
     sources: List[str] # Список алиасов (["Dragon", "SocialNetwork"])
     audio_path: str
+    script_path: Optional[str] = None # Текст эссе (.txt): forced alignment вместо распознавания
+    incremental: Optional[bool] = None # Перематчить только измененные сегменты (None - из config.yaml)
 
 class ProjectCreateRequest(BaseModel):
-    name: str
\ No newline at end of file
+    name: str
+
+class SearchRequest(BaseModel):
+    query: str
+    character: Optional[str] = None
+    shot_type: Optional[str] = None # "Close-Up", "Medium Shot", ...
+    sources: Optional[List[str]] = None # None - вся библиотека
+    top_k: int = Field(20, ge=1, le=200)
\ No newline at end of file
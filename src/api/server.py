@@ -1,32 +1,42 @@
 import asyncio
+import multiprocessing
+import threading
 import logging
 import json
-import queue # Синхронная очередь
 from pathlib import Path
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, BackgroundTasks, WebSocket, WebSocketDisconnect
+from typing import Optional
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import JSONResponse, Response, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import yaml
 
 from src.project_manager import ProjectManager
-from src.api.models import IngestRequest, BuildRequest, ProjectCreateRequest
+from src.api.models import IngestRequest, BuildRequest, ProjectCreateRequest, SearchRequest
 from src.utils.tmdb_client import TMDBClient
+from src.utils.model_registry import model_registry
+from src.utils.app_paths import get_app_data_dir
+from src.api.library_catalog import LibraryCatalog
+from src.api.event_bus import EventBus
+from src.api.thumbnails import ThumbnailService, DEFAULT_WIDTH
+from src.utils.job_registry import job_registry
+from src.utils.job_executor import JobExecutor
 
-# === ГЛОБАЛЬНАЯ ОЧЕРЕДЬ ===
-msg_queue = queue.Queue()
+# === ШИНА СОБЫТИЙ ===
+# Каждый WebSocket-клиент получает свою копию потока логов и прогресса
+event_bus = EventBus()
 
 # === ЛОГИРОВАНИЕ ===
 class QueueHandler(logging.Handler):
     def emit(self, record):
         try:
-            entry = json.dumps({
+            event_bus.publish({
                 "type": "log",
                 "message": self.format(record),
                 "level": record.levelname
             })
-            msg_queue.put(entry)
         except:
             pass
 
@@ -45,7 +55,51 @@ manager = ProjectManager(BASE_DIR)
 tmdb_key = manager.config.get("api_keys", {}).get("tmdb")
 tmdb_client = TMDBClient(tmdb_key) if tmdb_key else None
 
-app = FastAPI(title="Sculptor AI Backend")
+catalog = LibraryCatalog(manager.library_path, tmdb_client)
+
+thumbnails = ThumbnailService(manager.library_path, get_app_data_dir() / "cache" / "thumbs")
+
+# Открытые хранилища сцен (mmap смещений) для /library/{alias}/scenes
+scene_stores = {}
+
+# Индексы и текстовая модель для /search живут в памяти сервера.
+# Создаются при первом обращении (прогрев на старте - в фоне), чтобы numpy/torch
+# не грузились до того, как сервер ответит на /status
+_scene_search = None
+_scene_search_lock = threading.Lock()
+
+def get_scene_search():
+    global _scene_search
+    with _scene_search_lock:
+        if _scene_search is None:
+            from src.matching.scene_search import SceneSearch
+            _scene_search = SceneSearch(manager.library_path, model_name=manager.config.get("models", {}).get("clip", "ViT-B/32"))
+        return _scene_search
+
+def warm_up():
+    get_scene_search().warm_up()
+
+# Ingest/build идут в отдельных процессах, а не в тредпуле сервера
+jobs_cfg = manager.config.get("jobs", {})
+executor = JobExecutor(
+    BASE_DIR,
+    workers=jobs_cfg.get("workers", 2),
+    slots={"ingest": jobs_cfg.get("ingest_slots", 1), "build": jobs_cfg.get("build_slots", 1)},
+    on_log=lambda entry: event_bus.publish({"type": "log", **entry})
+)
+
+@asynccontextmanager
+async def lifespan(app):
+    event_bus.attach(asyncio.get_running_loop())
+    executor.start()
+    # Каталог обновляет свой фоновый поток, поиск прогревается в фоне:
+    # /status отвечает сразу, первый /search уже быстрый
+    catalog.start()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    yield
+    executor.shutdown()
+
+app = FastAPI(title="Sculptor AI Backend", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -65,78 +119,86 @@ def health_check():
     lib_count = len(list(lib_path.glob("*"))) if lib_path.exists() else 0
     return {"status": "running", "library_count": lib_count}
 
+@app.get("/models")
+def get_resident_models():
+    """Какие модели сейчас загружены: в сервере (поиск) и в процессах-воркерах (ingest/build)."""
+    models = [dict(entry, process="server") for entry in model_registry.resident()]
+    for worker in executor.worker_models():
+        models.extend(dict(entry, process=f"worker-{worker['pid']}") for entry in worker["models"])
+    return {"idle_ttl_minutes": model_registry.idle_ttl / 60, "models": models}
+
 @app.get("/library")
-def get_library():
-    movies = []
-    lib_path = manager.library_path
-    
-    if lib_path.exists():
-        for folder in lib_path.iterdir():
-            if folder.is_dir() and not folder.name.startswith('.'):
-                master_index_path = folder / "master_index.json"
-                status_file = folder / ".ingest_status.json"  # <--- НОВОЕ
-                has_index = master_index_path.exists()
-                
-                # === ЧИТАЕМ СТАТУС ОБРАБОТКИ ===
-                ingest_status = None
-                if status_file.exists():
-                    try:
-                        with open(status_file, 'r') as f:
-                            ingest_status = json.load(f)
-                    except: pass
-                
-                # TMDB Logic (оставляем как было)
-                thumbnail_url = None
-                cache_file = folder / ".tmdb_cache"
-                
-                if cache_file.exists():
-                    try:
-                        with open(cache_file, 'r') as f:
-                            thumbnail_url = f.read().strip()
-                    except: pass
-                
-                if not thumbnail_url and tmdb_client:
-                    search_query = folder.name
-                    if has_index:
-                        try:
-                            with open(master_index_path, 'r') as f:
-                                meta = json.load(f)
-                                search_query = meta.get("movie_name", folder.name)
-                        except: pass
-                    
-                    try:
-                        found_poster = tmdb_client.get_poster_url(search_query)
-                        if found_poster:
-                            thumbnail_url = found_poster
-                            with open(cache_file, 'w') as f:
-                                f.write(thumbnail_url)
-                    except: pass
-                
-                if not thumbnail_url:
-                    faces_dir = folder / "faces"
-                    if faces_dir.exists():
-                        images = list(faces_dir.glob("*.jpg"))
-                        if images:
-                            target_img = images[min(5, len(images)-1)]
-                            thumbnail_url = f"http://localhost:8000/images/{folder.name}/faces/{target_img.name}"
-
-                # === ФОРМИРУЕМ ОТВЕТ ===
-                movie_data = {
-                    "alias": folder.name,
-                    "ready": has_index,
-                    "path": str(folder.absolute()),
-                    "thumbnail": thumbnail_url
-                }
-                
-                # Добавляем статус обработки, если он есть
-                if ingest_status:
-                    movie_data["ingest_status"] = ingest_status.get("status", "unknown")
-                    movie_data["percent"] = ingest_status.get("percent", 0)
-                    movie_data["progress_text"] = ingest_status.get("progress_text", "")
-                
-                movies.append(movie_data)
-    
-    return movies
+def get_library(request: Request):
+    # Каталог живет в памяти: диск перечитывает фоновый поток, не запрос
+    etag, movies = catalog.snapshot()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(movies, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/thumbs/{alias}/{keyframe}")
+async def get_thumbnail(alias: str, keyframe: str, request: Request, w: int = DEFAULT_WIDTH, v: Optional[str] = None):
+    """Уменьшенный кейфрейм (WebP, если браузер его принимает) вместо полного 1280px из /images."""
+    webp = "image/webp" in request.headers.get("accept", "")
+    thumb = thumbnails.describe(alias, keyframe, w, webp)
+    if thumb is None:
+        return Response(status_code=404)
+
+    # Версионированный URL (из thumbnails.url) не меняется - кэшируем навсегда;
+    # без версии (или со старой) браузер перепроверяет по ETag
+    cache_control = "public, max-age=31536000, immutable" if v == thumb.version else "no-cache"
+    headers = {"ETag": thumb.etag, "Cache-Control": cache_control, "Vary": "Accept"}
+    if request.headers.get("if-none-match") == thumb.etag:
+        return Response(status_code=304, headers=headers)
+
+    await thumbnails.get(alias, keyframe, w, webp)
+    return FileResponse(thumb.path, media_type=thumb.media_type, headers=headers)
+
+@app.get("/library/{alias}/scenes")
+def get_library_scenes(alias: str, offset: int = 0, limit: int = 50,
+                       shot_type: Optional[str] = None, character: Optional[str] = None):
+    """Страница сцен фильма: читаются только нужные строки, а не весь master_index.json."""
+    folder = manager.library_path / alias
+    if alias.startswith(".") or not folder.is_dir():
+        return {"error": "Source not found"}
+
+    store = scene_stores.get(alias)
+    if store is None:
+        from src.ingestion.scene_store import SceneStore
+        store = scene_stores.setdefault(alias, SceneStore(folder))
+
+    page = store.page(max(0, offset), max(1, min(limit, 500)), shot_type=shot_type, character=character)
+    if page is None:
+        return {"error": "Index not found"}
+
+    for scene in page["scenes"]:
+        keyframe = Path(scene.get("visual", {}).get("path") or "").name
+        scene["thumbnail"] = thumbnails.url(alias, keyframe) if keyframe else None
+    return page
+
+@app.get("/library/{alias}/faces")
+def get_library_faces(alias: str):
+    """Спрайт лиц фильма + атлас координат: один запрос и одна картинка на всех персонажей."""
+    folder = manager.library_path / alias
+    atlas_path = folder / "faces_atlas.json"
+    if not atlas_path.exists():
+        return {"error": "Faces not found"}
+
+    with open(atlas_path, 'r') as f:
+        atlas = json.load(f)
+
+    names = {}
+    char_map_path = folder / "character_map.json"
+    if char_map_path.exists():
+        try:
+            with open(char_map_path, 'r', encoding='utf-8') as f:
+                names = json.load(f)
+        except: pass
+
+    for pid, rect in atlas.get("faces", {}).items():
+        rect["name"] = names.get(pid)
+
+    atlas["sprite_url"] = f"http://localhost:8000/images/{alias}/{atlas['sprite']}"
+    return atlas
 
 # === ВОТ ЭТИ ЭНДПОИНТЫ БЫЛИ ПОТЕРЯНЫ ===
 @app.get("/projects")
@@ -168,60 +230,101 @@ def create_project(req: ProjectCreateRequest):
 # ========================================
 
 @app.post("/ingest")
-async def run_ingest(req: IngestRequest, background_tasks: BackgroundTasks):
+async def run_ingest(req: IngestRequest):
     logger.info(f"🚀 API Request: Ingesting {req.alias}...")
     
     def progress_report(percent, status):
-        msg = json.dumps({
+        catalog.invalidate(req.alias)
+        event_bus.publish({
             "type": "progress",
             "alias": req.alias,
             "percent": percent,
             "status": status
         })
-        msg_queue.put(msg)
-
-    background_tasks.add_task(
-        manager.ingest_source, 
-        req.file_path, 
-        req.alias, 
-        req.fullname,
-        progress_report
+
+    def on_finish(job):
+        # Фоновый поток каталога перечитает фильм и сразу поставит в очередь поиск постера
+        catalog.invalidate(req.alias)
+
+    job = manager.create_job("ingest", req.alias)
+    executor.submit(
+        job,
+        "ingest_source",
+        (req.file_path, req.alias, req.fullname),
+        progress_callback=progress_report,
+        on_finish=on_finish
     )
-    return {"status": "started", "task": f"Ingest {req.alias}"}
+    return {"status": "queued", "task": f"Ingest {req.alias}", "job_id": job.id}
 
 @app.post("/build")
-async def run_build(req: BuildRequest, background_tasks: BackgroundTasks):
+async def run_build(req: BuildRequest):
     logger.info(f"🚀 API Request: Building {req.project_name}...")
     
     # Создаем колбэк для WebSocket (так же, как в /ingest)
     def progress_report(percent, status):
-        msg = json.dumps({
+        event_bus.publish({
             "type": "progress",
             "alias": req.project_name, # Важно: используем имя проекта как alias
             "percent": percent,
             "status": status
         })
-        msg_queue.put(msg)
-
-    # Запускаем задачу
-    background_tasks.add_task(
-        manager.build_project, 
-        req.project_name, 
-        req.sources, 
-        req.audio_path,
-        progress_report # <--- Передаем колбэк
+
+    # Ставим в очередь: сборка обгоняет ожидающие индексации
+    job = manager.create_job("build", req.project_name, sources=req.sources)
+    executor.submit(
+        job,
+        "build_project",
+        (req.project_name, req.sources, req.audio_path, None, req.script_path, req.incremental),
+        progress_callback=progress_report # <--- Передаем колбэк
+    )
+    return {"status": "queued", "task": f"Build {req.project_name}", "job_id": job.id}
+
+@app.post("/search")
+def search_scenes(req: SearchRequest):
+    """Текст -> top-k сцен библиотеки (те же эмбеддинги, что и у SmartMatcher)."""
+    search = get_scene_search()
+    if req.sources:
+        # Только готовые фильмы библиотеки: никаких скрытых папок и путей вне ее
+        available = set(search.available_sources())
+        unknown = [alias for alias in req.sources if alias not in available]
+        if unknown:
+            return JSONResponse({"error": f"Unknown sources: {unknown}"}, status_code=400)
+    found = search.search(
+        req.query,
+        top_k=req.top_k,
+        character=req.character,
+        shot_type=req.shot_type,
+        sources=req.sources
     )
-    return {"status": "started", "task": f"Build {req.project_name}"}
+    for result in found["results"]:
+        result["thumbnail"] = thumbnails.url(result["source"], result["keyframe"]) if result["keyframe"] else None
+    return found
+
+@app.get("/jobs")
+def get_jobs(kind: Optional[str] = None, active: bool = False):
+    """Все джобы процесса (новые в конце): один дешевый эндпоинт для опроса UI."""
+    return [job.to_dict() for job in job_registry.list(kind=kind, active_only=active)]
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_registry.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}
+    return job.to_dict()
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = job_registry.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}
+    return {"id": job_id, "cancel_requested": executor.cancel(job_id) or job.cancel(), "state": job.state}
 
 @app.websocket("/ws/logs")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     try:
-        while True:
-            while not msg_queue.empty():
-                msg = msg_queue.get_nowait()
-                await websocket.send_text(msg)
-            await asyncio.sleep(0.1)
+        # Push без опроса: шина будит клиента, когда для него есть события
+        await event_bus.serve(websocket.send_text)
     except WebSocketDisconnect:
         print("Client disconnected")
     except Exception as e:
@@ -230,6 +333,8 @@ async def websocket_endpoint(websocket: WebSocket):
 @app.delete("/library/{alias}")
 def delete_library_item(alias: str):
     success = manager.delete_source_from_library(alias)
+    catalog.invalidate(alias)
+    scene_stores.pop(alias, None)
     if not success:
         return {"error": "Not found"}, 404
     return {"status": "deleted"}
@@ -242,4 +347,6 @@ def delete_project_item(name: str):
     return {"status": "deleted"}
 
 if __name__ == "__main__":
+    # Нужно для spawn-воркеров (Whisper) внутри собранного PyInstaller-бинарника
+    multiprocessing.freeze_support()
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
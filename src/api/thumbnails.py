@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Разрешенные ширины: произвольный ?w= округляется вверх, чтобы кэш не разрастался
+THUMB_WIDTHS = (160, 320, 480, 640)
+DEFAULT_WIDTH = 320
+QUALITY = 80
+
+THUMBS_URL = "http://localhost:8000/thumbs"
+
+
+class Thumbnail:
+    def __init__(self, path, etag, media_type, version):
+        self.path = path
+        self.etag = etag
+        self.media_type = media_type
+        self.version = version  # mtime исходника (hex), тот же, что в ?v= у url()
+
+
+class ThumbnailService:
+    """
+    Уменьшенные кейфреймы для сеток сцен в UI.
+
+    Превью делаются по запросу и складываются на диск; имя файла содержит
+    mtime исходника, поэтому переиндексация фильма автоматически дает
+    новые превью. Ресайз идет в ограниченном пуле потоков, одинаковые
+    одновременные запросы ждут одну и ту же задачу. Ссылки из url()
+    содержат ту же версию (?v=), поэтому их можно кэшировать навсегда:
+    после переиндексации UI получит уже другой URL.
+    """
+
+    def __init__(self, library_path, cache_dir, workers=2):
+        self.library_path = library_path
+        self.cache_dir = cache_dir
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs")
+        self._inflight = {}
+
+    def _source(self, alias, keyframe):
+        # Только имена без путей: /thumbs не должен читать файлы вне keyframes/
+        for part in (alias, keyframe):
+            if not part or part.startswith(".") or "/" in part or "\\" in part:
+                return None
+        path = self.library_path / alias / "keyframes" / keyframe
+        return path if path.is_file() else None
+
+    def snap_width(self, width):
+        for allowed in THUMB_WIDTHS:
+            if width <= allowed:
+                return allowed
+        return THUMB_WIDTHS[-1]
+
+    def url(self, alias, keyframe, width=DEFAULT_WIDTH):
+        """Версионированная ссылка на превью (None, если кейфрейма нет)."""
+        source = self._source(alias, keyframe)
+        if source is None:
+            return None
+        return f"{THUMBS_URL}/{alias}/{keyframe}?w={width}&v={source.stat().st_mtime_ns:x}"
+
+    def describe(self, alias, keyframe, width, webp=True):
+        """
+        Дешевое описание превью без ресайза (только stat исходника).
+
+        Returns:
+            Thumbnail | None: None, если кейфрейма нет
+        """
+        source = self._source(alias, keyframe)
+        if source is None:
+            return None
+
+        width = self.snap_width(width)
+        mtime = source.stat().st_mtime_ns
+        ext = "webp" if webp else "jpg"
+        path = self.cache_dir / alias / f"{source.stem}_w{width}_{mtime:x}.{ext}"
+        etag = f'"{mtime:x}-{width}-{ext}"'
+        return Thumbnail(path, etag, "image/webp" if webp else "image/jpeg", f"{mtime:x}")
+
+    async def get(self, alias, keyframe, width, webp=True):
+        """Описание готового превью (создает его при первом запросе)."""
+        thumb = self.describe(alias, keyframe, width, webp)
+        if thumb is None or thumb.path.exists():
+            return thumb
+
+        key = str(thumb.path)
+        future = self._inflight.get(key)
+        if future is None:
+            source = self._source(alias, keyframe)
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._pool, self._render, source, thumb.path, self.snap_width(width), webp)
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        await future
+        return thumb
+
+    def _render(self, source, target, width, webp):
+        # Импорт здесь: PIL не должен грузиться на старте сервера
+        from PIL import Image
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        with Image.open(source) as img:
+            # draft: JPEG декодируется сразу в уменьшенном масштабе (в разы быстрее)
+            img.draft("RGB", (width, width))
+            img = img.convert("RGB")
+            if img.width > width:
+                height = max(1, round(img.height * width / img.width))
+                img = img.resize((width, height), Image.LANCZOS)
+
+            tmp_path = target.with_name(target.name + ".tmp")
+            if webp:
+                img.save(tmp_path, "WEBP", quality=QUALITY, method=4)
+            else:
+                img.save(tmp_path, "JPEG", quality=QUALITY, optimize=True)
+            tmp_path.replace(target)
+
+        # Превью от старых версий кейфрейма больше не нужны
+        prefix = target.name.rsplit("_", 1)[0] + "_"
+        for stale in target.parent.glob(f"{prefix}*"):
+            if stale != target and stale.suffix == target.suffix:
+                try:
+                    stale.unlink()
+                except OSError:
+                    pass
@@ -1,3 +1,4 @@
+import io
 import torch
 import clip
 import os
@@ -8,6 +9,8 @@ from PIL import Image
 from pathlib import Path
 from tqdm import tqdm
 
+from src.utils.model_registry import model_registry
+
 logger = logging.getLogger(__name__)
 
 # Типы кадров, которые мы хотим различать
@@ -26,6 +29,7 @@ class ClipEncoder:
         self.keyframes_dir = self.output_dir / "keyframes"
         self.embeddings_path = self.output_dir / "embeddings.npy"
         self.visual_tags_path = self.output_dir / "visual_tags.json"
+        self.model_name = model_name
         
         # Определяем устройство (Apple Silicon MPS или CPU)
         if torch.backends.mps.is_available():
@@ -34,9 +38,21 @@ class ClipEncoder:
             self.device = "cuda"
         else:
             self.device = "cpu"
-            
-        logger.info(f"👁 Loading CLIP model ({model_name}) on {self.device}...")
-        self.model, self.preprocess = clip.load(model_name, device=self.device)
+
+        # Модель грузится лениво: в конвейере это происходит в потоке стадии,
+        # параллельно с загрузкой InsightFace
+        self.model = None
+        self.preprocess = None
+        self._reset_state()
+
+    def _load_model(self):
+        if self.model is not None:
+            return
+
+        self.model, self.preprocess = model_registry.get(
+            ("clip", self.model_name, self.device),
+            lambda: self._create_model()
+        )
         
         # Подготавливаем текстовые векторы для определения типа кадра
         logger.info("📐 Pre-calculating shot type vectors...")
@@ -45,74 +61,88 @@ class ClipEncoder:
             self.shot_type_features = self.model.encode_text(text_inputs)
             self.shot_type_features /= self.shot_type_features.norm(dim=-1, keepdim=True)
 
-    def process_embeddings(self):
-        """
-        Генерирует векторы для картинок и определяет тип кадра.
-        """
-        if not self.keyframes_dir.exists():
-            logger.error(f"Keyframes dir not found: {self.keyframes_dir}")
+    def _create_model(self):
+        logger.info(f"👁 Loading CLIP model ({self.model_name}) on {self.device}...")
+        return clip.load(self.model_name, device=self.device)
+
+    def _reset_state(self):
+        self.embeddings_dict = {} # scene_id -> [vector_start, vector_mid, vector_end]
+        self.visual_tags = {}     # scene_id -> {"shot_counts": {...}}
+
+    # ------------------------------------------------------------------
+    # Stage API (используется IngestPipeline)
+    # ------------------------------------------------------------------
+
+    def prepare(self):
+        self._load_model()
+        self._reset_state()
+
+    def consume(self, img_path, data):
+        """Принимает сырые байты кейфрейма из общего потока."""
+        try:
+            pil_image = Image.open(io.BytesIO(data))
+            # Декодируем сразу: битый/обрезанный JPEG должен упасть здесь, а не в preprocess
+            pil_image.load()
+        except Exception as e:
+            # Один плохой кадр не должен валить стадию: сцена получит вектор по остальным
+            logger.error(f"Error processing {img_path}: {e}")
             return
+        self.add_keyframe(img_path, pil_image)
 
-        image_files = sorted(list(self.keyframes_dir.glob("*.jpg")))
-        logger.info(f"👁 Encoding {len(image_files)} keyframes...")
-
-        embeddings_dict = {} # scene_id -> [vector_start, vector_mid, vector_end]
-        visual_tags = {}     # scene_id -> {"shot_type": "Close-Up", "probs": ...}
-
-        # Чтобы не грузить память, процессим по одной картинке (CLIP быстрый)
-        # Можно оптимизировать батчами, но для начала так безопаснее
-        for img_path in tqdm(image_files, desc="CLIP Encoding"):
-            try:
-                # 1. Загрузка и препроцессинг
-                image = self.preprocess(Image.open(img_path)).unsqueeze(0).to(self.device)
-                
-                # 2. Генерация эмбеддинга
-                with torch.no_grad():
-                    image_features = self.model.encode_image(image)
-                    
-                    # Нормализация вектора (важно для cosine similarity)
-                    image_features /= image_features.norm(dim=-1, keepdim=True)
-
-                    # 3. Определение типа кадра (Shot Classification)
-                    # Считаем схожесть картинки с текстовыми описаниями планов
-                    similarity = (100.0 * image_features @ self.shot_type_features.T).softmax(dim=-1)
-                    values, indices = similarity[0].topk(1)
-                    
-                    best_shot_type = SHOT_TYPES[indices[0]]
-
-                # Сохраняем данные
-                # Получаем scene_id из имени файла (scene_0001_0.jpg -> scene_0001)
-                scene_id = "_".join(img_path.stem.split("_")[:-1])
-                
-                # Сохраняем вектор как numpy array (переводим на CPU)
-                vec_numpy = image_features.cpu().numpy()[0]
+    def add_keyframe(self, img_path, pil_image):
+        """Эмбеддинг + тип кадра для одного кейфрейма."""
+        try:
+            # 1. Препроцессинг
+            image = self.preprocess(pil_image).unsqueeze(0).to(self.device)
+            
+            # 2. Генерация эмбеддинга
+            with torch.no_grad():
+                image_features = self.model.encode_image(image)
                 
-                if scene_id not in embeddings_dict:
-                    embeddings_dict[scene_id] = []
-                    visual_tags[scene_id] = {"shot_counts": {}}
+                # Нормализация вектора (важно для cosine similarity)
+                image_features /= image_features.norm(dim=-1, keepdim=True)
 
-                embeddings_dict[scene_id].append(vec_numpy)
+                # 3. Определение типа кадра (Shot Classification)
+                # Считаем схожесть картинки с текстовыми описаниями планов
+                similarity = (100.0 * image_features @ self.shot_type_features.T).softmax(dim=-1)
+                values, indices = similarity[0].topk(1)
                 
-                # Считаем голоса за тип кадра (у нас 3 кадра на сцену)
-                # Если 2 из 3 кадров говорят Close-Up, значит это Close-Up
-                current_counts = visual_tags[scene_id]["shot_counts"]
-                current_counts[best_shot_type] = current_counts.get(best_shot_type, 0) + 1
+                best_shot_type = SHOT_TYPES[indices[0]]
 
-            except Exception as e:
-                logger.error(f"Error processing {img_path}: {e}")
+            # Сохраняем данные
+            # Получаем scene_id из имени файла (scene_0001_0.jpg -> scene_0001)
+            scene_id = "_".join(Path(img_path).stem.split("_")[:-1])
+            
+            # Сохраняем вектор как numpy array (переводим на CPU)
+            vec_numpy = image_features.cpu().numpy()[0]
+            
+            if scene_id not in self.embeddings_dict:
+                self.embeddings_dict[scene_id] = []
+                self.visual_tags[scene_id] = {"shot_counts": {}}
+
+            self.embeddings_dict[scene_id].append(vec_numpy)
+            
+            # Считаем голоса за тип кадра (у нас 3 кадра на сцену)
+            # Если 2 из 3 кадров говорят Close-Up, значит это Close-Up
+            current_counts = self.visual_tags[scene_id]["shot_counts"]
+            current_counts[best_shot_type] = current_counts.get(best_shot_type, 0) + 1
+
+        except Exception as e:
+            logger.error(f"Error processing {img_path}: {e}")
 
-        # Финализация данных
+    def finalize(self):
+        """Усреднение векторов по сценам и сохранение на диск."""
         final_embeddings = {}
         final_tags = {}
 
-        for scene_id, vectors in embeddings_dict.items():
+        for scene_id, vectors in self.embeddings_dict.items():
             # 1. Усредняем вектор сцены (берем среднее между 3 кадрами)
             # Это дает более стабильный вектор для поиска
             avg_vector = np.mean(vectors, axis=0)
             final_embeddings[scene_id] = avg_vector
 
             # 2. Определяем итоговый тип сцены (Majority Vote)
-            counts = visual_tags[scene_id]["shot_counts"]
+            counts = self.visual_tags[scene_id]["shot_counts"]
             most_frequent_shot = max(counts, key=counts.get)
             final_tags[scene_id] = most_frequent_shot
 
@@ -122,4 +152,33 @@ class ClipEncoder:
             json.dump(final_tags, f, indent=2)
 
         logger.info(f"💾 Embeddings saved to: {self.embeddings_path}")
-        logger.info(f"💾 Visual tags saved to: {self.visual_tags_path}")
\ No newline at end of file
+        logger.info(f"💾 Visual tags saved to: {self.visual_tags_path}")
+
+    # ------------------------------------------------------------------
+    # Standalone run
+    # ------------------------------------------------------------------
+
+    def process_embeddings(self):
+        """
+        Генерирует векторы для картинок и определяет тип кадра.
+        """
+        if not self.keyframes_dir.exists():
+            logger.error(f"Keyframes dir not found: {self.keyframes_dir}")
+            return
+
+        self.prepare()
+
+        image_files = sorted(list(self.keyframes_dir.glob("*.jpg")))
+        logger.info(f"👁 Encoding {len(image_files)} keyframes...")
+
+        # Чтобы не грузить память, процессим по одной картинке (CLIP быстрый)
+        # Можно оптимизировать батчами, но для начала так безопаснее
+        for img_path in tqdm(image_files, desc="CLIP Encoding"):
+            try:
+                pil_image = Image.open(img_path)
+            except Exception as e:
+                logger.error(f"Error processing {img_path}: {e}")
+                continue
+            self.add_keyframe(img_path, pil_image)
+
+        self.finalize()
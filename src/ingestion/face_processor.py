@@ -7,89 +7,196 @@ from pathlib import Path
 from tqdm import tqdm
 import pickle
 
-from insightface.app import FaceAnalysis
 from sklearn.cluster import DBSCAN
 from sklearn.preprocessing import normalize
+from scipy.sparse.csgraph import connected_components
+
+from src.utils.model_registry import model_registry
 
 logger = logging.getLogger(__name__)
 
+# Размер квадратного превью лица (px) и отступ вокруг bbox
+FACE_CROP_SIZE = 128
+FACE_CROP_MARGIN = 0.25
+
 class FaceProcessor:
     def __init__(self, output_dir):
         self.output_dir = Path(output_dir)
         self.keyframes_dir = self.output_dir / "keyframes"
         self.faces_path = self.output_dir / "faces_clusters.json"
         self.face_reps_path = self.output_dir / "face_representatives.json"
+        self.face_groups_path = self.output_dir / "face_groups.json"
+        self.faces_dir = self.output_dir / "faces"
+        self.sprite_path = self.output_dir / "faces_sprite.jpg"
+        self.atlas_path = self.output_dir / "faces_atlas.json"
 
         self.app = None 
+        self._reset_state()
 
     def _load_model(self):
         if self.app is None:
-            logger.info("⚡️ Loading LIGHTWEIGHT InsightFace model (buffalo_s)...")
-            # buffalo_s - супер-быстрая модель. Точность ниже, но скорость х10.
-            # det_size=(640, 640) - стандартное разрешение.
-            self.app = FaceAnalysis(name='buffalo_s', providers=['CPUExecutionProvider'])
-            self.app.prepare(ctx_id=0, det_size=(640, 640))
+            # Модель живет в реестре процесса и переживает джобу
+            self.app = model_registry.get(("insightface", "buffalo_s"), self._create_app)
 
-    def process_faces(self):
-        # SKIP LOGIC
-        if self.faces_path.exists() and self.face_reps_path.exists():
-            logger.info(f"⏭️  Face data exists. Skipping.")
+    def _create_app(self):
+        # Импорт здесь: onnxruntime/insightface нужны только детекции, не кластеризации
+        from insightface.app import FaceAnalysis
+
+        logger.info("⚡️ Loading LIGHTWEIGHT InsightFace model (buffalo_s)...")
+        # buffalo_s - супер-быстрая модель. Точность ниже, но скорость х10.
+        # det_size=(640, 640) - стандартное разрешение.
+        app = FaceAnalysis(name='buffalo_s', providers=['CPUExecutionProvider'])
+        app.prepare(ctx_id=0, det_size=(640, 640))
+        return app
+
+    def _reset_state(self):
+        self.all_embeddings = []
+        self.embedding_map = []
+        self.face_boxes = []  # (путь кейфрейма, bbox), параллельно embedding_map
+        self.detected_count = 0
+        self.skipped_low_quality = 0
+
+    def has_results(self):
+        """True, если лица для этого фильма уже посчитаны (SKIP LOGIC)."""
+        return self.faces_path.exists() and self.face_reps_path.exists()
+
+    # ------------------------------------------------------------------
+    # Stage API (используется IngestPipeline)
+    # ------------------------------------------------------------------
+
+    def prepare(self):
+        self._load_model()
+        self._reset_state()
+
+    def consume(self, img_path, data):
+        """Принимает сырые байты кейфрейма из общего потока."""
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
             return
+        self.add_keyframe(img_path, img)
 
-        if not self.keyframes_dir.exists():
-            logger.error(f"Keyframes dir not found.")
+    def add_keyframe(self, img_path, img):
+        """Детекция лиц на одном уже декодированном кадре (BGR)."""
+        try:
+            faces = self.app.get(img)
+        except Exception:
             return
 
-        self._load_model()
+        if not faces:
+            return
 
-        image_files = sorted(list(self.keyframes_dir.glob("*.jpg")))
-        logger.info(f"🔍 Scanning faces in {len(image_files)} keyframes...")
+        scene_id = "_".join(Path(img_path).stem.split("_")[:-1])
 
-        all_embeddings = []
-        embedding_map = [] 
+        for face in faces:
+            # ОЧЕНЬ ВАЖНО: Поднимаем порог качества до 0.60
+            # Мы игнорируем размытые лица, которые служат "мостиком" для склеивания разных людей.
+            if face.det_score < 0.60: 
+                self.skipped_low_quality += 1
+                continue 
 
-        # --- ЭТАП 1: Строгая фильтрация ---
-        detected_count = 0
-        skipped_low_quality = 0
+            self.all_embeddings.append(face.embedding)
+            self.embedding_map.append({
+                "scene_id": scene_id,
+                "filename": Path(img_path).name,
+                "score": float(face.det_score)
+            })
+            # Превью нужны только представителям кластеров: кропаем их в finalize,
+            # а здесь запоминаем, где лицо (десятки тысяч JPEG в памяти не держим)
+            self.face_boxes.append((str(img_path), [float(v) for v in face.bbox]))
+            self.detected_count += 1
 
-        for img_path in tqdm(image_files, desc="Detecting Faces"):
-            img = cv2.imread(str(img_path))
-            if img is None: continue
-            
-            try:
-                faces = self.app.get(img)
-            except Exception: continue
-            
-            if not faces: continue
-
-            scene_id = "_".join(img_path.stem.split("_")[:-1])
-
-            for face in faces:
-                # ОЧЕНЬ ВАЖНО: Поднимаем порог качества до 0.60
-                # Мы игнорируем размытые лица, которые служат "мостиком" для склеивания разных людей.
-                if face.det_score < 0.60: 
-                    skipped_low_quality += 1
-                    continue 
-
-                all_embeddings.append(face.embedding)
-                embedding_map.append({
-                    "scene_id": scene_id,
-                    "filename": img_path.name,
-                    "score": float(face.det_score)
-                })
-                detected_count += 1
-
-        logger.info(f"📊 Faces detected: {detected_count}. Skipped blur/bad: {skipped_low_quality}")
+    def _crop_face(self, img, bbox):
+        """Квадратный кроп лица с отступом, сжатый в JPEG."""
+        h, w = img.shape[:2]
+        x1, y1, x2, y2 = [float(v) for v in bbox]
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        half = max(x2 - x1, y2 - y1) * (1 + FACE_CROP_MARGIN) / 2
+
+        left, top = int(max(0, cx - half)), int(max(0, cy - half))
+        right, bottom = int(min(w, cx + half)), int(min(h, cy + half))
+        if right <= left or bottom <= top:
+            return None
+
+        crop = cv2.resize(img[top:bottom, left:right], (FACE_CROP_SIZE, FACE_CROP_SIZE), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", crop, [int(cv2.IMWRITE_JPEG_QUALITY), 85])
+        return buf.tobytes() if ok else None
+
+    def save_face_thumbnails(self, rep_indices):
+        """
+        Сохраняет превью представителей в faces/ и собирает один спрайт
+        на фильм + JSON-атлас с координатами каждого лица.
+
+        Args:
+            rep_indices: {person_id: индекс лучшего лица в embedding_map}
+
+        Returns:
+            dict: {person_id: относительный путь к превью}
+        """
+        self.faces_dir.mkdir(parents=True, exist_ok=True)
+
+        # Перечитываем только кейфреймы представителей, каждый - один раз
+        by_keyframe = {}
+        for pid, idx in rep_indices.items():
+            path, bbox = self.face_boxes[idx]
+            by_keyframe.setdefault(path, []).append((pid, bbox))
+
+        crops = {}
+        for path, faces in by_keyframe.items():
+            img = cv2.imread(path)
+            if img is None:
+                continue
+            for pid, bbox in faces:
+                data = self._crop_face(img, bbox)
+                if data:
+                    crops[pid] = data
+
+        if not crops:
+            return {}
+
+        # Сортируем по номеру, чтобы атлас был стабильным
+        ordered = sorted(crops, key=lambda pid: int(pid.split("_")[-1]))
+        columns = int(np.ceil(np.sqrt(len(ordered))))
+        rows = int(np.ceil(len(ordered) / columns))
+        sprite = np.zeros((rows * FACE_CROP_SIZE, columns * FACE_CROP_SIZE, 3), dtype=np.uint8)
+
+        saved = {}
+        atlas = {}
+        for i, pid in enumerate(ordered):
+            rel_path = f"faces/{pid}.jpg"
+            (self.output_dir / rel_path).write_bytes(crops[pid])
+            saved[pid] = rel_path
+
+            tile = cv2.imdecode(np.frombuffer(crops[pid], dtype=np.uint8), cv2.IMREAD_COLOR)
+            x, y = (i % columns) * FACE_CROP_SIZE, (i // columns) * FACE_CROP_SIZE
+            sprite[y:y + FACE_CROP_SIZE, x:x + FACE_CROP_SIZE] = tile
+            atlas[pid] = {"x": x, "y": y, "w": FACE_CROP_SIZE, "h": FACE_CROP_SIZE}
+
+        cv2.imwrite(str(self.sprite_path), sprite, [int(cv2.IMWRITE_JPEG_QUALITY), 85])
+        with open(self.atlas_path, 'w') as f:
+            json.dump({
+                "sprite": self.sprite_path.name,
+                "tile_size": FACE_CROP_SIZE,
+                "columns": columns,
+                "faces": atlas
+            }, f, indent=2)
+
+        logger.info(f"🖼 Saved {len(saved)} face thumbnails + sprite sheet: {self.sprite_path.name}")
+        return saved
+
+    def finalize(self):
+        """Кластеризация накопленных эмбеддингов и сохранение на диск."""
+        logger.info(f"📊 Faces detected: {self.detected_count}. Skipped blur/bad: {self.skipped_low_quality}")
         
-        if detected_count == 0:
+        if self.detected_count == 0:
             logger.warning("⚠️ No high-quality faces found! Try lowering threshold slightly.")
             with open(self.faces_path, 'w') as f: json.dump({}, f)
             with open(self.face_reps_path, 'w') as f: json.dump({}, f)
+            with open(self.face_groups_path, 'w') as f: json.dump({}, f)
             return
 
         # --- ЭТАП 2: Дробление Кластеров ---
         logger.info("Pre-normalizing embeddings...")
-        X = normalize(np.array(all_embeddings))
+        X = normalize(np.array(self.all_embeddings))
 
         logger.info("🧩 Clustering faces (Fragmentation Mode)...")
         
@@ -106,12 +213,13 @@ class FaceProcessor:
         # --- ЭТАП 3: Сохранение ---
         scene_faces = {} 
         representative_faces = {} 
+        rep_indices = {}
 
         for idx, label in enumerate(labels):
             if label == -1: continue 
             
             person_id = f"person_{label}"
-            data = embedding_map[idx]
+            data = self.embedding_map[idx]
             s_id = data["scene_id"]
 
             if s_id not in scene_faces: scene_faces[s_id] = set()
@@ -119,9 +227,20 @@ class FaceProcessor:
             
             if person_id not in representative_faces:
                 representative_faces[person_id] = {"path": data["filename"], "score": data["score"]}
+                rep_indices[person_id] = idx
             else:
                 if data["score"] > representative_faces[person_id]["score"]:
                     representative_faces[person_id] = {"path": data["filename"], "score": data["score"]}
+                    rep_indices[person_id] = idx
+
+        try:
+            thumbnails = self.save_face_thumbnails(rep_indices)
+        except Exception as e:
+            logger.warning(f"⚠️ Face thumbnails skipped: {e}")
+            thumbnails = {}
+
+        for pid, rel_path in thumbnails.items():
+            representative_faces[pid]["crop"] = rel_path
 
         with open(self.face_reps_path, 'w') as f:
             json.dump(representative_faces, f, indent=2)
@@ -130,4 +249,76 @@ class FaceProcessor:
         with open(self.faces_path, 'w') as f:
             json.dump(final_json, f, indent=2)
 
-        logger.info(f"💾 Saved data to {self.faces_path}")
\ No newline at end of file
+        # --- ЭТАП 4: Склейка фрагментов в персонажей ---
+        groups = self.merge_fragments(X, labels)
+        with open(self.face_groups_path, 'w') as f:
+            json.dump(groups, f, indent=2)
+
+        logger.info(f"💾 Saved data to {self.faces_path}")
+
+    def merge_fragments(self, X, labels, threshold=0.30):
+        """
+        Склеивает фрагменты одного персонажа в identity-группы по центроидам.
+
+        DBSCAN специально дробит людей (eps=0.40), поэтому здесь сравниваем
+        уже усредненные центроиды кластеров, но с более строгим порогом.
+        Центроид шумит меньше, чем отдельное лицо, поэтому "мостики" между
+        разными людьми почти не возникают.
+
+        Args:
+            X: Нормализованные эмбеддинги лиц (N x D)
+            labels: Метки DBSCAN для каждого эмбеддинга
+            threshold: Косинусная дистанция между центроидами для склейки
+
+        Returns:
+            dict: {person_id представителя: [person_id всех фрагментов]}
+        """
+        labels = np.asarray(labels)
+        cluster_ids = sorted(l for l in set(labels.tolist()) if l != -1)
+        if not cluster_ids:
+            return {}
+
+        centroids = normalize(np.stack([X[labels == l].mean(axis=0) for l in cluster_ids]))
+        sizes = np.array([(labels == l).sum() for l in cluster_ids])
+
+        # Попарная косинусная схожесть всех центроидов одним матричным умножением
+        similarity = centroids @ centroids.T
+        n_groups, components = connected_components(similarity >= 1.0 - threshold, directed=False)
+
+        groups = {}
+        for g in range(n_groups):
+            members = np.flatnonzero(components == g)
+            # Представитель группы - самый "частый" фрагмент
+            rep_idx = members[np.argmax(sizes[members])]
+            rep_pid = f"person_{cluster_ids[rep_idx]}"
+            groups[rep_pid] = [f"person_{cluster_ids[i]}" for i in members]
+
+        logger.info(f"🧬 Merged {len(cluster_ids)} fragments into {n_groups} identity groups.")
+        return groups
+
+    # ------------------------------------------------------------------
+    # Standalone run
+    # ------------------------------------------------------------------
+
+    def process_faces(self):
+        # SKIP LOGIC
+        if self.has_results():
+            logger.info(f"⏭️  Face data exists. Skipping.")
+            return
+
+        if not self.keyframes_dir.exists():
+            logger.error(f"Keyframes dir not found.")
+            return
+
+        self.prepare()
+
+        image_files = sorted(list(self.keyframes_dir.glob("*.jpg")))
+        logger.info(f"🔍 Scanning faces in {len(image_files)} keyframes...")
+
+        # --- ЭТАП 1: Строгая фильтрация ---
+        for img_path in tqdm(image_files, desc="Detecting Faces"):
+            img = cv2.imread(str(img_path))
+            if img is None: continue
+            self.add_keyframe(img_path, img)
+
+        self.finalize()
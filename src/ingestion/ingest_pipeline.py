@@ -0,0 +1,149 @@
+import queue
+import threading
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Маркер конца потока кейфреймов
+_END = object()
+
+
+class IngestPipeline:
+    """
+    Producer/consumer конвейер для кейфреймов фильма.
+
+    Продюсер один раз читает каждый кейфрейм с диска и кладет байты
+    в ограниченную очередь каждой стадии. Стадии (лица, CLIP) работают
+    в своих потоках параллельно, поэтому инджест длится примерно как
+    самая медленная стадия, а не как их сумма.
+
+    Стадия - любой объект с методами prepare(), consume(img_path, data)
+    и finalize() (см. FaceProcessor и ClipEncoder).
+    """
+
+    def __init__(self, keyframes_dir, stages, queue_size=32, progress_callback=None, should_stop=None):
+        """
+        Args:
+            keyframes_dir: Папка с кейфреймами (*.jpg)
+            stages: dict {имя стадии: объект стадии}
+            queue_size: Размер очереди каждой стадии (ограничивает память)
+            progress_callback: Функция (stage, done, total) для отчета о прогрессе
+            should_stop: Функция без аргументов; True - остановиться на следующем кейфрейме
+        """
+        self.keyframes_dir = Path(keyframes_dir)
+        self.stages = stages
+        self.queue_size = queue_size
+        self.progress_callback = progress_callback
+        self.should_stop = should_stop
+        self.stopped = False
+
+    def _report(self, stage, done, total):
+        if self.progress_callback:
+            try:
+                self.progress_callback(stage, done, total)
+            except Exception as e:
+                logger.warning(f"Progress callback failed: {e}")
+
+    def _produce(self, image_files, queues):
+        for img_path in image_files:
+            if self.should_stop and self.should_stop():
+                logger.warning("🛑 Ingest pipeline stopped on request")
+                self.stopped = True
+                break
+
+            try:
+                data = img_path.read_bytes()
+            except OSError as e:
+                logger.error(f"Can't read keyframe {img_path}: {e}")
+                data = None
+
+            # put() блокируется, если стадия отстает - это и есть backpressure
+            for q in queues.values():
+                q.put((img_path, data))
+
+        for q in queues.values():
+            q.put(_END)
+
+    def _consume(self, name, stage, q, total, errors):
+        failed = False
+        try:
+            stage.prepare()
+        except Exception as e:
+            logger.error(f"❌ Stage '{name}' failed to prepare: {e}")
+            errors[name] = e
+            failed = True
+
+        done = 0
+        last_percent = -1
+
+        while True:
+            item = q.get()
+            if item is _END:
+                break
+
+            # Упавшая стадия продолжает вычитывать очередь, чтобы не блокировать продюсера
+            if failed:
+                continue
+
+            img_path, data = item
+            if data is not None:
+                try:
+                    stage.consume(img_path, data)
+                except Exception as e:
+                    logger.error(f"❌ Stage '{name}' failed on {img_path.name}: {e}")
+                    errors[name] = e
+                    failed = True
+                    continue
+
+            done += 1
+            percent = int(done * 100 / total) if total else 100
+            if percent != last_percent:
+                last_percent = percent
+                self._report(name, done, total)
+
+        # Остановленный прогон не сохраняет частичные результаты
+        if failed or self.stopped:
+            return
+
+        try:
+            stage.finalize()
+        except Exception as e:
+            logger.error(f"❌ Stage '{name}' failed to finalize: {e}")
+            errors[name] = e
+
+    def run(self):
+        """
+        Прогоняет все стадии по кейфреймам.
+
+        Returns:
+            dict: {имя стадии: исключение} для упавших стадий (пустой, если все ок)
+        """
+        if not self.stages:
+            return {}
+
+        image_files = sorted(self.keyframes_dir.glob("*.jpg"))
+        total = len(image_files)
+        logger.info(f"🔀 Ingest pipeline: {total} keyframes -> stages {list(self.stages)}")
+
+        queues = {name: queue.Queue(maxsize=self.queue_size) for name in self.stages}
+        errors = {}
+
+        workers = [
+            threading.Thread(
+                target=self._consume,
+                args=(name, stage, queues[name], total, errors),
+                name=f"ingest-{name}",
+                daemon=True
+            )
+            for name, stage in self.stages.items()
+        ]
+        for w in workers:
+            w.start()
+
+        self._produce(image_files, queues)
+
+        for w in workers:
+            w.join()
+
+        return errors
@@ -1,21 +1,30 @@
+import io
 import json
+import math
+import time
 import logging
 from pathlib import Path
 from collections import Counter
 from dotenv import load_dotenv
-from PIL import Image
+from PIL import Image, ImageDraw
 
 from src.utils.gemini_client import GeminiClient
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Коллаж для Gemini: максимальная сторона и высота подписи под плиткой
+COLLAGE_MAX_SIDE = 1024
+COLLAGE_LABEL_HEIGHT = 20
+
 
 class MetadataManager:
-    def __init__(self, library_dir, movie_name="Unknown Movie", source_video_path=None):
+    def __init__(self, library_dir, movie_name="Unknown Movie", source_video_path=None, use_collage=True):
         self.library_dir = Path(library_dir)
         self.movie_name = movie_name
         self.source_video_path = source_video_path
+        # True -> все лица уходят в Gemini одним подписанным коллажем
+        self.use_collage = use_collage
         self.keyframes_dir = self.library_dir / "keyframes"
 
         # Paths
@@ -23,6 +32,7 @@ class MetadataManager:
         self.visual_tags_path = self.library_dir / "visual_tags.json"
         self.face_clusters_path = self.library_dir / "faces_clusters.json"
         self.face_reps_path = self.library_dir / "face_representatives.json"
+        self.face_groups_path = self.library_dir / "face_groups.json"
         self.master_index_path = self.library_dir / "master_index.json"
         self.character_map_path = self.library_dir / "character_map.json"
 
@@ -39,6 +49,21 @@ class MetadataManager:
     # Characters
     # ------------------------------------------------------------------
 
+    def _load_face_groups(self):
+        """
+        Загружает identity-группы фрагментов {rep_pid: [pid, ...]}.
+        Для старых библиотек (без face_groups.json) каждый pid - сам себе группа.
+        """
+        if not self.face_groups_path.exists():
+            return {}
+
+        try:
+            with open(self.face_groups_path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Can't read face groups: {e}")
+            return {}
+
     def get_top_characters(self, limit=15):
         if not self.face_clusters_path.exists():
             return []
@@ -46,10 +71,15 @@ class MetadataManager:
         with open(self.face_clusters_path, "r") as f:
             clusters = json.load(f)
 
+        # pid -> представитель группы
+        groups = self._load_face_groups()
+        owner = {pid: rep for rep, members in groups.items() for pid in members}
+
         counter = Counter()
         for persons in clusters.values():
-            for pid in persons:
-                counter[pid] += 1
+            # Несколько фрагментов одного персонажа в сцене считаем один раз
+            for rep in {owner.get(pid, pid) for pid in persons}:
+                counter[rep] += 1
 
         top = [pid for pid, _ in counter.most_common(limit)]
         logger.info(f"🏆 Top {limit} characters: {top}")
@@ -66,8 +96,9 @@ class MetadataManager:
         with open(self.face_reps_path, "r") as f:
             reps = json.load(f)
 
+        groups = self._load_face_groups()
         target_pids = self.get_top_characters(limit=15)
-        images = []
+        entries = []
         prompts = [
             f"You are analyzing the movie '{self.movie_name}'.",
             "These are faces of MAIN characters.",
@@ -80,19 +111,51 @@ class MetadataManager:
             if pid not in reps:
                 continue
 
-            img_path = self.keyframes_dir / reps[pid]["path"]
+            # Маленький кроп лица из FaceProcessor, если он есть; иначе полный кейфрейм
+            crop = reps[pid].get("crop")
+            img_path = self.library_dir / crop if crop else self.keyframes_dir / reps[pid]["path"]
+            if not img_path.exists():
+                img_path = self.keyframes_dir / reps[pid]["path"]
+
             if img_path.exists():
-                images.append(Image.open(img_path))
-                prompts.append(f"Image {len(images)} is labeled '{pid}'.")
+                entries.append((pid, Image.open(img_path)))
 
-        if not images:
+        if not entries:
             logger.warning("No character images found.")
             return {}
 
+        if self.use_collage:
+            images = [self._build_collage(entries)]
+            prompts.append("The image is a grid of faces. Each face is labeled with its id (e.g. 'person_3') below it.")
+            prompts.append(f"Faces in the grid: {', '.join(pid for pid, _ in entries)}.")
+        else:
+            images = []
+            for pid, img in entries:
+                images.append(img)
+                prompts.append(f"Image {len(images)} is labeled '{pid}'.")
+
+        mode = "collage" if self.use_collage else "separate"
+        if logger.isEnabledFor(logging.DEBUG):
+            # Размер считается повторным JPEG-кодированием - только при отладке, не в каждом запросе
+            logger.debug(f"📦 Character request payload ({mode}): ~{self._payload_bytes(images) / 1024:.0f} KB")
+
         try:
-            response = self.client.generate_content(prompts + images)
+            started = time.time()
+            # Неразбираемый ответ не кэшируем, иначе он вернется при следующей индексации
+            response = self.client.generate_content(
+                prompts + images,
+                validate=lambda text: isinstance(json.loads(self.client.parse_json(text)), dict)
+            )
+            latency = time.time() - started
+            logger.info(f"📦 Character request ({mode}): {len(images)} image(s), {latency:.1f}s")
+
             parsed = json.loads(self.client.parse_json(response.text))
 
+            # Имя представителя распространяется на все фрагменты его группы
+            for rep, name in list(parsed.items()):
+                for pid in groups.get(rep, []):
+                    parsed.setdefault(pid, name)
+
             with open(self.character_map_path, "w", encoding="utf-8") as f:
                 json.dump(parsed, f, indent=2, ensure_ascii=False)
 
@@ -103,6 +166,42 @@ class MetadataManager:
             logger.error(f"❌ Character identification failed: {e}")
             return {}
 
+    def _build_collage(self, entries):
+        """
+        Собирает лица в одну подписанную сетку ограниченного размера.
+
+        Args:
+            entries: [(person_id, PIL.Image), ...]
+
+        Returns:
+            PIL.Image: Коллаж не больше COLLAGE_MAX_SIDE по каждой стороне
+        """
+        columns = math.ceil(math.sqrt(len(entries)))
+        rows = math.ceil(len(entries) / columns)
+        tile = min(256, COLLAGE_MAX_SIDE // columns, COLLAGE_MAX_SIDE // rows - COLLAGE_LABEL_HEIGHT)
+        cell_h = tile + COLLAGE_LABEL_HEIGHT
+
+        collage = Image.new("RGB", (columns * tile, rows * cell_h), "white")
+        draw = ImageDraw.Draw(collage)
+
+        for i, (pid, img) in enumerate(entries):
+            x, y = (i % columns) * tile, (i // columns) * cell_h
+            thumb = img.convert("RGB")
+            thumb.thumbnail((tile, tile))
+            collage.paste(thumb, (x + (tile - thumb.width) // 2, y + (tile - thumb.height) // 2))
+            draw.text((x + 4, y + tile + 4), pid, fill="black")
+
+        return collage
+
+    def _payload_bytes(self, images):
+        """Примерный размер картинок в запросе (JPEG), для сравнения режимов."""
+        total = 0
+        for img in images:
+            buf = io.BytesIO()
+            img.convert("RGB").save(buf, format="JPEG", quality=90)
+            total += buf.tell()
+        return total
+
     # ------------------------------------------------------------------
     # Master Index
     # ------------------------------------------------------------------
@@ -134,11 +233,13 @@ class MetadataManager:
             scene_id = scene["scene_id"]
             raw_ids = face_clusters.get(scene_id, [])
 
-            named_chars = [
+            # Склеенные фрагменты одного персонажа дают одно имя на несколько pid:
+            # в сцене оно должно встречаться один раз (порядок сохраняем)
+            named_chars = list(dict.fromkeys(
                 char_map[pid]
                 for pid in raw_ids
                 if pid in char_map and char_map[pid] != "Unknown"
-            ]
+            ))
 
             scenes_index.append({
                 "id": scene_id,
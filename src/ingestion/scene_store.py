@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import numpy as np
+from pathlib import Path
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+LOCK_STALE_SECONDS = 300   # лок умершего процесса снимается через 5 минут
+LOCK_POLL_SECONDS = 0.05
+
+
+class SceneStore:
+    """
+    Постраничное чтение сцен фильма без разбора всего master_index.json.
+
+    Рядом с индексом один раз строятся:
+      scenes.jsonl          - по сцене на строку
+      scenes_offsets.npy    - байтовые смещения строк (N+1)
+      scenes_postings.npy   - списки номеров сцен для фильтров подряд
+      scenes_store.json     - оглавление: число сцен, mtime индекса и
+                              {"shot_type:Close-Up": [start, len], "character:Neo": [...]}
+    Смещения и списки открываются через mmap, поэтому страница читает
+    только свои строки - время ответа не зависит от длины фильма.
+    Файлы перестраиваются сами, если master_index.json изменился.
+    Сборку может начать и воркер ingest, и сервер (лениво) - поэтому она
+    идет под файловым локом scenes_store.lock, а временные файлы у каждого
+    сборщика свои.
+    """
+
+    def __init__(self, source_dir):
+        self.source_dir = Path(source_dir)
+        self.index_path = self.source_dir / "master_index.json"
+        self.lines_path = self.source_dir / "scenes.jsonl"
+        self.offsets_path = self.source_dir / "scenes_offsets.npy"
+        self.postings_path = self.source_dir / "scenes_postings.npy"
+        self.manifest_path = self.source_dir / "scenes_store.json"
+        self.lock_path = self.source_dir / "scenes_store.lock"
+
+        self._manifest = None
+        self._offsets = None
+        self._postings = None
+        self._lock = threading.Lock()
+
+    # === ПОСТРОЕНИЕ ===
+
+    @contextmanager
+    def _file_lock(self):
+        """Межпроцессный лок на сборку (O_CREAT|O_EXCL работает и без fcntl)."""
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - self.lock_path.stat().st_mtime > LOCK_STALE_SECONDS:
+                        logger.warning(f"⚠️ Removing stale scene store lock: {self.lock_path}")
+                        self.lock_path.unlink()
+                        continue
+                except OSError:
+                    # Лок сняли, пока мы смотрели
+                    continue
+                time.sleep(LOCK_POLL_SECONDS)
+        try:
+            os.write(fd, str(os.getpid()).encode("ascii"))
+            os.close(fd)
+            yield
+        finally:
+            try:
+                self.lock_path.unlink()
+            except OSError:
+                pass
+
+    def _read_manifest(self, source_mtime):
+        """Оглавление, если оно собрано для текущего master_index.json, иначе None."""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != STORE_VERSION or manifest.get("source_mtime") != source_mtime:
+            return None
+        return manifest
+
+    def _tmp_path(self, path):
+        # Уникальное имя на сборщика; суффикс .npy сохраняем, иначе np.save допишет свой
+        tag = f"{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        return path.with_name(f"{path.stem}.{tag}.tmp{path.suffix}")
+
+    def build(self):
+        """
+        Разбирает master_index.json (один раз) и пишет файлы хранилища.
+
+        Если, пока ждали лок, хранилище для этой версии индекса уже собрал
+        другой процесс, повторно не собирает.
+        """
+        with self._file_lock():
+            source_mtime = self.index_path.stat().st_mtime_ns
+            manifest = self._read_manifest(source_mtime)
+            if manifest is not None:
+                return manifest
+            return self._write(source_mtime)
+
+    def _write(self, source_mtime):
+        tmp_paths = [self._tmp_path(path) for path in
+                     (self.lines_path, self.offsets_path, self.postings_path, self.manifest_path)]
+        try:
+            return self._write_files(source_mtime, *tmp_paths)
+        finally:
+            # После os.replace их уже нет; остаются только при ошибке сборки
+            for path in tmp_paths:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def _write_files(self, source_mtime, tmp_lines, tmp_offsets, tmp_postings, tmp_manifest):
+        with open(self.index_path, 'r') as f:
+            index_data = json.load(f)
+
+        # Новый формат {"scenes": [...]} и старый - просто список
+        scenes = index_data["scenes"] if isinstance(index_data, dict) else index_data
+
+        postings = {}
+        offsets = [0]
+        with open(tmp_lines, 'wb') as f:
+            for idx, scene in enumerate(scenes):
+                line = json.dumps(scene, ensure_ascii=False).encode("utf-8") + b"\n"
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+
+                shot_type = scene.get("visual", {}).get("shot_type", "Unknown")
+                postings.setdefault(f"shot_type:{shot_type}", []).append(idx)
+                # Имя может повториться в сцене (склеенные фрагменты) - номер сцены один раз
+                for name in set(scene.get("content", {}).get("characters", [])):
+                    postings.setdefault(f"character:{name}", []).append(idx)
+
+        flat = []
+        directory = {}
+        for key, idxs in postings.items():
+            directory[key] = [len(flat), len(idxs)]
+            flat.extend(idxs)
+
+        np.save(tmp_offsets, np.array(offsets, dtype=np.int64))
+        np.save(tmp_postings, np.array(flat, dtype=np.int32))
+
+        os.replace(tmp_lines, self.lines_path)
+        os.replace(tmp_offsets, self.offsets_path)
+        os.replace(tmp_postings, self.postings_path)
+
+        # Оглавление пишется последним: пока его нет, хранилище считается несобранным
+        manifest = {
+            "version": STORE_VERSION,
+            "count": len(scenes),
+            "source_mtime": source_mtime,
+            "postings": directory
+        }
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_manifest, self.manifest_path)
+
+        logger.info(f"🗂 Scene store built for '{self.source_dir.name}': {len(scenes)} scenes")
+        return manifest
+
+    def ensure(self):
+        """
+        Открывает хранилище, при необходимости (пере)строив его.
+
+        Returns:
+            bool: False, если у фильма нет master_index.json
+        """
+        try:
+            source_mtime = self.index_path.stat().st_mtime_ns
+        except OSError:
+            return False
+
+        with self._lock:
+            if self._manifest is not None and self._manifest["source_mtime"] == source_mtime:
+                return True
+
+            manifest = self._read_manifest(source_mtime)
+            if manifest is None:
+                manifest = self.build()
+
+            self._manifest = manifest
+            self._offsets = np.load(self.offsets_path, mmap_mode="r")
+            self._postings = np.load(self.postings_path, mmap_mode="r")
+            return True
+
+    # === ЧТЕНИЕ ===
+
+    def _posting(self, key):
+        start, length = self._manifest["postings"].get(key, [0, 0])
+        return self._postings[start:start + length]
+
+    def page(self, offset=0, limit=50, shot_type=None, character=None):
+        """
+        Returns:
+            dict: {"total", "offset", "limit", "scenes": [...]} или None, если индекса нет
+        """
+        if not self.ensure():
+            return None
+
+        with self._lock:
+            manifest, offsets = self._manifest, self._offsets
+            if shot_type or character:
+                selected = None
+                for key in ([f"shot_type:{shot_type}"] if shot_type else []) + ([f"character:{character}"] if character else []):
+                    posting = self._posting(key)
+                    selected = posting if selected is None else np.intersect1d(selected, posting)
+                total = len(selected)
+                idxs = selected[offset:offset + limit]
+            else:
+                total = manifest["count"]
+                idxs = range(offset, min(offset + limit, total))
+
+            scenes = []
+            with open(self.lines_path, 'rb') as f:
+                for idx in idxs:
+                    start, end = int(offsets[idx]), int(offsets[idx + 1])
+                    f.seek(start)
+                    scene = json.loads(f.read(end - start))
+                    scene["index"] = int(idx)
+                    scenes.append(scene)
+
+        return {"total": int(total), "offset": offset, "limit": limit, "scenes": scenes}
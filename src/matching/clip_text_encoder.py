@@ -0,0 +1,159 @@
+import re
+import time
+import logging
+import argparse
+import torch
+from torch import nn
+
+from src.utils.app_paths import get_app_data_dir
+
+logger = logging.getLogger(__name__)
+
+# Ключи state_dict CLIP, относящиеся к текстовой башне
+TEXT_KEYS = ("token_embedding.", "positional_embedding", "transformer.", "ln_final.", "text_projection")
+
+
+def get_text_cache_dir():
+    return get_app_data_dir() / "cache" / "clip_text"
+
+
+def _cache_path(model_name):
+    # "ViT-B/32" -> "ViT-B-32.text.pt"
+    return get_text_cache_dir() / f"{re.sub(r'[^A-Za-z0-9_.-]', '-', model_name)}.text.pt"
+
+
+class ClipTextTower(nn.Module):
+    """
+    Только текстовая часть CLIP (то, что нужно матчеру для encode_text).
+
+    Повторяет CLIP.encode_text из пакета clip, но без визуальной башни ViT:
+    ~40% весов ViT-B/32 и заметно быстрее старт.
+    """
+
+    def __init__(self, embed_dim, context_length, vocab_size, width, heads, layers):
+        super().__init__()
+        # Импорт здесь: clip тянет torchvision, нужен только при сборке башни
+        from clip.model import Transformer, LayerNorm
+
+        self.context_length = context_length
+        self.transformer = Transformer(width=width, layers=layers, heads=heads, attn_mask=self.build_attention_mask())
+        self.token_embedding = nn.Embedding(vocab_size, width)
+        self.positional_embedding = nn.Parameter(torch.empty(context_length, width))
+        self.ln_final = LayerNorm(width)
+        self.text_projection = nn.Parameter(torch.empty(width, embed_dim))
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        # Размеры восстанавливаются по весам, как в clip.model.build_model
+        width = state_dict["ln_final.weight"].shape[0]
+        tower = cls(
+            embed_dim=state_dict["text_projection"].shape[1],
+            context_length=state_dict["positional_embedding"].shape[0],
+            vocab_size=state_dict["token_embedding.weight"].shape[0],
+            width=width,
+            heads=width // 64,
+            layers=len({k.split(".")[2] for k in state_dict if k.startswith("transformer.resblocks")})
+        )
+        tower.load_state_dict(state_dict)
+        return tower.eval()
+
+    def build_attention_mask(self):
+        mask = torch.empty(self.context_length, self.context_length)
+        mask.fill_(float("-inf"))
+        mask.triu_(1)
+        return mask
+
+    def encode_text(self, text):
+        x = self.token_embedding(text)
+        x = x + self.positional_embedding
+        x = x.permute(1, 0, 2)  # NLD -> LND
+        x = self.transformer(x)
+        x = x.permute(1, 0, 2)  # LND -> NLD
+        x = self.ln_final(x)
+        # Эмбеддинг берется с токена EOT (у него максимальный id)
+        return x[torch.arange(x.shape[0]), text.argmax(dim=-1)] @ self.text_projection
+
+
+def load_text_encoder(model_name="ViT-B/32"):
+    """
+    Грузит текстовую башню CLIP на CPU.
+
+    При первом вызове модель грузится целиком через clip.load, текстовые
+    веса сохраняются в app_data/cache/clip_text, дальше читаются только они.
+    """
+    path = _cache_path(model_name)
+    if path.exists():
+        try:
+            state_dict = torch.load(path, map_location="cpu")
+            logger.info(f"🧠 Loading CLIP text encoder ({model_name}) from cache...")
+            return ClipTextTower.from_state_dict(state_dict)
+        except Exception as e:
+            logger.warning(f"⚠️ Broken CLIP text cache {path.name} ({e}), rebuilding...")
+
+    import clip
+
+    logger.info(f"🧠 Extracting CLIP text encoder ({model_name}) from the full model (one-time)...")
+    full_model, _ = clip.load(model_name, device="cpu", jit=False)
+    state_dict = {k: v.float() for k, v in full_model.state_dict().items() if k.startswith(TEXT_KEYS)}
+    del full_model
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    torch.save(state_dict, tmp_path)
+    tmp_path.replace(path)
+
+    return ClipTextTower.from_state_dict(state_dict)
+
+
+def _param_mb(model):
+    return sum(p.numel() * p.element_size() for p in model.parameters()) / (1024 * 1024)
+
+
+def benchmark_startup(model_name="ViT-B/32", repeats=3):
+    """
+    Сравнивает старт матчера: полный clip.load против текстовой башни.
+    Первый прогон текстового пути (извлечение в кэш) в замер не входит.
+    """
+    import clip
+
+    load_text_encoder(model_name)  # прогрев кэша
+
+    results = {}
+    for label, loader in (
+        ("full", lambda: clip.load(model_name, device="cpu")[0]),
+        ("text_only", lambda: load_text_encoder(model_name)),
+    ):
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            model = loader()
+            timings.append(time.perf_counter() - started)
+
+        tokens = clip.tokenize(["a man walking in the rain"])
+        with torch.no_grad():
+            emb = model.encode_text(tokens).float()
+
+        results[label] = {
+            "load_seconds": round(min(timings), 3),
+            "weights_mb": round(_param_mb(model), 1),
+            "embedding": emb
+        }
+        del model
+
+    diff = (results["full"].pop("embedding") - results["text_only"].pop("embedding")).abs().max().item()
+    results["max_embedding_diff"] = diff
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="CLIP text encoder startup benchmark")
+    parser.add_argument("--model", default="ViT-B/32")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    report = benchmark_startup(args.model, args.repeats)
+    for label in ("full", "text_only"):
+        r = report[label]
+        print(f"{label:>10}: load {r['load_seconds']:.3f}s, weights {r['weights_mb']:.1f} MB")
+    print(f"max |Δ embedding| = {report['max_embedding_diff']:.2e}")
@@ -0,0 +1,268 @@
+import time
+import logging
+import argparse
+import threading
+import numpy as np
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_SIZE = 256
+
+
+class SceneSearch:
+    """
+    Интерактивный поиск сцен по тексту для ручного подбора шотов.
+
+    Работает на тех же embeddings.npy / master_index.json и той же текстовой
+    модели CLIP, что и SmartMatcher (через его _load_source/_encode_query),
+    но все держит в памяти между запросами: индексы фильмов грузятся один
+    раз и перечитываются только при изменении файлов, эмбеддинги запросов
+    кэшируются. Фильтры по персонажу/плану/источнику жесткие, а не бонусы,
+    как в матчере: здесь их задает человек.
+
+    Индексы строятся вне общего лока и подменяются целиком: поиск по уже
+    загруженным фильмам не ждет ни прогрева, ни пересборки измененного
+    фильма (до ее конца отдается старый индекс).
+    """
+
+    def __init__(self, library_path, model_name="ViT-B/32"):
+        self.library_path = Path(library_path)
+        self.model_name = model_name
+        self._matcher = None
+        self._sources = {}          # alias -> индекс фильма (см. _build_source)
+        self._query_cache = {}
+        self._lock = threading.Lock()          # подмена _sources и кэш запросов
+        self._matcher_lock = threading.Lock()  # однократная загрузка модели
+        self._build_lock = threading.Lock()    # одна сборка индекса за раз
+
+    # === ЗАГРУЗКА ===
+
+    def _get_matcher(self):
+        if self._matcher is None:
+            with self._matcher_lock:
+                if self._matcher is None:
+                    # Импорт здесь: torch/clip не должны грузиться на старте сервера
+                    from src.matching.smart_matcher import SmartMatcher
+                    self._matcher = SmartMatcher(self.library_path, model_name=self.model_name, text_only=True)
+        return self._matcher
+
+    def _stamp(self, source_dir):
+        try:
+            return (
+                (source_dir / "master_index.json").stat().st_mtime_ns,
+                (source_dir / "embeddings.npy").stat().st_mtime_ns
+            )
+        except OSError:
+            return None
+
+    def available_sources(self):
+        if not self.library_path.exists():
+            return []
+        return sorted(
+            folder.name for folder in self.library_path.iterdir()
+            if folder.is_dir() and not folder.name.startswith('.')
+            and (folder / "master_index.json").exists() and (folder / "embeddings.npy").exists()
+        )
+
+    def _build_source(self, alias, stamp):
+        matcher = self._get_matcher()
+        matcher.loaded_sources.pop(alias, None)
+        data = matcher._load_source(alias)
+        if data is None:
+            return None
+
+        scenes = data["scenes"]
+        by_character = {}
+        for idx, scene in enumerate(scenes):
+            for name in scene["content"].get("characters", []):
+                by_character.setdefault(name, []).append(idx)
+
+        # Матчеру данные больше не нужны: индекс живет здесь
+        matcher.loaded_sources.pop(alias, None)
+
+        return {
+            "stamp": stamp,
+            "scenes": scenes,
+            "matrix": data["matrix"].cpu().numpy(),
+            "shot_types": np.array([scene["visual"].get("shot_type", "Unknown") for scene in scenes]),
+            "by_character": {name: np.array(idxs) for name, idxs in by_character.items()}
+        }
+
+    def _get_source(self, alias):
+        stamp = self._stamp(self.library_path / alias)
+        if stamp is None:
+            with self._lock:
+                self._sources.pop(alias, None)
+            return None
+
+        entry = self._sources.get(alias)
+        if entry is not None and entry["stamp"] == stamp:
+            return entry
+
+        # Старый индекс отдаем, пока новый строит другой поток; ждем только первую загрузку
+        if not self._build_lock.acquire(blocking=entry is None):
+            return entry
+        try:
+            current = self._sources.get(alias)
+            if current is not None and current["stamp"] == stamp:
+                return current
+            started = time.perf_counter()
+            fresh = self._build_source(alias, stamp)
+            if fresh is None:
+                return None
+            with self._lock:
+                self._sources[alias] = fresh
+            logger.info(f"🔎 Search index for '{alias}': {len(fresh['scenes'])} scenes in {time.perf_counter() - started:.2f}s")
+            return fresh
+        finally:
+            self._build_lock.release()
+
+    def warm_up(self):
+        """Грузит модель и индексы всех готовых фильмов заранее (фоновый поток на старте)."""
+        started = time.perf_counter()
+        try:
+            self._get_matcher()
+            for alias in self.available_sources():
+                self._get_source(alias)
+        except Exception as e:
+            logger.warning(f"⚠️ Scene search warm-up failed: {e}")
+            return
+        logger.info(f"🔥 Scene search ready: {len(self._sources)} sources in {time.perf_counter() - started:.1f}s")
+
+    # === ПОИСК ===
+
+    def _encode(self, query):
+        with self._lock:
+            vector = self._query_cache.get(query)
+        if vector is None:
+            vector = self._get_matcher()._encode_query(query).squeeze(0).cpu().numpy()
+            with self._lock:
+                if len(self._query_cache) >= QUERY_CACHE_SIZE:
+                    self._query_cache.pop(next(iter(self._query_cache)))
+                self._query_cache[query] = vector
+        return vector
+
+    def search(self, query, top_k=20, character=None, shot_type=None, sources=None):
+        """
+        Returns:
+            dict: {"results": [...], "took_ms": ...}
+        """
+        started = time.perf_counter()
+        vector = self._encode(query)
+        aliases = sources if sources else self.available_sources()
+        entries = [(alias, self._get_source(alias)) for alias in aliases]
+        results = self.rank(vector, [(a, e) for a, e in entries if e is not None], top_k, character, shot_type)
+
+        return {"results": results, "took_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    def rank(self, vector, entries, top_k, character=None, shot_type=None):
+        """Top-k сцен по косинусной близости среди индексов entries [(alias, entry)]."""
+        candidates = []
+        for alias, entry in entries:
+            scores = entry["matrix"] @ vector
+
+            if character or shot_type:
+                mask = np.ones(len(scores), dtype=bool)
+                if character:
+                    mask[:] = False
+                    idxs = entry["by_character"].get(character)
+                    if idxs is not None:
+                        mask[idxs] = True
+                if shot_type:
+                    mask &= entry["shot_types"] == shot_type
+                scores = np.where(mask, scores, -np.inf)
+
+            k = min(top_k, len(scores))
+            if k == 0:
+                continue
+            top = np.argpartition(-scores, k - 1)[:k]
+            for idx in top:
+                if np.isfinite(scores[idx]):
+                    candidates.append((float(scores[idx]), alias, int(idx), entry))
+
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        return [self._result(score, alias, entry["scenes"][idx]) for score, alias, idx, entry in candidates[:top_k]]
+
+    def _result(self, score, alias, scene):
+        keyframe = Path(scene["visual"].get("path") or "").name
+        return {
+            "source": alias,
+            "scene_id": scene["id"],
+            # Тот же масштаб, что и match_score в EDL (косинус * 100)
+            "score": round(score * 100.0, 2),
+            "in_point": scene["time"]["start"],
+            "out_point": scene["time"]["end"],
+            "shot_type": scene["visual"].get("shot_type"),
+            "characters": scene["content"].get("characters", []),
+            # Ссылку на превью (с версией кейфрейма) добавляет сервер
+            "keyframe": keyframe
+        }
+
+
+def _synthetic_entries(films, scenes_per_film, dim, seed=0):
+    """Случайные индексы размера реальной библиотеки (без диска и модели)."""
+    rng = np.random.default_rng(seed)
+    shot_types = np.array(["Close-Up", "Medium Shot", "Wide Angle", "Extreme Close-Up"])
+    entries = []
+    for f in range(films):
+        matrix = rng.standard_normal((scenes_per_film, dim)).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        scenes = [
+            {"id": f"scene_{i:04d}", "time": {"start": i * 3.0, "end": i * 3.0 + 3.0},
+             "visual": {"shot_type": str(shot_types[i % 4]), "path": f"scene_{i:04d}_1.jpg"},
+             "content": {"characters": ["Hero"] if i % 5 == 0 else []}}
+            for i in range(scenes_per_film)
+        ]
+        entries.append((f"film_{f:03d}", {
+            "stamp": None,
+            "scenes": scenes,
+            "matrix": matrix,
+            "shot_types": shot_types[np.arange(scenes_per_film) % 4],
+            "by_character": {"Hero": np.arange(0, scenes_per_film, 5)}
+        }))
+    return entries
+
+
+def benchmark(films=100, scenes_per_film=1500, dim=512, queries=50, library_path=None):
+    """
+    Латентность поиска. С library_path - реальная библиотека и модель (полный
+    путь запроса), без него - синтетические индексы и случайные запросы
+    (только ранжирование, без энкодинга текста).
+    """
+    if library_path:
+        search = SceneSearch(library_path)
+        search.warm_up()
+        words = ["man walking in the rain", "city at night", "close-up of a face", "car chase", "empty room"]
+        timings = [search.search(f"{words[i % len(words)]} {i}")["took_ms"] for i in range(queries)]
+    else:
+        search = SceneSearch(".")
+        entries = _synthetic_entries(films, scenes_per_film, dim)
+        rng = np.random.default_rng(1)
+        timings = []
+        for i in range(queries):
+            vector = rng.standard_normal(dim).astype(np.float32)
+            vector /= np.linalg.norm(vector)
+            started = time.perf_counter()
+            search.rank(vector, entries, 20, character="Hero" if i % 2 else None)
+            timings.append((time.perf_counter() - started) * 1000)
+
+    timings = np.array(timings)
+    return {
+        "queries": len(timings),
+        "p50_ms": round(float(np.percentile(timings, 50)), 1),
+        "p95_ms": round(float(np.percentile(timings, 95)), 1),
+        "max_ms": round(float(timings.max()), 1)
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Scene search latency benchmark")
+    parser.add_argument("--library", default=None, help="Реальная библиотека (иначе синтетика)")
+    parser.add_argument("--films", type=int, default=100)
+    parser.add_argument("--scenes", type=int, default=1500)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    print(benchmark(args.films, args.scenes, queries=args.queries, library_path=args.library))
@@ -1,4 +1,5 @@
 import json
+import difflib
 import logging
 import torch
 import clip
@@ -6,20 +7,37 @@ import numpy as np
 from pathlib import Path
 from tqdm import tqdm
 
+from src.utils.model_registry import model_registry
+from src.matching.clip_text_encoder import load_text_encoder
+
 logger = logging.getLogger(__name__)
 
 class SmartMatcher:
-    def __init__(self, library_path, model_name="ViT-B/32"):
+    def __init__(self, library_path, model_name="ViT-B/32", text_only=True):
         self.library_path = Path(library_path)
         # CLIP для текста очень легкий, CPU справляется мгновенно
         self.device = "cpu" 
         
-        logger.info(f"🧠 Loading CLIP model for matching...")
-        self.model, _ = clip.load(model_name, device=self.device)
+        if text_only:
+            # Матчеру нужен только encode_text: визуальную башню не грузим
+            self.model = model_registry.get(
+                ("clip-text", model_name, self.device),
+                lambda: load_text_encoder(model_name)
+            )
+        else:
+            # Та же модель, что и у ClipEncoder на CPU: грузится один раз на процесс
+            self.model, _ = model_registry.get(
+                ("clip", model_name, self.device),
+                lambda: self._create_model(model_name)
+            )
         
         # Кэш для загруженных данных фильмов
         self.loaded_sources = {}
 
+    def _create_model(self, model_name):
+        logger.info(f"🧠 Loading CLIP model for matching...")
+        return clip.load(model_name, device=self.device)
+
     def _load_source(self, source_name):
         """Загружает индекс и эмбеддинги фильма в память."""
         if source_name in self.loaded_sources:
@@ -83,7 +101,152 @@ class SmartMatcher:
         self.loaded_sources[source_name] = data
         return data
 
-    def match(self, script_path, output_path, source_names):
+    def _encode_query(self, query_text):
+        # Токенизация и энкодинг текста
+        text_token = clip.tokenize([query_text], truncate=True).to(self.device)
+
+        with torch.no_grad():
+            text_emb = self.model.encode_text(text_token).float()
+
+            # !!! ИСПРАВЛЕНИЕ: В PyTorch аргумент называется keepdim (единственное число) !!!
+            text_emb /= text_emb.norm(dim=-1, keepdim=True)
+        return text_emb
+
+    def _find_best(self, segment, active_sources, used_scene_ids):
+        """Лучшая сцена для сегмента среди всех источников -> (score, scene, source_name)."""
+        target_char = segment.get("character")
+        target_shot = segment.get("shot_type")
+
+        text_emb = self._encode_query(segment.get("visual_query", ""))
+
+        best_score = -10000
+        best_match = None
+        best_source = None
+
+        # Поиск по всем фильмам
+        for src_data in active_sources:
+            # Матричное умножение (Cosine Similarity)
+            # Результат: массив схожести для всех сцен сразу
+            sim_scores = (text_emb @ src_data["matrix"].T).squeeze(0).cpu().numpy()
+
+            for idx, scene in enumerate(src_data["scenes"]):
+                s_id = scene['id']
+
+                # Базовый скор от CLIP (обычно от 15 до 35)
+                score = sim_scores[idx] * 100.0 
+
+                # --- СИСТЕМА ФИЛЬТРОВ И ШТРАФОВ ---
+
+                # A. Фильтр Персонажа (Самый важный)
+                scene_chars = scene["content"].get("characters", [])
+
+                if target_char:
+                    # Если ищем конкретного героя
+                    if target_char in scene_chars:
+                        score += 500 # Огромный бонус, если нашли
+                    else:
+                        score -= 500 # Огромный штраф, если героя нет
+                else:
+                    # Если ищем B-Roll (пейзаж, деталь), а в кадре герои
+                    if scene_chars: 
+                        score -= 50 # Небольшой штраф, лучше найти пустой кадр
+
+                # B. Фильтр Типа Кадра (Close-Up, Wide...)
+                scene_shot = scene["visual"].get("shot_type", "Unknown")
+                if target_shot and scene_shot == target_shot:
+                    score += 50 # Бонус за правильную крупность плана
+
+                # C. Защита от повторов
+                if s_id in used_scene_ids:
+                    score -= 10000 # Запрещаем использовать сцену повторно
+
+                # Запоминаем лидера
+                if score > best_score:
+                    best_score = score
+                    best_match = scene
+                    best_source = src_data["source_name"]
+
+        return best_score, best_match, best_source
+
+    def _make_entry(self, segment, best_match, best_source, best_score, active_sources):
+        best_source_data = next((s for s in active_sources if s["source_name"] == best_source), None)
+        video_path = best_source_data["source_video_path"] if best_source_data else None
+
+        return {
+            "segment_id": segment.get("segment_id", 0),
+            "text": segment.get("text"),
+            # Путь к картинке (для дебага)
+            "source_file": best_match["visual"]["path"], 
+            "source_project_alias": best_source,
+            "source_video_path": video_path,
+            "scene_id": best_match['id'],
+            # Таймкоды
+            "in_point": best_match['time']['start'],
+            "out_point": best_match['time']['end'],
+            "duration": best_match['time']['end'] - best_match['time']['start'],
+            "target_duration": segment.get('target_duration', segment['end'] - segment['start']),
+            # Метаданные
+            "match_score": float(best_score),
+            "shot_type": best_match["visual"]["shot_type"],
+            "characters": best_match["content"]["characters"],
+            # Запрос, по которому искали (ключ для инкрементального ре-матчинга)
+            "query": self._query_signature(segment)
+        }
+
+    # ------------------------------------------------------------------
+    # Incremental
+    # ------------------------------------------------------------------
+
+    def _query_signature(self, segment):
+        return {
+            "text": " ".join((segment.get("text") or "").split()),
+            "visual_query": segment.get("visual_query", ""),
+            "character": segment.get("character"),
+            "shot_type": segment.get("shot_type")
+        }
+
+    def _keep_previous_cuts(self, script, previous_edl, active_sources):
+        """
+        Сопоставляет новый сценарий со старым EDL по тексту + запросу.
+
+        Из старого EDL берется только выбор сцены (источник + scene_id);
+        таймкоды и путь к видео - из текущих данных источника, чтобы
+        переиндексированный фильм не дал устаревших склеек.
+
+        Returns:
+            dict: {индекс сегмента в script: (scene, source_name, match_score)} для
+            неизмененных сегментов, чья сцена все еще есть в активных источниках
+        """
+        available = {
+            src["source_name"]: {scene['id']: scene for scene in src["scenes"]}
+            for src in active_sources
+        }
+
+        # EDL старого формата (без "query") сопоставить нельзя -> полный матчинг
+        old_keys = [json.dumps(cut.get("query"), sort_keys=True) if cut.get("query") else None for cut in previous_edl]
+        new_keys = [json.dumps(self._query_signature(seg), sort_keys=True) for seg in script]
+
+        matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+        kept = {}
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag != "equal":
+                continue
+            for offset in range(i2 - i1):
+                cut = previous_edl[i1 + offset]
+                if old_keys[i1 + offset] is None:
+                    continue
+                scene = available.get(cut.get("source_project_alias"), {}).get(cut.get("scene_id"))
+                if scene is not None:
+                    kept[j1 + offset] = (scene, cut["source_project_alias"], cut.get("match_score", 0.0))
+        return kept
+
+    def match(self, script_path, output_path, source_names, previous_edl_path=None):
+        """
+        Args:
+            previous_edl_path: EDL прошлой сборки. Если задан, склейки неизмененных
+                сегментов сохраняются (их сцены резервируются), а заново
+                матчатся только измененные/новые сегменты.
+        """
         script_path = Path(script_path)
         with open(script_path, 'r') as f:
             script = json.load(f)
@@ -93,107 +256,47 @@ class SmartMatcher:
         for src in source_names:
             data = self._load_source(src)
             if data: active_sources.append(data)
-            
+
         if not active_sources:
             logger.error("No valid sources loaded!")
             return
 
+        previous_edl = []
+        if previous_edl_path and Path(previous_edl_path).exists():
+            try:
+                with open(previous_edl_path, 'r') as f:
+                    previous_edl = json.load(f)
+            except Exception as e:
+                logger.warning(f"⚠️ Previous EDL unreadable, full re-match: {e}")
+
+        kept = self._keep_previous_cuts(script, previous_edl, active_sources) if previous_edl else {}
+        used_scene_ids = {scene['id'] for scene, _, _ in kept.values()} # Сет использованных сцен для защиты от повторов
+
+        if kept:
+            logger.info(f"♻️ Keeping {len(kept)} cuts from previous EDL, re-matching {len(script) - len(kept)} segments...")
+        else:
+            logger.info(f"🎯 Matching {len(script)} segments...")
+
         final_edl = [] 
-        used_scene_ids = set() # Сет использованных сцен для защиты от повторов
 
-        logger.info(f"🎯 Matching {len(script)} segments...")
+        for idx, segment in enumerate(tqdm(script, desc="Matching")):
+            if idx in kept:
+                # Сцена та же; запись собирается заново из текущих данных сцены и сегмента
+                scene, source_name, score = kept[idx]
+                final_edl.append(self._make_entry(segment, scene, source_name, score, active_sources))
+                continue
 
-        for segment in tqdm(script, desc="Matching"):
-            query_text = segment.get("visual_query", "")
-            target_char = segment.get("character")
-            target_shot = segment.get("shot_type")
-            
-            # 2. Токенизация и энкодинг текста
-            text_token = clip.tokenize([query_text], truncate=True).to(self.device)
-            
-            with torch.no_grad():
-                text_emb = self.model.encode_text(text_token).float()
-                
-                # !!! ИСПРАВЛЕНИЕ: В PyTorch аргумент называется keepdim (единственное число) !!!
-                text_emb /= text_emb.norm(dim=-1, keepdim=True)
-
-            best_score = -10000
-            best_match = None
-            best_source = None
-
-            # 3. Поиск по всем фильмам
-            for src_data in active_sources:
-                # Матричное умножение (Cosine Similarity)
-                # Результат: массив схожести для всех сцен сразу
-                sim_scores = (text_emb @ src_data["matrix"].T).squeeze(0).cpu().numpy()
-
-                for idx, scene in enumerate(src_data["scenes"]):
-                    s_id = scene['id']
-                    
-                    # Базовый скор от CLIP (обычно от 15 до 35)
-                    score = sim_scores[idx] * 100.0 
-
-                    # --- СИСТЕМА ФИЛЬТРОВ И ШТРАФОВ ---
-
-                    # A. Фильтр Персонажа (Самый важный)
-                    scene_chars = scene["content"].get("characters", [])
-                    
-                    if target_char:
-                        # Если ищем конкретного героя
-                        if target_char in scene_chars:
-                            score += 500 # Огромный бонус, если нашли
-                        else:
-                            score -= 500 # Огромный штраф, если героя нет
-                    else:
-                        # Если ищем B-Roll (пейзаж, деталь), а в кадре герои
-                        if scene_chars: 
-                            score -= 50 # Небольшой штраф, лучше найти пустой кадр
-
-                    # B. Фильтр Типа Кадра (Close-Up, Wide...)
-                    scene_shot = scene["visual"].get("shot_type", "Unknown")
-                    if target_shot and scene_shot == target_shot:
-                        score += 50 # Бонус за правильную крупность плана
-                    
-                    # C. Защита от повторов
-                    if s_id in used_scene_ids:
-                        score -= 10000 # Запрещаем использовать сцену повторно
-
-                    # Запоминаем лидера
-                    if score > best_score:
-                        best_score = score
-                        best_match = scene
-                        best_source = src_data["source_name"]
-
-            # 4. Сохранение результата
+            best_score, best_match, best_source = self._find_best(segment, active_sources, used_scene_ids)
+
+            # Сохранение результата
             if best_match:
                 used_scene_ids.add(best_match['id'])
-                best_source_data = next((s for s in active_sources if s["source_name"] == best_source), None)
-                video_path = best_source_data["source_video_path"] if best_source_data else None
-                
-                edit_entry = {
-                    "segment_id": segment.get("segment_id", 0),
-                    "text": segment.get("text"),
-                    # Путь к картинке (для дебага)
-                    "source_file": best_match["visual"]["path"], 
-                    "source_project_alias": best_source,
-                    "source_video_path": video_path,
-                    "scene_id": best_match['id'],
-                    # Таймкоды
-                    "in_point": best_match['time']['start'],
-                    "out_point": best_match['time']['end'],
-                    "duration": best_match['time']['end'] - best_match['time']['start'],
-                    "target_duration": segment.get('target_duration', segment['end'] - segment['start']),
-                    # Метаданные
-                    "match_score": float(best_score),
-                    "shot_type": best_match["visual"]["shot_type"],
-                    "characters": best_match["content"]["characters"]
-                }
-                final_edl.append(edit_entry)
+                final_edl.append(self._make_entry(segment, best_match, best_source, best_score, active_sources))
             else:
                 logger.warning(f"⚠️ No match found for segment: {segment.get('text', '')[:20]}...")
 
         # Сохраняем в JSON
         with open(output_path, 'w') as f:
             json.dump(final_edl, f, indent=2)
-            
-        logger.info(f"✅ Created Edit Decision List with {len(final_edl)} cuts: {output_path}")
\ No newline at end of file
+
+        logger.info(f"✅ Created Edit Decision List with {len(final_edl)} cuts: {output_path}")
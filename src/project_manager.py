@@ -1,11 +1,12 @@
 import os
 import sys
-import time
 import yaml
 import argparse
 import json
 import shutil
+import hashlib
 import logging
+import functools
 from pathlib import Path
 
 # Настройка путей проекта
@@ -23,16 +24,14 @@ from src.utils.app_paths import (
     get_app_data_dir
 )
 
-# Импорты модулей проекта
-from src.ingestion.scene_indexer import SceneIndexer
-from src.ingestion.flicker_fixer import FlickerFixer
-from src.ingestion.face_processor import FaceProcessor
-from src.ingestion.clip_encoder import ClipEncoder
-from src.ingestion.metadata_manager import MetadataManager
-from src.analysis.audio_processor import AudioProcessor
-from src.analysis.director_agent import DirectorAgent
-from src.matching.smart_matcher import SmartMatcher
-from src.matching.premiere_exporter import PremiereExporter
+# Импорты модулей проекта.
+# Стадии пайплайна (torch, whisper, clip, insightface, sklearn, scenedetect,
+# google.generativeai) импортируются внутри ingest_source/build_project:
+# сервер должен отвечать на /status раньше, чем они загрузятся.
+from src.utils.response_cache import configure_shared_cache
+from src.utils.llm_providers import configure_llm_backend
+from src.utils.model_registry import model_registry
+from src.utils.job_registry import job_registry, JobCancelled, READY, FAILED, CANCELLED
 
 # Настройка логирования
 logging.basicConfig(
@@ -42,6 +41,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _leases_models(method):
+    """Модели, полученные джобой, не выгружаются до ее конца (см. ModelRegistry.lease)."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with model_registry.lease():
+            return method(*args, **kwargs)
+    return wrapper
+
+
 class ProjectManager:
     """Управляет проектами видео-эссе и библиотекой источников."""
     
@@ -61,6 +69,27 @@ class ProjectManager:
         
         # Загружаем конфиг
         self.config = self._load_config()
+
+        # Общий кэш ответов Gemini (DirectorAgent + MetadataManager)
+        gemini_cfg = self.config.get("gemini", {})
+        configure_shared_cache(
+            enabled=gemini_cfg.get("cache", True),
+            ttl_hours=gemini_cfg.get("cache_ttl_hours", 24 * 7),
+            max_mb=gemini_cfg.get("cache_max_mb", 200)
+        )
+
+        # Теплый пул моделей: простаивающие дольше TTL выгружаются
+        model_registry.configure(
+            idle_ttl_minutes=self.config.get("model_pool", {}).get("idle_ttl_minutes", 15)
+        )
+
+        # LLM-бэкенд: настоящий Gemini или локальный детерминированный (офлайн/CI)
+        llm_cfg = self.config.get("llm", {})
+        provider = llm_cfg.get("provider", "gemini")
+        if provider == "local":
+            configure_llm_backend(provider, latency=llm_cfg.get("local_latency", 0.0))
+        else:
+            configure_llm_backend(provider)
         
         # Настраиваем директории (используя app_paths)
         self._setup_directories()
@@ -135,7 +164,28 @@ class ProjectManager:
 
     # === КОМАНДА 2: ИНДЕКСАЦИЯ ИСТОЧНИКА ===
     
-    def ingest_source(self, file_path, alias, fullname=None, progress_callback=None):
+    def create_job(self, kind, target, sources=None):
+        """
+        Регистрирует джобу ingest/build в job_registry.
+
+        Файл статуса (.ingest_status.json / project_meta.json) ведет сама
+        джоба: он переписывается только при смене стадии.
+        """
+        if kind == "ingest":
+            return job_registry.create(
+                "ingest", target,
+                status_path=self.library_path / target / ".ingest_status.json",
+                running_status="processing"
+            )
+        return job_registry.create(
+            "build", target,
+            status_path=self.projects_path / target / "project_meta.json",
+            status_fields={"sources": sources},
+            running_status="building"
+        )
+
+    @_leases_models
+    def ingest_source(self, file_path, alias, fullname=None, progress_callback=None, job=None):
         """
         Индексирует видеофайл и добавляет его в библиотеку.
         
@@ -144,101 +194,148 @@ class ProjectManager:
             alias: Короткое имя для библиотеки
             fullname: Полное название фильма (опционально)
             progress_callback: Функция для отчета о прогрессе (percent, text)
+            job: Джоба из create_job (None - создается здесь)
         """
+        if job is None:
+            job = self.create_job("ingest", alias)
+
         file_path = Path(file_path)
         if not file_path.exists():
             logger.error(f"Source file not found: {file_path}")
+            # Папку в библиотеке под несуществующий файл не создаем
+            job.status_path = None
+            job.finish(FAILED, "Error: source file not found", error=str(file_path))
             return
 
         source_name = alias
         movie_real_name = fullname if fullname else alias
         target_dir = self.library_path / source_name
-        status_file = target_dir / ".ingest_status.json"
-
-        def save_ingest_state(status, percent=0, text=""):
-            """Сохраняет состояние обработки в файл."""
-            self._ensure_dir(target_dir)
-            status_data = {
-                "status": status,
-                "percent": percent,
-                "progress_text": text,
-                "last_updated": time.time()
-            }
-            with open(status_file, "w") as f:
-                json.dump(status_data, f, indent=2)
 
-        def report(percent, text):
-            """Отправляет прогресс в callback и сохраняет в файл."""
+        def report(percent, text, stage=None, items=None):
+            """Обновляет джобу (файл пишется только при смене стадии) и отправляет callback."""
+            job.update(percent, text, stage=stage, items=items)
             if progress_callback:
                 progress_callback(percent, text)
-            save_ingest_state("processing", percent, text)
 
-        # Начало обработки
-        report(0, "Initializing...")
-        
+        def fail(text, error=None):
+            job.finish(FAILED, text, error=error)
+            if progress_callback:
+                progress_callback(0, text)
+
         try:
+            # Начало обработки
+            report(0, "Initializing...", stage="init")
+
             logger.info(f"🚀 Starting ingestion for '{movie_real_name}'...")
 
+            # Ленивые импорты: тяжелые зависимости грузятся только при реальной работе
+            from src.ingestion.scene_indexer import SceneIndexer
+            from src.ingestion.flicker_fixer import FlickerFixer
+            from src.ingestion.face_processor import FaceProcessor
+            from src.ingestion.clip_encoder import ClipEncoder
+            from src.ingestion.ingest_pipeline import IngestPipeline
+            from src.ingestion.metadata_manager import MetadataManager
+            from src.ingestion.scene_store import SceneStore
+
             # STEP 1: Детекция сцен
-            report(10, "Detecting Scenes...")
+            report(10, "Detecting Scenes...", stage="scenes")
             indexer = SceneIndexer(file_path, target_dir)
             indexer.process()
 
             # STEP 1.5: Исправление мерцаний
-            report(25, "Fixing Flickers...")
+            report(25, "Fixing Flickers...", stage="flicker")
             try:
                 fixer = FlickerFixer(target_dir)
                 fixer.fix(offset=0.2)
             except Exception as e:
                 logger.warning(f"Flicker Fixer skipped/failed: {e}")
 
-            # STEP 2: Детекция лиц
-            report(30, "Scanning Faces (This takes time)...")
+            # STEP 2-3: Детекция лиц + CLIP эмбеддинги (параллельно, один поток кейфреймов)
+            report(30, "Scanning Faces & Building Index...", stage="faces_clip")
             fp = FaceProcessor(target_dir)
-            fp.process_faces()
+            clip_model = self.config.get("models", {}).get("clip", "ViT-B/32")
+            clip_encoder = ClipEncoder(target_dir, model_name=clip_model)
 
-            # STEP 3: CLIP эмбеддинги
-            report(80, "Building Index...")
-            try:
-                logger.info("🎨 Generating CLIP embeddings...")
-                clip_model = self.config.get("models", {}).get("clip", "ViT-B/32")
-                clip_encoder = ClipEncoder(target_dir, model_name=clip_model)
-                clip_encoder.process_embeddings()
-            except Exception as e:
-                logger.error(f"Failed during CLIP encoding: {e}")
-                save_ingest_state("failed", 0, "Error occurred")
-                if progress_callback:
-                    progress_callback(0, "Error occurred")
+            stages = {"clip": clip_encoder}
+            if fp.has_results():
+                logger.info("⏭️  Face data exists. Skipping.")
+            else:
+                stages["faces"] = fp
+
+            stage_progress = {name: 0.0 for name in stages}
+            stage_done = {name: 0 for name in stages}
+            stage_labels = {"faces": "Faces", "clip": "CLIP"}
+
+            def report_stage(stage, done, total):
+                """Сводит прогресс стадий в общий процент (30..80)."""
+                if job.cancelled:
+                    return
+                stage_progress[stage] = done / total if total else 1.0
+                stage_done[stage] = done
+                overall = sum(stage_progress.values()) / len(stage_progress)
+                text = " · ".join(
+                    f"{stage_labels.get(name, name)} {int(value * 100)}%"
+                    for name, value in stage_progress.items()
+                )
+                # Пропускная способность считается по самой медленной стадии
+                report(30 + int(overall * 50), text, items=min(stage_done.values()))
+
+            logger.info("🎨 Scanning faces and generating CLIP embeddings...")
+            pipeline = IngestPipeline(
+                target_dir / "keyframes",
+                stages,
+                progress_callback=report_stage,
+                should_stop=lambda: job.cancelled
+            )
+            errors = pipeline.run()
+            job.raise_if_cancelled()
+
+            if "faces" in errors:
+                raise errors["faces"]
+
+            if "clip" in errors:
+                logger.error(f"Failed during CLIP encoding: {errors['clip']}")
+                fail("Error occurred", error=str(errors["clip"]))
                 return
 
             # STEP 4: Агрегация метаданных
-            report(90, "Building Index...")
+            report(90, "Building Index...", stage="metadata")
             try:
                 logger.info(f"🧠 Linking everything together for '{movie_real_name}'...")
                 meta = MetadataManager(
                     target_dir,
                     movie_name=movie_real_name,
-                    source_video_path=file_path
+                    source_video_path=file_path,
+                    use_collage=self.config.get("gemini", {}).get("character_collage", True)
                 )
                 meta.build_master_index()
             except Exception as e:
                 logger.error(f"Failed during metadata aggregation: {e}")
-                save_ingest_state("failed", 0, "Error occurred")
-                if progress_callback:
-                    progress_callback(0, "Error occurred")
+                fail("Error occurred", error=str(e))
                 return
 
+            # Постраничный доступ к сценам для /library/{alias}/scenes.
+            # Не критично: сервер соберет хранилище сам при первом запросе
+            try:
+                SceneStore(target_dir).build()
+            except Exception as e:
+                logger.warning(f"⚠️ Scene store not built for '{alias}' (will be rebuilt on demand): {e}")
+
             # Завершение
-            save_ingest_state("ready", 100, "Ready")
+            job.finish(READY, "Ready")
             if progress_callback:
                 progress_callback(100, "Ready")
             logger.info(f"🎉 Source '{source_name}' is FULLY INDEXED inside library.")
+
+        except JobCancelled:
+            logger.warning(f"🛑 Ingest of '{source_name}' cancelled")
+            job.finish(CANCELLED, "Cancelled")
+            if progress_callback:
+                progress_callback(job.percent, "Cancelled")
             
         except Exception as e:
             logger.error(f"❌ INGEST FAILED: {e}")
-            save_ingest_state("failed", 0, f"Error: {str(e)}")
-            if progress_callback:
-                progress_callback(0, f"Error: {str(e)}")
+            fail(f"Error: {str(e)}", error=str(e))
 
     # === ПОЛУЧЕНИЕ ИНФОРМАЦИИ О ПРОЕКТЕ ===
     
@@ -277,6 +374,11 @@ class ProjectManager:
             except Exception:
                 pass
 
+        # Живой прогресс идущей сборки берем из памяти: файл пишется только на смене стадий
+        job = job_registry.find_active("build", project_name)
+        if job is not None:
+            meta.update(status=job.status_value(), percent=job.percent, progress_text=job.text)
+
         return {
             "name": project_name,
             "path": str(project_dir),  # Добавляем путь
@@ -289,7 +391,8 @@ class ProjectManager:
 
     # === КОМАНДА 3: СБОРКА ПРОЕКТА ===
     
-    def build_project(self, project_name, sources_list, audio_path=None, progress_callback=None):
+    @_leases_models
+    def build_project(self, project_name, sources_list, audio_path=None, progress_callback=None, script_path=None, incremental=None, job=None):
         """
         Генерирует монтаж для проекта.
         
@@ -298,14 +401,24 @@ class ProjectManager:
             sources_list: Список источников или строка через запятую
             audio_path: Путь к аудиофайлу (опционально)
             progress_callback: Функция для отчета о прогрессе
+            script_path: Текст эссе (.txt), если он уже известен (опционально)
+            incremental: Перематчить только измененные сегменты прошлого EDL
+                (None - из config.yaml, matching.incremental)
+            job: Джоба из create_job (None - создается здесь)
         """
         logger.info(f"🔨 Building project '{project_name}'...")
 
         project_dir = self.projects_path / project_name
         if not project_dir.exists():
             logger.error(f"Project '{project_name}' not found. Run 'create' first.")
+            if job is not None:
+                job.status_path = None
+                job.finish(FAILED, "Error: project not found")
             return
 
+        if job is None:
+            job = self.create_job("build", project_name, sources=sources_list)
+
         input_dir = project_dir / "input"
         output_dir = project_dir / "output"
         artifacts_dir = project_dir / "artifacts"
@@ -314,30 +427,22 @@ class ProjectManager:
         self._ensure_dir(output_dir)
         self._ensure_dir(artifacts_dir)
 
-        meta_path = project_dir / "project_meta.json"
-
-        def save_state(status, percent=0, text=""):
-            """Сохраняет состояние сборки в файл."""
-            meta_data = {
-                "sources": sources_list,
-                "status": status,
-                "percent": percent,
-                "progress_text": text,
-                "last_updated": time.time()
-            }
-            with open(meta_path, "w") as f:
-                json.dump(meta_data, f, indent=2)
-
-        def report(percent, text):
-            """Отправляет прогресс в callback и сохраняет в файл."""
+        def report(percent, text, stage=None):
+            """Обновляет джобу (файл пишется только при смене стадии) и отправляет callback."""
+            job.update(percent, text, stage=stage)
             if progress_callback:
                 progress_callback(percent, text)
-            save_state("building", percent, text)
-
-        # Начало сборки
-        report(0, "Initializing workspace...")
 
         try:
+            # Начало сборки
+            report(0, "Initializing workspace...", stage="prepare")
+
+            # Ленивые импорты: тяжелые зависимости грузятся только при реальной работе
+            from src.analysis.audio_processor import AudioProcessor
+            from src.analysis.director_agent import DirectorAgent
+            from src.matching.smart_matcher import SmartMatcher
+            from src.matching.premiere_exporter import PremiereExporter
+
             # Копирование аудио (опционально)
             if audio_path:
                 src_audio = Path(audio_path)
@@ -359,6 +464,17 @@ class ProjectManager:
 
             audio_path = audio_files[0]
             logger.info(f"✅ Audio verified: {audio_path.name}")
+
+            # Текст эссе (опционально): выравниваем его по аудио вместо распознавания
+            script_text_path = input_dir / "script.txt"
+            if script_path:
+                src_script = Path(script_path)
+                if not src_script.exists():
+                    raise Exception(f"Script file not found: {script_path}")
+                shutil.copy2(src_script, script_text_path)
+                logger.info(f"📝 Script text copied: {script_text_path.name}")
+            if not script_text_path.exists():
+                script_text_path = None
             report(10, "Audio verified")
 
             # Нормализация списка источников
@@ -376,42 +492,93 @@ class ProjectManager:
                     raise Exception(f"Source '{src}' not found in library")
 
             logger.info(f"🎬 Sources verified: {source_list}")
-            report(20, "Sources verified")
+            report(20, "Sources verified", stage="transcribe")
 
             # STEP 1: Транскрипция через Whisper
+            # Пересчитываем, только если аудио реально поменялось (по хэшу)
             transcript_path = artifacts_dir / "transcript.json"
-
-            if transcript_path.exists():
-                logger.info("⏭ Transcript exists, skipping Whisper")
+            state_path = artifacts_dir / "build_state.json"
+            build_state = self._load_build_state(state_path)
+            audio_hash = self._file_hash(audio_path)
+            script_hash = self._file_hash(script_text_path) if script_text_path else None
+            transcript_changed = False
+
+            if (transcript_path.exists()
+                    and build_state.get("audio_hash") in (None, audio_hash)
+                    and build_state.get("script_hash") == script_hash):
+                # None - сборка старой версии без хэша: доверяем существующему транскрипту
+                logger.info("⏭ Transcript is up to date, skipping Whisper")
             else:
-                logger.info("🎙 Running Whisper...")
+                if transcript_path.exists():
+                    logger.info("🔄 Voiceover or script changed since last build, re-transcribing...")
+                logger.info("📐 Aligning script text with Whisper..." if script_text_path else "🎙 Running Whisper...")
+                audio_cfg = self.config.get("audio", {})
                 processor = AudioProcessor(
-                    model_size=self.config["models"]["whisper"]
+                    model_size=self.config["models"]["whisper"],
+                    workers=audio_cfg.get("whisper_workers", 2),
+                    chunk_seconds=audio_cfg.get("chunk_seconds", 300)
                 )
-                processor.process(audio_path, transcript_path)
+                processor.process(audio_path, transcript_path, script_text_path=script_text_path)
+                transcript_changed = True
 
-            report(40, "Transcript ready")
+            transcript_hash = self._file_hash(transcript_path)
+            build_state["audio_hash"] = audio_hash
+            build_state["script_hash"] = script_hash
+            if transcript_changed:
+                # До успешного прогона Director script.json считается устаревшим
+                build_state["transcript_hash"] = None
+            self._save_build_state(state_path, build_state)
+
+            report(40, "Transcript ready", stage="director")
 
             # STEP 2: Генерация скрипта через Director Agent
+            # При новом транскрипте Director сам переиспользует шоты неизмененных сегментов
             script_path = artifacts_dir / "script.json"
 
-            if script_path.exists():
-                logger.info("⏭ Script exists, skipping Director")
+            # transcript_hash - хэш транскрипта, по которому написан script.json
+            # (нет ключа - сборка старой версии: доверяем скрипту, если транскрипт не менялся)
+            if "transcript_hash" in build_state:
+                script_fresh = build_state["transcript_hash"] == transcript_hash
+            else:
+                script_fresh = not transcript_changed
+
+            if script_path.exists() and script_fresh:
+                logger.info("⏭ Script is up to date, skipping Director")
             else:
                 logger.info("🎬 Director Agent running...")
-                director = DirectorAgent(self.library_path)
-                director.process(transcript_path, script_path, source_list)
+                gemini_cfg = self.config.get("gemini", {})
+                director = DirectorAgent(
+                    self.library_path,
+                    concurrency=gemini_cfg.get("director_concurrency", 4),
+                    requests_per_minute=gemini_cfg.get("requests_per_minute", 60),
+                    context_tokens=gemini_cfg.get("director_context_tokens", 8000)
+                )
+                written = director.process(transcript_path, script_path, source_list, should_stop=lambda: job.cancelled)
+                job.raise_if_cancelled()
+                if not written:
+                    raise Exception("Director Agent did not produce a script (check Gemini API key)")
+
+                # Фиксируем только после того, как script.json записан
+                build_state["transcript_hash"] = transcript_hash
+                self._save_build_state(state_path, build_state)
 
-            report(60, "Visual script generated")
+            report(60, "Visual script generated", stage="match")
 
             # STEP 3: Подбор сцен через Smart Matcher
             edl_path = artifacts_dir / "edl.json"
 
             logger.info("🎯 Smart Matcher running...")
-            matcher = SmartMatcher(self.library_path)
-            matcher.match(script_path, edl_path, source_list)
-
-            report(80, "Scenes matched")
+            matching_cfg = self.config.get("matching", {})
+            matcher = SmartMatcher(
+                self.library_path,
+                text_only=matching_cfg.get("text_encoder_only", True)
+            )
+            if incremental is None:
+                incremental = matching_cfg.get("incremental", False)
+            # Инкрементально: прошлый EDL -> перематчиваются только измененные сегменты
+            matcher.match(script_path, edl_path, source_list, previous_edl_path=edl_path if incremental else None)
+
+            report(80, "Scenes matched", stage="export")
 
             # STEP 4: Экспорт в Premiere XML
             output_xml = output_dir / f"{project_name}_v2.xml"
@@ -420,19 +587,47 @@ class ProjectManager:
             exporter = PremiereExporter(fps=24)
             exporter.export(edl_path, output_xml, audio_path)
 
-            save_state("ready", 100, "Build complete")
+            job.finish(READY, "Build complete")
             if progress_callback:
                 progress_callback(100, "Build complete")
 
             logger.info("✨ PROJECT BUILD COMPLETE ✨")
             logger.info(f"📂 Import into Premiere: {output_xml}")
 
+        except JobCancelled:
+            logger.warning(f"🛑 Build of '{project_name}' cancelled")
+            job.finish(CANCELLED, "Cancelled")
+            if progress_callback:
+                progress_callback(job.percent, "Cancelled")
+
         except Exception as e:
             logger.error(f"❌ BUILD FAILED: {e}")
-            save_state("failed", 0, f"Error: {str(e)}")
+            job.finish(FAILED, f"Error: {str(e)}", error=str(e))
             if progress_callback:
                 progress_callback(0, f"Error: {str(e)}")
 
+    def _file_hash(self, path, chunk_size=1024 * 1024):
+        """sha256 файла (читаем кусками, аудио бывает большим)."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _load_build_state(self, state_path):
+        """Состояние прошлой сборки (хэш аудио и т.п.) для инкрементальных пересборок."""
+        if not state_path.exists():
+            return {}
+        try:
+            with open(state_path, 'r') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _save_build_state(self, state_path, state):
+        with open(state_path, 'w') as f:
+            json.dump(state, f, indent=2)
+
     # === УДАЛЕНИЕ ИСТОЧНИКА ===
     
     def delete_source_from_library(self, alias):
@@ -523,6 +718,16 @@ def main():
         required=True,
         help="Comma-separated list of sources (e.g. matrix,fight_club)"
     )
+    build_parser.add_argument(
+        "--script",
+        help="Known essay text (.txt) to align instead of transcribing"
+    )
+    build_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=None,
+        help="Keep cuts of unchanged segments from the previous EDL"
+    )
 
     args = parser.parse_args()
     
@@ -535,7 +740,7 @@ def main():
     elif args.command == "ingest":
         manager.ingest_source(args.file, args.alias, args.fullname)
     elif args.command == "build":
-        manager.build_project(args.project, args.sources)
+        manager.build_project(args.project, args.sources, script_path=args.script, incremental=args.incremental)
     else:
         parser.print_help()
 
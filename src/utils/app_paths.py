@@ -69,6 +69,34 @@ models:
   clip: "ViT-B/32"
   face_detection: "buffalo_s"
 
+gemini:
+  character_collage: true
+  cache: true
+  cache_ttl_hours: 168
+  cache_max_mb: 200
+  director_concurrency: 4
+  requests_per_minute: 60
+  director_context_tokens: 8000
+
+matching:
+  text_encoder_only: true  # матчер грузит только текстовую часть CLIP
+
+jobs:
+  workers: 2        # процессы для ingest/build
+  ingest_slots: 1  # одновременных индексаций
+  build_slots: 1   # одновременных сборок (сборки обгоняют очередь индексаций)
+
+model_pool:
+  idle_ttl_minutes: 15  # модели, простаивающие дольше, выгружаются из памяти
+
+audio:
+  whisper_workers: 2   # процессы для параллельной транскрипции длинных записей
+  chunk_seconds: 300
+
+llm:
+  provider: "gemini"  # gemini | local (детерминированный офлайн-бэкенд)
+  local_latency: 0.0
+
 api_keys:
   tmdb: "6c4e1849b92d6a813f34cda134db66a8"
 """
@@ -1,33 +1,82 @@
 import time
 import logging
-import os
-import google.generativeai as genai
-from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, InternalServerError
+
+from src.utils.response_cache import CachedResponse, get_shared_cache
+from src.utils.llm_providers import create_provider
 
 logger = logging.getLogger(__name__)
 
 class GeminiClient:
-    def __init__(self, model_name="gemini-2.5-flash"):
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("❌ GOOGLE_API_KEY not found in env variables!")
-            
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model_name)
+    def __init__(self, model_name="gemini-2.5-flash", use_cache=True, rate_limiter=None, provider=None):
+        """
+        Args:
+            model_name: Имя модели
+            use_cache: Использовать общий on-disk кэш ответов
+            rate_limiter: Общий TokenBucket для параллельных запросов (опционально)
+            provider: Имя бэкенда ("gemini" / "local"); None - из config.yaml (llm.provider)
+        """
+        self.model_name = model_name
+        self.provider = create_provider(model_name, provider)
+        # Общий on-disk кэш ответов (None, если выключен в config.yaml)
+        self.cache = get_shared_cache() if use_cache else None
+        self.rate_limiter = rate_limiter
 
-    def generate_content(self, contents, retries=5, initial_delay=2):
+    def generate_content(self, contents, retries=5, initial_delay=2, bypass_cache=False, validate=None):
         """
         Обертка над generate_content с автоматическим повтором при ошибке 429.
+        Одинаковые запросы (модель + промпт + картинки) отдаются из кэша.
+        bypass_cache=True - всегда идти в API (результат все равно кэшируется).
+        validate(text) -> bool - разбирается ли ответ у вызывающего кода: невалидный
+        ответ не кэшируется, а невалидная запись из кэша удаляется (идем в API).
         """
+        cache_key = None
+        if self.cache is not None:
+            # Провайдер входит в ключ: ответы local-бэкенда не должны подменять настоящие
+            cache_key = self.cache.make_key(f"{self.provider.name}:{self.model_name}", contents)
+            if not bypass_cache:
+                cached_text = self.cache.get(cache_key)
+                if cached_text is not None:
+                    if self._is_valid(cached_text, validate):
+                        logger.info(f"⚡️ Gemini cache hit ({cache_key[:10]})")
+                        return CachedResponse(cached_text)
+                    logger.warning(f"⚠️ Cached Gemini response {cache_key[:10]} is invalid, evicting")
+                    self.cache.delete(cache_key)
+
+        response = self._generate_with_retries(contents, retries, initial_delay)
+
+        if cache_key is not None and self._is_valid(response.text, validate):
+            try:
+                self.cache.put(cache_key, response.text)
+            except Exception as e:
+                logger.warning(f"⚠️ Failed to cache Gemini response: {e}")
+
+        return response
+
+    def _is_valid(self, text, validate):
+        if validate is None:
+            return True
+        try:
+            return bool(validate(text))
+        except Exception:
+            return False
+
+    def _generate_with_retries(self, contents, retries, initial_delay):
         delay = initial_delay
         
         for attempt in range(1, retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+
             try:
                 # Пробуем отправить запрос
-                response = self.model.generate_content(contents)
+                response = self.provider.generate(contents)
+                if self.rate_limiter:
+                    self.rate_limiter.on_success()
                 return response
             
-            except (ResourceExhausted, ServiceUnavailable, InternalServerError) as e:
+            except self.provider.retryable_errors as e:
+                if self.rate_limiter and isinstance(e, self.provider.throttle_errors):
+                    self.rate_limiter.on_throttle()
                 logger.warning(f"⚠️ Gemini API Error ({e.code if hasattr(e, 'code') else 'Unknown'}). Retrying in {delay}s... (Attempt {attempt}/{retries})")
                 time.sleep(delay)
                 delay *= 2  # Экспоненциальная задержка (2, 4, 8, 16...)
@@ -43,4 +92,4 @@ class GeminiClient:
     def parse_json(self, response_text):
         """Очищает ответ от markdown ```json ... ```"""
         text = response_text.replace("```json", "").replace("```", "").strip()
-        return text
\ No newline at end of file
+        return text
@@ -0,0 +1,363 @@
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from src.utils.job_registry import Job, FINISHED_STATES, QUEUED, FAILED, CANCELLED
+
+logger = logging.getLogger(__name__)
+
+# Меньше - раньше: сборка, которую ждет пользователь, обгоняет очередь индексаций
+PRIORITIES = {"build": 0, "ingest": 1}
+DEFAULT_SLOTS = {"ingest": 1, "build": 1}
+
+LOG_FORMAT = '%(asctime)s - [%(levelname)s] - %(message)s'
+
+# Как часто воркер присылает состав своего model_registry (и когда отчет считается устаревшим)
+MODELS_REPORT_SECONDS = 30
+
+# === ВНУТРИ ПРОЦЕССА-ВОРКЕРА ===
+
+_worker = {"manager": None, "events": None}
+
+
+class _EventLogHandler(logging.Handler):
+    """Пересылает логи воркера в сервер (там они уходят в шину событий)."""
+
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def emit(self, record):
+        try:
+            self.events.put(("log", None, {"message": self.format(record), "level": record.levelname}))
+        except Exception:
+            pass
+
+
+def _init_worker(root_dir, events, manager_factory=None):
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.setLevel(logging.INFO)
+    handler = _EventLogHandler(events)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.addHandler(handler)
+
+    # Один ProjectManager (и один теплый model_registry) на весь срок жизни воркера
+    if manager_factory is None:
+        from src.project_manager import ProjectManager
+        manager_factory = ProjectManager
+    _worker["manager"] = manager_factory(root_dir)
+    _worker["events"] = events
+
+    threading.Thread(target=_report_models_loop, name="models-report", daemon=True).start()
+
+
+def _report_models():
+    """Отправляет серверу, какие модели сейчас загружены в этом воркере (для /models)."""
+    from src.utils.model_registry import model_registry
+    try:
+        _worker["events"].put(("models", os.getpid(), model_registry.resident()))
+    except Exception:
+        pass
+
+
+def _report_models_loop():
+    while True:
+        _report_models()
+        time.sleep(MODELS_REPORT_SECONDS)
+
+
+def _run_job(spec, method, args, cancel_event):
+    events = _worker["events"]
+    job = Job.from_spec(spec)
+    job.bind_cancel_event(cancel_event)
+    job.listener = lambda event: events.put(("job", job.id, event))
+
+    try:
+        getattr(_worker["manager"], method)(*args, job=job)
+    finally:
+        # Метод мог выйти без finish (ранний return) - сервер не должен ждать вечно
+        if job.state not in FINISHED_STATES:
+            job.finish(FAILED, "Error: job ended unexpectedly")
+        # Джоба могла загрузить новые модели - /models увидит их сразу, а не через период
+        _report_models()
+
+
+# === НА СТОРОНЕ СЕРВЕРА ===
+
+class JobExecutor:
+    """
+    Выполняет ingest/build в отдельных процессах, а не в тредпуле сервера.
+
+    Воркеры живут долго (модели в них остаются теплыми). Сколько джоб
+    каждого вида идет одновременно, задают слоты; из очереди берется
+    самая приоритетная джоба, для вида которой есть свободный слот.
+    Отмена - общий Event: джоба останавливается на ближайшей границе
+    кейфрейма/батча/стадии. Прогресс и логи воркеров приходят обратно
+    через очередь и применяются к зеркалу джобы в job_registry; туда же
+    воркеры периодически присылают состав своего model_registry.
+    Если воркер умер (OOM, segfault в нативной библиотеке), пул
+    пересоздается: джобы, шедшие в нем, падают, очередь работает дальше.
+    """
+
+    def __init__(self, root_dir, workers=2, slots=None, on_log=None, manager_factory=None):
+        """
+        Args:
+            root_dir: Корень проекта (для ProjectManager в воркерах)
+            workers: Число процессов-воркеров
+            slots: {вид джобы: сколько одновременно}, по умолчанию 1 ingest + 1 build
+            on_log: on_log({"message", "level"}) для логов из воркеров
+            manager_factory: manager_factory(root_dir) в воркере - объект с методами
+                             джоб (по умолчанию ProjectManager; должен пиклиться)
+        """
+        self.root_dir = str(root_dir)
+        self.workers = workers
+        self.slots = dict(DEFAULT_SLOTS, **(slots or {}))
+        self.on_log = on_log
+        self.manager_factory = manager_factory
+
+        self._ctx = multiprocessing.get_context("spawn")
+        self._mp_manager = None
+        self._events = None
+        self._pool = None
+
+        self._queue = []                 # heap (priority, seq, task)
+        self._seq = itertools.count()
+        self._running = {kind: 0 for kind in self.slots}
+        self._tasks = {}                 # job_id -> task
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._worker_models = {}         # pid -> (время отчета, model_registry.resident() воркера)
+
+    def start(self):
+        # Manager дает Event/Queue, которые можно передать в задачу пула
+        self._mp_manager = self._ctx.Manager()
+        self._events = self._mp_manager.Queue()
+        self._pool = self._create_pool()
+        threading.Thread(target=self._dispatch_loop, name="job-dispatch", daemon=True).start()
+        threading.Thread(target=self._listen_loop, name="job-events", daemon=True).start()
+        logger.info(f"⚙️ Job executor: {self.workers} workers, slots {self.slots}")
+
+    def _create_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._ctx,
+            initializer=_init_worker,
+            initargs=(self.root_dir, self._events, self.manager_factory)
+        )
+
+    def _replace_broken_pool(self, broken):
+        """Новый пул вместо сломанного (один раз, сколько бы джоб ни упало вместе с ним)."""
+        with self._cond:
+            if self._stopped or self._pool is not broken:
+                return self._pool
+            logger.warning("💥 Worker process died, restarting the worker pool")
+            self._pool = self._create_pool()
+            # Отчеты умерших воркеров больше не актуальны
+            self._worker_models.clear()
+            pool = self._pool
+        broken.shutdown(wait=False, cancel_futures=True)
+        return pool
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            for task in self._tasks.values():
+                task["job"].cancel()
+            self._cond.notify_all()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._mp_manager is not None:
+            self._mp_manager.shutdown()
+
+    def submit(self, job, method, args, progress_callback=None, on_finish=None, priority=None):
+        """
+        Ставит джобу в очередь.
+
+        Args:
+            job: Job из ProjectManager.create_job (станет зеркалом)
+            method: Имя метода ProjectManager ("ingest_source" / "build_project")
+            args: Позиционные аргументы метода (без progress_callback и job)
+            progress_callback: (percent, text) на каждое обновление прогресса
+            on_finish: on_finish(job) после завершения в любом состоянии
+            priority: Меньше - раньше (по умолчанию PRIORITIES[job.kind])
+        """
+        job.mirror = True
+        job.bind_cancel_event(self._mp_manager.Event())
+        task = {
+            "job": job,
+            "method": method,
+            "args": args,
+            "progress_callback": progress_callback,
+            "on_finish": on_finish
+        }
+        if priority is None:
+            priority = PRIORITIES.get(job.kind, 10)
+
+        with self._cond:
+            self._tasks[job.id] = task
+            heapq.heappush(self._queue, (priority, next(self._seq), task))
+            self._cond.notify_all()
+        return job
+
+    def cancel(self, job_id):
+        with self._cond:
+            task = self._tasks.get(job_id)
+            if task is None:
+                return False
+            requested = task["job"].cancel()
+            self._cond.notify_all()  # отмененная в очереди снимется диспетчером
+        return requested
+
+    def queued(self):
+        with self._cond:
+            return [task["job"].id for _, _, task in sorted(self._queue)]
+
+    def worker_models(self):
+        """
+        Модели, загруженные в процессах-воркерах (по их последним отчетам).
+
+        Returns:
+            list: [{"pid", "reported_seconds_ago", "models": [...]}]
+        """
+        now = time.time()
+        with self._cond:
+            # Воркер, давно не присылавший отчет, считаем умершим
+            for pid in [pid for pid, (at, _) in self._worker_models.items() if now - at > 3 * MODELS_REPORT_SECONDS]:
+                del self._worker_models[pid]
+            return [
+                {"pid": pid, "reported_seconds_ago": round(now - at, 1), "models": models}
+                for pid, (at, models) in sorted(self._worker_models.items())
+            ]
+
+    # === ДИСПЕТЧЕР ===
+
+    def _next_task(self):
+        """Самая приоритетная джоба со свободным слотом (вызывается под self._cond)."""
+        for entry in sorted(self._queue):
+            kind = entry[2]["job"].kind
+            if self._running.get(kind, 0) < self.slots.get(kind, 1):
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                return entry[2]
+        return None
+
+    def _drop_cancelled(self):
+        dropped = [entry for entry in self._queue if entry[2]["job"].cancelled]
+        for entry in dropped:
+            self._queue.remove(entry)
+        if dropped:
+            heapq.heapify(self._queue)
+        return [entry[2] for entry in dropped]
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    dropped = self._drop_cancelled()
+                    task = self._next_task()
+                    if dropped or task:
+                        break
+                    self._cond.wait()
+                if task:
+                    self._running[task["job"].kind] = self._running.get(task["job"].kind, 0) + 1
+
+            for cancelled in dropped:
+                self._finish_locally(cancelled, CANCELLED, "Cancelled")
+
+            if task:
+                self._start(task)
+
+    def _start(self, task):
+        job = task["job"]
+        logger.info(f"▶️ Starting {job.kind} job {job.id} ({job.target})")
+        pool = self._pool
+        try:
+            try:
+                future = pool.submit(_run_job, job.to_spec(), task["method"], task["args"], job.cancel_event())
+            except BrokenProcessPool:
+                # Пул сломался раньше, чем это заметил _on_done: одна попытка в новом
+                pool = self._replace_broken_pool(pool)
+                future = pool.submit(_run_job, job.to_spec(), task["method"], task["args"], job.cancel_event())
+        except Exception as e:
+            # Диспетчер не должен умирать: джоба падает, слот освобождается
+            logger.error(f"❌ Could not start {job.kind} job {job.id}: {e}")
+            self._release_slot(job)
+            self._finish_locally(task, FAILED, f"Error: {e}", error=str(e))
+            return
+        future.add_done_callback(lambda f, task=task, pool=pool: self._on_done(task, pool, f))
+
+    def _release_slot(self, job):
+        with self._cond:
+            self._running[job.kind] -= 1
+            self._cond.notify_all()
+
+    def _on_done(self, task, pool, future):
+        job = task["job"]
+        self._release_slot(job)
+
+        error = future.exception() if not future.cancelled() else None
+        if isinstance(error, BrokenProcessPool):
+            self._replace_broken_pool(pool)
+        if error is not None and job.state not in FINISHED_STATES:
+            # Воркер упал (например, OOM) - финиша из процесса уже не будет
+            logger.error(f"❌ {job.kind} job {job.id} crashed: {error}")
+            self._finish_locally(task, FAILED, f"Error: {error}", error=str(error))
+
+    def _finish_locally(self, task, state, text, error=None):
+        job = task["job"]
+        job.mirror = False  # воркер файл уже не запишет
+        if job.state == QUEUED:
+            # Джоба не начиналась: на диске нечего обновлять (и не создаем папку фильма)
+            job.status_path = None
+        job.finish(state, text, error=error)
+        self._complete(task)
+
+    def _complete(self, task):
+        with self._cond:
+            self._tasks.pop(task["job"].id, None)
+        if task["on_finish"]:
+            try:
+                task["on_finish"](task["job"])
+            except Exception as e:
+                logger.warning(f"on_finish failed for job {task['job'].id}: {e}")
+
+    # === СОБЫТИЯ ИЗ ВОРКЕРОВ ===
+
+    def _listen_loop(self):
+        while True:
+            try:
+                kind, job_id, payload = self._events.get()
+            except (EOFError, OSError):
+                return  # Manager остановлен
+
+            if kind == "log":
+                if self.on_log:
+                    self.on_log(payload)
+                continue
+
+            if kind == "models":
+                # job_id здесь - pid воркера
+                with self._cond:
+                    self._worker_models[job_id] = (time.time(), payload)
+                continue
+
+            with self._cond:
+                task = self._tasks.get(job_id)
+            if task is None:
+                continue
+
+            task["job"].apply(payload)
+            if task["progress_callback"]:
+                percent = task["job"].percent
+                task["progress_callback"](percent, payload["text"])
+            if payload["type"] == "finish":
+                self._complete(task)
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Состояния джобы
+QUEUED = "queued"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (READY, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Джоба отменена пользователем (бросается на ближайшей точке отчета)."""
+
+
+class Job:
+    """
+    Одна джоба ingest/build: состояние, прогресс, тайминги стадий.
+
+    Прогресс живет в памяти. Файл статуса (.ingest_status.json /
+    project_meta.json) переписывается атомарно только при смене стадии
+    и в конце, а не на каждый процент.
+    """
+
+    def __init__(self, kind, target, status_path=None, status_fields=None, running_status="processing"):
+        """
+        Args:
+            kind: "ingest" или "build"
+            target: alias фильма или имя проекта
+            status_path: Файл статуса для UI и перезапусков (опционально)
+            status_fields: Доп. поля файла статуса (например, sources сборки)
+            running_status: Значение "status" в файле, пока джоба работает
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.target = target
+        self.status_path = status_path
+        self.status_fields = status_fields or {}
+        self.running_status = running_status
+
+        self.state = QUEUED
+        self.percent = 0
+        self.text = "Queued"
+        self.error = None
+        self.stage = None
+        self.stages = []   # [{"name", "started", "finished", "seconds", "items"}]
+        self.items = None  # обработано элементов в текущей стадии (кейфреймы и т.п.)
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+        # listener(event) - получатель событий джобы (воркер -> сервер, см. JobExecutor)
+        self.listener = None
+        # Зеркало джобы, которая выполняется в другом процессе: файл статуса пишет воркер
+        self.mirror = False
+
+    def bind_cancel_event(self, event):
+        """Подменяет флаг отмены общим между процессами (multiprocessing Event)."""
+        if self._cancel.is_set():
+            event.set()
+        self._cancel = event
+
+    def cancel_event(self):
+        """Флаг отмены (после bind_cancel_event - общий Event, его передают воркеру)."""
+        return self._cancel
+
+    # === ОТЧЕТЫ ИЗ РАБОЧЕГО ПОТОКА ===
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def raise_if_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(f"{self.kind} '{self.target}' cancelled")
+
+    def update(self, percent, text, stage=None, items=None):
+        """
+        Обновляет прогресс. stage - имя начавшейся стадии (None - та же стадия).
+        Бросает JobCancelled, если джобу отменили.
+        """
+        self.raise_if_cancelled()
+        transition = self._record(percent, text, stage, items)
+        if self.listener:
+            self.listener({"type": "update", "percent": percent, "text": text, "stage": stage, "items": items})
+        if transition:
+            self.persist()
+
+    def _record(self, percent, text, stage, items):
+        now = time.time()
+        with self._lock:
+            if self.state == QUEUED:
+                self.state = RUNNING
+                self.started_at = now
+            self.percent = percent
+            self.text = text
+            if items is not None:
+                self.items = items
+
+            transition = stage is not None and stage != self.stage
+            if transition:
+                self._close_stage(now)
+                self.stage = stage
+                self.items = None
+                self.stages.append({"name": stage, "started": now, "finished": None, "seconds": None, "items": None})
+        return transition
+
+    def apply(self, event):
+        """Применяет событие джобы-оригинала из воркера к зеркалу (без отмены и записи файла)."""
+        if event["type"] == "update":
+            self._record(event["percent"], event["text"], event["stage"], event["items"])
+        elif event["type"] == "finish":
+            self._finish(event["state"], event["text"], event["error"])
+
+    def finish(self, state, text, error=None):
+        self._finish(state, text, error)
+        if self.listener:
+            self.listener({"type": "finish", "state": state, "text": text, "error": error})
+        self.persist()
+
+    def _finish(self, state, text, error):
+        now = time.time()
+        with self._lock:
+            self._close_stage(now)
+            self.state = state
+            self.text = text
+            self.error = error
+            if state == READY:
+                self.percent = 100
+            elif state == FAILED:
+                self.percent = 0
+            self.finished_at = now
+
+    def cancel(self):
+        """Просьба остановиться: джоба выйдет на ближайшей точке отчета."""
+        if self.state in FINISHED_STATES:
+            return False
+        self._cancel.set()
+        return True
+
+    def to_spec(self):
+        """Что нужно воркеру, чтобы воссоздать эту джобу у себя (см. JobExecutor)."""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "target": self.target,
+            "status_path": self.status_path,
+            "status_fields": self.status_fields,
+            "running_status": self.running_status
+        }
+
+    @classmethod
+    def from_spec(cls, spec):
+        job = cls(
+            spec["kind"], spec["target"],
+            status_path=spec["status_path"],
+            status_fields=spec["status_fields"],
+            running_status=spec["running_status"]
+        )
+        job.id = spec["id"]
+        return job
+
+    def _close_stage(self, now):
+        if self.stages and self.stages[-1]["finished"] is None:
+            current = self.stages[-1]
+            current["finished"] = now
+            current["seconds"] = round(now - current["started"], 2)
+            current["items"] = self.items
+
+    # === ПРЕДСТАВЛЕНИЕ ===
+
+    def status_value(self):
+        """Значение "status" в файле статуса (совместимо с прежним форматом)."""
+        return self.running_status if self.state in (QUEUED, RUNNING) else self.state
+
+    def to_dict(self):
+        now = time.time()
+        with self._lock:
+            stages = [dict(s) for s in self.stages]
+            throughput = None
+            if stages and stages[-1]["finished"] is None:
+                elapsed = now - stages[-1]["started"]
+                stages[-1]["seconds"] = round(elapsed, 2)
+                if self.items is not None and elapsed > 0:
+                    throughput = round(self.items / elapsed, 2)
+
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "target": self.target,
+                "state": self.state,
+                "percent": self.percent,
+                "progress_text": self.text,
+                "stage": self.stage,
+                "stages": stages,
+                "items_per_second": throughput,
+                "error": self.error,
+                "cancel_requested": self.cancelled,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at
+            }
+
+    def persist(self):
+        """Атомарно пишет файл статуса (tmp + os.replace)."""
+        if self.status_path is None or self.mirror:
+            return
+        with self._lock:
+            data = dict(self.status_fields)
+            data.update({
+                "status": self.status_value(),
+                "percent": self.percent,
+                "progress_text": self.text,
+                "job_id": self.id,
+                "last_updated": time.time()
+            })
+        try:
+            self.status_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.status_path.with_name(self.status_path.name + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.status_path)
+        except OSError as e:
+            logger.warning(f"⚠️ Can't persist job status {self.status_path}: {e}")
+
+
+class JobRegistry:
+    """Все джобы процесса. Завершенные хранятся ограниченное время/количество."""
+
+    def __init__(self, max_finished=100):
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, kind, target, **kwargs):
+        job = Job(kind, target, **kwargs)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, kind=None, active_only=False):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [
+            job for job in jobs
+            if (kind is None or job.kind == kind)
+            and (not active_only or job.state not in FINISHED_STATES)
+        ]
+
+    def find_active(self, kind, target):
+        """Последняя незавершенная джоба над target (или None)."""
+        for job in reversed(self.list(kind=kind, active_only=True)):
+            if job.target == target:
+                return job
+        return None
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        return job.cancel() if job else False
+
+    def _trim(self):
+        finished = [jid for jid, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for jid in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[jid]
+
+
+# Один реестр на процесс сервера
+job_registry = JobRegistry()
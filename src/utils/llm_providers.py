@@ -0,0 +1,160 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LLMResponse:
+    """Ответ провайдера: клиентскому коду нужен только .text"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class LLMProvider:
+    """
+    Интерфейс бэкенда для GeminiClient.
+
+    generate(contents) -> объект с .text
+    retryable_errors - исключения, после которых стоит повторить запрос
+    throttle_errors - подмножество retryable_errors, означающее 429
+    """
+
+    name = "base"
+    retryable_errors = ()
+    throttle_errors = ()
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate(self, contents):
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    """Настоящий Google Gemini (нужен GOOGLE_API_KEY и сеть)."""
+
+    name = "gemini"
+
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("❌ GOOGLE_API_KEY not found in env variables!")
+
+        # Импорт здесь: локальному провайдеру google-библиотеки не нужны
+        import google.generativeai as genai
+        from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, InternalServerError
+
+        self.retryable_errors = (ResourceExhausted, ServiceUnavailable, InternalServerError)
+        self.throttle_errors = (ResourceExhausted,)
+
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, contents):
+        return self.model.generate_content(contents)
+
+
+class LocalProvider(LLMProvider):
+    """
+    Детерминированный офлайн-бэкенд для бенчмарков и CI.
+
+    Не понимает текст, но отвечает валидным по схеме JSON на оба типа
+    промптов пайплайна: shot list Директора и карту персонажей
+    MetadataManager. Ответ зависит только от входа (хэш), задержка
+    настраивается, чтобы имитировать сетевой round-trip.
+    """
+
+    name = "local"
+
+    SHOT_TYPES = ["Close-Up", "Medium Shot", "Wide Angle", "Extreme Close-Up"]
+    MOODS = ["Tense", "Calm", "Dark", "Happy"]
+
+    _segments_re = re.compile(r"^\s*(\[\{.*\}\])\s*$", re.MULTILINE)
+    _characters_re = re.compile(r"characters: (\[.*?\])\.")
+    _person_re = re.compile(r"person_\d+")
+
+    def __init__(self, model_name, latency=0.0):
+        super().__init__(model_name)
+        self.latency = float(latency)
+
+    def _text(self, contents):
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        return "\n".join(p for p in parts if isinstance(p, str))
+
+    def _pick(self, options, *keys):
+        digest = hashlib.sha256("|".join(str(k) for k in keys).encode("utf-8")).digest()
+        return options[digest[0] % len(options)]
+
+    def _shot_list(self, prompt, segments):
+        characters = []
+        match = self._characters_re.search(prompt)
+        if match:
+            try:
+                characters = json.loads(match.group(1))
+            except ValueError:
+                characters = []
+
+        shots = []
+        for seg in segments:
+            text = seg.get("text", "")
+            words = [w.strip(".,!?;:\"'").lower() for w in text.split()]
+            character = self._pick(characters + [None], seg.get("segment_id"), text) if characters else None
+            shots.append({
+                "segment_id": seg.get("segment_id"),
+                "visual_query": " ".join(w for w in words if len(w) > 3)[:80] or "scene from movie",
+                "shot_type": self._pick(self.SHOT_TYPES, seg.get("segment_id"), "shot"),
+                "character": character,
+                "mood": self._pick(self.MOODS, text)
+            })
+        return shots
+
+    def _character_map(self, prompt):
+        pids = []
+        for pid in self._person_re.findall(prompt):
+            if pid not in pids and pid != "person_X":
+                pids.append(pid)
+        return {pid: f"Character {i + 1}" for i, pid in enumerate(pids)}
+
+    def generate(self, contents):
+        if self.latency:
+            time.sleep(self.latency)
+
+        prompt = self._text(contents)
+        match = self._segments_re.search(prompt)
+        if match:
+            payload = self._shot_list(prompt, json.loads(match.group(1)))
+        else:
+            payload = self._character_map(prompt)
+
+        return LLMResponse(json.dumps(payload, ensure_ascii=False))
+
+
+PROVIDERS = {
+    GeminiProvider.name: GeminiProvider,
+    LocalProvider.name: LocalProvider,
+}
+
+# === ВЫБОР БЭКЕНДА ДЛЯ ПРОЦЕССА ===
+# ProjectManager настраивает его из config.yaml (llm.provider)
+
+_backend = {"provider": "gemini", "options": {}}
+
+
+def configure_llm_backend(provider="gemini", **options):
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{provider}'. Available: {list(PROVIDERS)}")
+    _backend["provider"] = provider
+    _backend["options"] = options
+    logger.info(f"🤖 LLM backend: {provider}")
+
+
+def create_provider(model_name, provider=None):
+    name = provider or _backend["provider"]
+    options = _backend["options"] if name == _backend["provider"] else {}
+    return PROVIDERS[name](model_name, **options)
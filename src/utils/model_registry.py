@@ -0,0 +1,169 @@
+import gc
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_TTL_MINUTES = 15
+
+
+class ModelRegistry:
+    """
+    Процессный пул "теплых" моделей (CLIP, Whisper, InsightFace).
+
+    Модель грузится лениво при первом запросе и переиспользуется всеми
+    следующими джобами. Модели, к которым не обращались дольше TTL,
+    выгружаются фоновым потоком. Джоба держит свои модели через lease():
+    пока аренда открыта, модель не выгружается, даже если джоба дольше TTL
+    не вызывала get() (иначе следующий get() загрузил бы вторую копию).
+    """
+
+    def __init__(self, idle_ttl_minutes=DEFAULT_IDLE_TTL_MINUTES, sweep_interval=60):
+        self.idle_ttl = idle_ttl_minutes * 60
+        self.sweep_interval = sweep_interval
+        self._models = {}       # key -> {"model", "loaded_at", "last_used", "load_seconds", "leases"}
+        self._leases = []       # открытые аренды (множества ключей)
+        self._key_locks = {}    # key -> Lock (одна загрузка на ключ)
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def configure(self, idle_ttl_minutes):
+        self.idle_ttl = idle_ttl_minutes * 60
+
+    def get(self, key, loader):
+        """
+        Возвращает модель по ключу, загружая ее через loader() при первом обращении.
+
+        Args:
+            key: Хэшируемый ключ, например ("clip", "ViT-B/32", "cpu")
+            loader: Функция без аргументов, которая грузит модель
+        """
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                entry["last_used"] = time.time()
+                self._attach_leases(key, entry)
+                return entry["model"]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Пока ждали, модель мог загрузить другой поток
+            with self._lock:
+                entry = self._models.get(key)
+                if entry is not None:
+                    entry["last_used"] = time.time()
+                    self._attach_leases(key, entry)
+                    return entry["model"]
+
+            started = time.time()
+            model = loader()
+            now = time.time()
+
+            with self._lock:
+                entry = {
+                    "model": model,
+                    "loaded_at": now,
+                    "last_used": now,
+                    "load_seconds": round(now - started, 2),
+                    "leases": 0
+                }
+                self._models[key] = entry
+                self._attach_leases(key, entry)
+            logger.info(f"🔥 Model {self._name(key)} loaded in {now - started:.1f}s (resident: {len(self._models)})")
+
+        self._ensure_reaper()
+        return model
+
+    @contextmanager
+    def lease(self):
+        """
+        Аренда на время джобы: все модели, полученные через get() пока она
+        открыта, не выгружаются до ее закрытия.
+
+        Аренда процессная, а не потоковая: стадии ingest берут модели из своих
+        потоков. Параллельная джоба может продлить чужую модель - это лишь
+        откладывает выгрузку.
+        """
+        keys = set()
+        with self._lock:
+            self._leases.append(keys)
+        try:
+            yield
+        finally:
+            now = time.time()
+            with self._lock:
+                self._leases.remove(keys)
+                for key in keys:
+                    entry = self._models.get(key)
+                    if entry is not None:
+                        entry["leases"] -= 1
+                        entry["last_used"] = now
+
+    def _attach_leases(self, key, entry):
+        """Привязывает модель к открытым арендам (вызывается под self._lock)."""
+        for keys in self._leases:
+            if key not in keys:
+                keys.add(key)
+                entry["leases"] += 1
+
+    def evict_idle(self):
+        """Выгружает модели, простаивающие дольше TTL и не взятые в аренду. Возвращает их ключи."""
+        cutoff = time.time() - self.idle_ttl
+        with self._lock:
+            stale = [
+                key for key, entry in self._models.items()
+                if entry["last_used"] < cutoff and entry["leases"] == 0
+            ]
+            for key in stale:
+                del self._models[key]
+
+        if stale:
+            gc.collect()
+            logger.info(f"🧊 Evicted idle models: {[self._name(k) for k in stale]}")
+        return stale
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            for keys in self._leases:
+                keys.clear()
+        gc.collect()
+
+    def resident(self):
+        """Список загруженных моделей для /models."""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "model": self._name(key),
+                    "loaded_seconds_ago": round(now - entry["loaded_at"], 1),
+                    "idle_seconds": round(now - entry["last_used"], 1),
+                    "load_seconds": entry["load_seconds"],
+                    "leases": entry["leases"]
+                }
+                for key, entry in self._models.items()
+            ]
+
+    def _name(self, key):
+        return ":".join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+
+    def _ensure_reaper(self):
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="model-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.warning(f"Model reaper error: {e}")
+
+
+# Один реестр на процесс сервера
+model_registry = ModelRegistry()
@@ -0,0 +1,64 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket с адаптацией к 429 (AIMD).
+
+    Каждый запрос забирает один токен. Токены пополняются со скоростью
+    rate в секунду, но не больше capacity. При ответе 429 скорость
+    делится пополам, после успешных запросов понемногу растет обратно
+    до исходной.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=0.05, recovery=0.05):
+        """
+        Args:
+            rate: Запросов в секунду (максимальная, она же стартовая скорость)
+            capacity: Размер "всплеска" (по умолчанию = max(1, rate))
+            min_rate: Нижняя граница скорости после штрафов
+            recovery: На сколько запросов/сек растет скорость после каждого успеха
+        """
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.min_rate = min_rate
+        self.recovery = recovery
+
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Блокирует поток, пока не появится свободный токен."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttle(self):
+        """Сервер ответил 429: режем скорость и сбрасываем накопленный запас."""
+        with self._lock:
+            # Время до этого момента засчитывается по старой скорости, дальше - по новой
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+            logger.warning(f"🐢 Rate limited: slowing down to {self.rate * 60:.1f} req/min")
+
+    def on_success(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.recovery)
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+from src.utils.app_paths import get_app_data_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_HOURS = 24 * 7
+DEFAULT_MAX_MB = 200
+
+
+class CachedResponse:
+    """Минимальная замена ответа Gemini: клиентскому коду нужен только .text"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class ResponseCache:
+    """
+    Content-addressed кэш ответов LLM на диске.
+
+    Ключ - sha256 от имени модели, текста промпта и байтов картинок.
+    Каждая запись - отдельный JSON-файл. Устаревшие по TTL записи
+    удаляются при чтении, при превышении лимита размера удаляются
+    самые давно использованные (по mtime). Размер кэша считается
+    один раз и дальше ведется по put/delete; каталог сканируется
+    заново только при вытеснении.
+    """
+
+    def __init__(self, cache_dir, ttl_hours=DEFAULT_TTL_HOURS, max_mb=DEFAULT_MAX_MB):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl_hours * 3600
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._total = None  # байт на диске (None - еще не считали)
+
+    # ------------------------------------------------------------------
+    # Keys
+    # ------------------------------------------------------------------
+
+    def make_key(self, model_name, contents):
+        digest = hashlib.sha256()
+        digest.update(model_name.encode("utf-8"))
+
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        for part in parts:
+            digest.update(b"\x00")
+            digest.update(self._part_bytes(part))
+
+        return digest.hexdigest()
+
+    def _part_bytes(self, part):
+        if isinstance(part, str):
+            return part.encode("utf-8")
+        if isinstance(part, (bytes, bytearray)):
+            return bytes(part)
+        # PIL.Image: хэшируем пиксели, а не объект
+        if hasattr(part, "tobytes") and hasattr(part, "size"):
+            header = f"{getattr(part, 'mode', '')}:{part.size}".encode("utf-8")
+            return header + part.tobytes()
+        return repr(part).encode("utf-8")
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    # ------------------------------------------------------------------
+    # Get / Put
+    # ------------------------------------------------------------------
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry.get("created", 0) > self.ttl:
+            self.delete(key)
+            return None
+
+        # Обновляем mtime -> запись становится "свежей" для LRU-вытеснения
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("text")
+
+    def put(self, key, text):
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "text": text}, f, ensure_ascii=False)
+        size = tmp_path.stat().st_size
+
+        with self._lock:
+            replaced = self._size_of(path)
+            os.replace(tmp_path, path)
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._scan())
+            else:
+                self._total += size - replaced
+            over_limit = self._total > self.max_bytes
+
+        if over_limit:
+            self._evict()
+
+    def delete(self, key):
+        path = self._path(key)
+        with self._lock:
+            size = self._size_of(path)
+            path.unlink(missing_ok=True)
+            if self._total is not None:
+                self._total = max(0, self._total - size)
+
+    def _size_of(self, path):
+        try:
+            return path.stat().st_size
+        except OSError:
+            return 0
+
+    def _scan(self):
+        files = []
+        for p in self.cache_dir.glob("*.json"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        return files
+
+    def _evict(self):
+        with self._lock:
+            # Полный проход: заодно поправляет счетчик, если в каталог писали другие процессы
+            files = self._scan()
+            total = sum(size for _, size, _ in files)
+
+            removed = 0
+            if total > self.max_bytes:
+                files.sort()
+                for _, size, p in files:
+                    if total <= self.max_bytes:
+                        break
+                    p.unlink(missing_ok=True)
+                    total -= size
+                    removed += 1
+            self._total = total
+
+        if removed:
+            logger.info(f"🧹 Response cache: evicted {removed} entries")
+
+    def clear(self):
+        with self._lock:
+            for p in self.cache_dir.glob("*.json"):
+                p.unlink(missing_ok=True)
+            self._total = 0
+
+
+# === ОБЩИЙ КЭШ ПРОЦЕССА ===
+# Один экземпляр на процесс: DirectorAgent и MetadataManager пишут в одно место
+
+_shared_cache = None
+_shared_enabled = True
+_shared_settings = {"ttl_hours": DEFAULT_TTL_HOURS, "max_mb": DEFAULT_MAX_MB}
+
+
+def configure_shared_cache(enabled=True, ttl_hours=DEFAULT_TTL_HOURS, max_mb=DEFAULT_MAX_MB):
+    """Настраивает общий кэш (вызывается ProjectManager из config.yaml)."""
+    global _shared_cache, _shared_enabled
+    _shared_enabled = enabled
+    _shared_settings["ttl_hours"] = ttl_hours
+    _shared_settings["max_mb"] = max_mb
+    _shared_cache = None
+
+
+def get_shared_cache():
+    """Возвращает общий кэш или None, если кэширование выключено."""
+    global _shared_cache
+    if not _shared_enabled:
+        return None
+    if _shared_cache is None:
+        _shared_cache = ResponseCache(get_app_data_dir() / "cache" / "gemini", **_shared_settings)
+    return _shared_cache
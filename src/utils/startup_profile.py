@@ -0,0 +1,84 @@
+import os
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+
+# Модули, которых не должно быть в холодном старте сервера:
+# они нужны только стадиям ingest/build, поиску и превью и импортируются лениво
+HEAVY_MODULES = (
+    "torch", "whisper", "clip", "insightface", "onnxruntime",
+    "sklearn", "scipy", "scenedetect", "cv2", "google.generativeai",
+    "numpy", "PIL"
+)
+
+DEFAULT_BUDGET_SECONDS = 1.5
+DEFAULT_TARGET = "src.api.server"
+
+
+def profile_imports(target=DEFAULT_TARGET):
+    """
+    Импортирует target в чистом интерпретаторе с -X importtime.
+
+    Returns:
+        dict: {module: cumulative_us} для модулей верхнего уровня импорта
+    """
+    project_root = Path(__file__).resolve().parents[2]
+    env = dict(os.environ, PYTHONPATH=str(project_root), PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=project_root, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        tail = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"import {target} failed:\n" + "\n".join(tail[-15:]))
+
+    # Формат строки: "import time: self [us] | cumulative | imported package"
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        module = name.strip()
+        timings[module] = max(timings.get(module, 0), int(cumulative))
+    return timings
+
+
+def check_startup(target=DEFAULT_TARGET, budget_seconds=DEFAULT_BUDGET_SECONDS):
+    """
+    Returns:
+        tuple: (ok, total_seconds, heavy_loaded, top) где top - самые дорогие модули
+    """
+    timings = profile_imports(target)
+    total = timings.get(target, 0) / 1_000_000
+
+    heavy_loaded = [m for m in HEAVY_MODULES if m in timings]
+
+    top_level = {m: us for m, us in timings.items() if "." not in m}
+    top = sorted(top_level.items(), key=lambda kv: kv[1], reverse=True)[:10]
+
+    ok = total <= budget_seconds and not heavy_loaded
+    return ok, total, heavy_loaded, top
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API server cold-start import budget check")
+    parser.add_argument("--target", default=DEFAULT_TARGET)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_SECONDS, help="Seconds")
+    args = parser.parse_args()
+
+    ok, total, heavy_loaded, top = check_startup(args.target, args.budget)
+
+    print(f"⏱ import {args.target}: {total:.3f}s (budget {args.budget:.3f}s)")
+    for module, us in top:
+        print(f"   {us / 1000:8.1f} ms  {module}")
+    if heavy_loaded:
+        print(f"❌ Heavy modules imported at startup: {heavy_loaded}")
+    if total > args.budget:
+        print("❌ Cold start is over budget")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
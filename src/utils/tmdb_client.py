@@ -1,39 +1,168 @@
-import requests
+import json
+import time
+import queue
 import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.utils.app_paths import get_app_data_dir
 
 logger = logging.getLogger(__name__)
 
+HIT_TTL_HOURS = 24 * 30   # постер фильма почти не меняется
+MISS_TTL_HOURS = 24       # "не нашли" перепроверяем раз в сутки
+
+
 class TMDBClient:
-    def __init__(self, api_key):
+    """
+    Поиск постеров TMDB.
+
+    Одна requests.Session с пулом соединений, кэш попаданий и промахов
+    с TTL (сохраняется в app_data/cache/tmdb.json) и фоновая очередь
+    prefetch, чтобы HTTP никогда не выполнялся внутри обработчика запроса.
+    Сетевые ошибки не кэшируются - только ответы TMDB.
+    """
+
+    def __init__(self, api_key, base_url="https://api.themoviedb.org/3",
+                 image_base="https://image.tmdb.org/t/p/w500",  # w500 - оптимальный размер
+                 cache_path=None, hit_ttl_hours=HIT_TTL_HOURS, miss_ttl_hours=MISS_TTL_HOURS,
+                 pool_size=4):
         self.api_key = api_key
-        self.base_url = "https://api.themoviedb.org/3"
-        self.image_base = "https://image.tmdb.org/t/p/w500" # w500 - оптимальный размер
+        self.base_url = base_url
+        self.image_base = image_base
+        self.hit_ttl = hit_ttl_hours * 3600
+        self.miss_ttl = miss_ttl_hours * 3600
 
-    def get_poster_url(self, query):
-        if not self.api_key or self.api_key == "ТВОЙ_КЛЮЧ_ВСТАВИТЬ_СЮДА":
-            return None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.cache_path = cache_path if cache_path is not None else get_app_data_dir() / "cache" / "tmdb.json"
+        self._cache = self._load_cache()
+        self._lock = threading.Lock()
+
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._worker = None
+
+    @property
+    def enabled(self):
+        return bool(self.api_key) and self.api_key != "ТВОЙ_КЛЮЧ_ВСТАВИТЬ_СЮДА"
+
+    # === КЭШ ===
+
+    def _key(self, query):
+        return " ".join(query.lower().split())
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
 
+    def _save_cache(self):
+        # Вызывается под self._lock
         try:
-            # 1. Поиск фильма
-            search_url = f"{self.base_url}/search/movie"
-            params = {
-                "api_key": self.api_key,
-                "query": query,
-                "language": "en-US"
-            }
-            
-            response = requests.get(search_url, params=params, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-
-            if data["results"]:
-                # Берем первый результат
-                poster_path = data["results"][0].get("poster_path")
-                if poster_path:
-                    return f"{self.image_base}{poster_path}"
-            
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix(".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._cache, f, ensure_ascii=False)
+            tmp_path.replace(self.cache_path)
+        except OSError as e:
+            logger.warning(f"⚠️ TMDB cache not saved: {e}")
+
+    def cached(self, query):
+        """
+        Returns:
+            tuple: (есть ли свежая запись, url или None)
+        """
+        with self._lock:
+            entry = self._cache.get(self._key(query))
+        if entry is None or entry["expires"] < time.time():
+            return False, None
+        return True, entry["url"]
+
+    def _store(self, query, url):
+        ttl = self.hit_ttl if url else self.miss_ttl
+        with self._lock:
+            self._cache[self._key(query)] = {"url": url, "expires": time.time() + ttl}
+            self._save_cache()
+
+    # === ПОИСК ===
+
+    def _lookup(self, query):
+        """Один запрос к TMDB. Исключение - сетевая/HTTP ошибка (не кэшируется)."""
+        search_url = f"{self.base_url}/search/movie"
+        params = {
+            "api_key": self.api_key,
+            "query": query,
+            "language": "en-US"
+        }
+
+        response = self.session.get(search_url, params=params, timeout=5)
+        response.raise_for_status()
+        data = response.json()
+
+        if data.get("results"):
+            # Берем первый результат
+            poster_path = data["results"][0].get("poster_path")
+            if poster_path:
+                return f"{self.image_base}{poster_path}"
+        return None
+
+    def get_poster_url(self, query):
+        if not self.enabled:
             return None
 
+        found, url = self.cached(query)
+        if found:
+            return url
+
+        try:
+            url = self._lookup(query)
         except Exception as e:
             logger.error(f"TMDB Error for '{query}': {e}")
-            return None
\ No newline at end of file
+            return None
+
+        self._store(query, url)
+        return url
+
+    # === ФОНОВЫЙ PREFETCH ===
+
+    def prefetch(self, key, query, callback=None):
+        """
+        Ставит поиск постера в фоновую очередь.
+
+        Args:
+            key: Идентификатор задачи (alias), повторы с тем же ключом игнорируются
+            query: Строка запроса или функция без аргументов, возвращающая ее
+                   (выполняется уже в фоновом потоке)
+            callback: callback(key, url) после поиска
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._prefetch_loop, name="tmdb-prefetch", daemon=True)
+                self._worker.start()
+        self._queue.put((key, query, callback))
+
+    def _prefetch_loop(self):
+        while True:
+            key, query, callback = self._queue.get()
+            try:
+                text = query() if callable(query) else query
+                url = self.get_poster_url(text)
+                if callback:
+                    callback(key, url)
+            except Exception as e:
+                logger.warning(f"⚠️ TMDB prefetch failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
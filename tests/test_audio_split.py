@@ -0,0 +1,51 @@
+import numpy as np
+
+from src.analysis.audio_split import find_split_points, SAMPLE_RATE
+
+
+def synthetic_speech(total_seconds, pauses, seed=0):
+    """
+    "Речь" - шум с огибающей слогов (~4 Гц) и короткими провалами между словами;
+    pauses - [(начало, длина)] настоящих пауз, где можно резать.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(total_seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)
+    audio = (rng.normal(0, 0.2, n) * envelope).astype(np.float32)
+
+    # Межсловные провалы по 0.15 с - слишком короткие для разреза
+    for start in np.arange(0.5, total_seconds, 1.3):
+        a = int(start * SAMPLE_RATE)
+        audio[a:a + int(0.15 * SAMPLE_RATE)] *= 0.01
+
+    for start, length in pauses:
+        a, b = int(start * SAMPLE_RATE), int((start + length) * SAMPLE_RATE)
+        audio[a:b] = rng.normal(0, 0.001, b - a)
+    return audio
+
+
+def test_cuts_fall_inside_pauses_near_chunk_boundaries():
+    pauses = [(303.4, 0.6), (599.8, 0.6), (896.2, 0.6)]
+    # Ложные кандидаты дальше от границ - выбрать надо ближайшую к 300/600/900 с
+    decoys = [(200.0, 0.8), (470.0, 0.8), (760.0, 0.8)]
+    audio = synthetic_speech(1100, pauses + decoys)
+
+    points = find_split_points(audio, chunk_seconds=300)
+
+    assert len(points) == 3
+    for cut, (start, length) in zip(points, pauses):
+        seconds = cut / SAMPLE_RATE
+        assert start < seconds < start + length
+    assert points == sorted(points)
+
+
+def test_no_pause_nearby_falls_back_to_hard_cut():
+    audio = synthetic_speech(700, [])
+    points = find_split_points(audio, chunk_seconds=300)
+    assert [p / SAMPLE_RATE for p in points] == [300.0]
+
+
+def test_short_audio_is_not_split():
+    audio = synthetic_speech(400, [(300.0, 1.0)])
+    assert find_split_points(audio, chunk_seconds=300) == []
@@ -0,0 +1,51 @@
+from src.analysis.batch_planner import BatchPlanner, SENTENCE_END
+
+
+def make_segments(sentences, words_per_segment=6):
+    """Предложения по 1-4 сегмента; конец предложения - только у последнего сегмента."""
+    segments = []
+    for s, length in enumerate(sentences):
+        for part in range(length):
+            text = " ".join(f"word{s}_{part}_{w}" for w in range(words_per_segment))
+            text += "." if part == length - 1 else ","
+            segments.append({"segment_id": len(segments), "start": 0.0, "end": 1.0, "text": text})
+    return segments
+
+
+def test_batches_close_on_sentence_boundaries():
+    segments = make_segments([1, 3, 2, 4, 1, 2, 3, 1, 4, 2] * 3)
+    planner = BatchPlanner(context_tokens=400, prompt_overhead_tokens=100, output_tokens_per_segment=20)
+    batches = planner.plan(segments)
+
+    assert len(batches) > 1
+    for batch in batches:
+        assert SENTENCE_END.search(batch["segments"][-1]["text"])
+    # Все сегменты на месте и по порядку
+    flat = [seg["segment_id"] for batch in batches for seg in batch["segments"]]
+    assert flat == list(range(len(segments)))
+    assert [batch["batch_id"] for batch in batches] == list(range(len(batches)))
+
+
+def test_batches_respect_token_budget_and_segment_cap():
+    segments = make_segments([2, 1, 3, 2] * 10)
+    planner = BatchPlanner(context_tokens=500, prompt_overhead_tokens=120, output_tokens_per_segment=30, max_segments=6)
+    batches = planner.plan(segments)
+
+    for batch in batches:
+        assert planner.estimate_batch_tokens(batch["segments"]) <= planner.context_tokens
+        assert len(batch["segments"]) <= planner.max_segments
+
+
+def test_batches_are_packed_greedily():
+    segments = make_segments([1] * 20)
+    planner = BatchPlanner(context_tokens=10 ** 6, max_segments=8)
+    sizes = [len(batch["segments"]) for batch in planner.plan(segments)]
+    assert sizes == [8, 8, 4]
+
+
+def test_oversized_sentence_gets_its_own_batch():
+    segments = make_segments([1, 10, 1])
+    planner = BatchPlanner(context_tokens=300, prompt_overhead_tokens=50, output_tokens_per_segment=20)
+    batches = planner.plan(segments)
+    # Предложение не режется, даже если одно не влезает в бюджет
+    assert [len(batch["segments"]) for batch in batches] == [1, 10, 1]
@@ -0,0 +1,111 @@
+import logging
+import json
+import time
+
+import pytest
+from PIL import Image
+
+from src.ingestion.metadata_manager import MetadataManager
+from src.utils.gemini_client import GeminiClient
+from src.utils.llm_providers import LocalProvider
+
+# Имитация аплоада: задержка пропорциональна размеру картинок в запросе
+UPLOAD_BYTES_PER_SECOND = 20 * 1024 * 1024
+
+
+class FakeGemini(LocalProvider):
+    """Локальный бэкенд, который записывает запросы и "платит" за размер картинок."""
+
+    name = "fake"
+
+    def __init__(self):
+        super().__init__("fake-gemini")
+        self.requests = []
+
+    def _character_map(self, prompt):
+        # Имя зависит только от подписи лица, а не от порядка упоминаний в промпте
+        return {pid: f"Hero {pid.split('_')[1]}" for pid in set(self._person_re.findall(prompt)) - {"person_X"}}
+
+    def generate(self, contents):
+        images = [part for part in contents if isinstance(part, Image.Image)]
+        payload = sum(img.width * img.height * 3 for img in images)
+        self.requests.append({"images": len(images), "payload": payload})
+        time.sleep(payload / UPLOAD_BYTES_PER_SECOND)
+        return super().generate(contents)
+
+
+def make_library(tmp_path, people=12):
+    keyframes = tmp_path / "keyframes"
+    keyframes.mkdir()
+    reps, clusters = {}, {}
+    for i in range(people):
+        pid = f"person_{i}"
+        name = f"scene_{i:04d}_1.jpg"
+        # Полный кейфрейм 1280px, как его сохраняет SceneIndexer
+        Image.new("RGB", (1280, 720), (i * 20, 80, 160)).save(keyframes / name)
+        reps[pid] = {"path": name}
+        for scene in range(people - i):
+            clusters.setdefault(f"scene_{scene:04d}", []).append(pid)
+
+    (tmp_path / "face_representatives.json").write_text(json.dumps(reps))
+    (tmp_path / "faces_clusters.json").write_text(json.dumps(clusters))
+    return tmp_path
+
+
+def identify(library_dir, use_collage):
+    manager = MetadataManager(library_dir, movie_name="Test Movie", use_collage=use_collage)
+    fake = FakeGemini()
+    manager.client = GeminiClient(model_name="fake-gemini", use_cache=False, provider="local")
+    manager.client.provider = fake
+    manager.gemini_ready = True
+
+    started = time.perf_counter()
+    mapping = manager.identify_characters()
+    latency = time.perf_counter() - started
+
+    manager.character_map_path.unlink()
+    return mapping, fake.requests, latency
+
+
+@pytest.fixture
+def library(tmp_path):
+    return make_library(tmp_path)
+
+
+def test_collage_sends_smaller_payload_with_same_mapping(library):
+    separate_map, separate_requests, separate_latency = identify(library, use_collage=False)
+    collage_map, collage_requests, collage_latency = identify(library, use_collage=True)
+
+    assert collage_map == separate_map
+    assert len(collage_map) == 12
+
+    assert len(collage_requests) <= len(separate_requests)
+    assert collage_requests[0]["images"] == 1
+    assert separate_requests[0]["images"] == 12
+    assert collage_requests[0]["payload"] * 5 < separate_requests[0]["payload"]
+    assert collage_latency < separate_latency
+
+
+def test_collage_is_bounded(library):
+    manager = MetadataManager(library, use_collage=True)
+    entries = [(f"person_{i}", Image.new("RGB", (1280, 720))) for i in range(15)]
+    collage = manager._build_collage(entries)
+    assert max(collage.size) <= 1024
+
+
+def test_payload_size_is_measured_only_when_debugging(library, monkeypatch):
+    calls = []
+    monkeypatch.setattr(MetadataManager, "_payload_bytes", lambda self, images: calls.append(len(images)) or 0)
+    logger = logging.getLogger("src.ingestion.metadata_manager")
+    level = logger.level
+    try:
+        logger.setLevel(logging.INFO)
+        mapping, _, _ = identify(library, use_collage=True)
+        assert len(mapping) == 12
+        assert calls == []
+
+        logger.setLevel(logging.DEBUG)
+        identify(library, use_collage=True)
+        assert calls == [1]
+    finally:
+        logger.setLevel(level)
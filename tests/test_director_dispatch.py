@@ -0,0 +1,187 @@
+import json
+import time
+import functools
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.analysis.director_agent import DirectorAgent
+from src.utils.gemini_client import GeminiClient
+from src.utils.llm_providers import LLMProvider, LLMResponse, LocalProvider
+from src.utils.rate_limiter import TokenBucket
+
+
+class MockGemini(ThreadingHTTPServer):
+    """
+    Локальный "Gemini": отвечает как LocalProvider с задержкой latency и
+    отдает 429, если за последнюю секунду пришло больше limit запросов.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.05, limit=8):
+        super().__init__(("127.0.0.1", 0), MockHandler)
+        self.latency = latency
+        self.limit = limit
+        self.backend = LocalProvider("mock")
+        self.lock = threading.Lock()
+        self.recent = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.served = 0
+        self.throttled = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/generate"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        prompt = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["prompt"]
+
+        now = time.monotonic()
+        with server.lock:
+            server.recent = [t for t in server.recent if now - t < 1.0]
+            if len(server.recent) >= server.limit:
+                server.throttled += 1
+                self.send_response(429)
+                self.end_headers()
+                return
+            server.recent.append(now)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+
+        time.sleep(server.latency)
+        body = server.backend.generate([prompt]).text.encode("utf-8")
+
+        with server.lock:
+            server.in_flight -= 1
+            server.served += 1
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Throttled(Exception):
+    code = 429
+
+
+class HttpProvider(LLMProvider):
+    name = "mock-http"
+    retryable_errors = (Throttled,)
+    throttle_errors = (Throttled,)
+
+    def __init__(self, url):
+        super().__init__("mock")
+        self.url = url
+
+    def generate(self, contents):
+        data = json.dumps({"prompt": contents}).encode("utf-8")
+        request = urllib.request.Request(self.url, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return LLMResponse(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                raise Throttled() from e
+            raise
+
+
+class RecordingBucket(TokenBucket):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_seen = self.rate
+
+    def on_throttle(self):
+        super().on_throttle()
+        self.min_seen = min(self.min_seen, self.rate)
+
+
+@pytest.fixture
+def mock_gemini():
+    server = MockGemini()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_transcript(path, batches=24, per_batch=3):
+    data = []
+    seg_id = 0
+    for b in range(batches):
+        segments = []
+        for _ in range(per_batch):
+            segments.append({"segment_id": seg_id, "start": seg_id * 2.0, "end": seg_id * 2.0 + 2.0,
+                             "text": f"segment number {seg_id} about the city at night"})
+            seg_id += 1
+        data.append({"batch_id": b, "segments": segments})
+    path.write_text(json.dumps(data))
+    return seg_id
+
+
+def make_director(tmp_path, url, bucket, concurrency=6):
+    director = DirectorAgent(tmp_path, concurrency=concurrency, context_tokens=None)
+    client = GeminiClient(model_name="mock", use_cache=False, provider="local", rate_limiter=bucket)
+    client.provider = HttpProvider(url)
+    # Короткие паузы ретраев, чтобы тест шел секунды, а не минуты
+    client.generate_content = functools.partial(client.generate_content, initial_delay=0.05, retries=8)
+    director.client = client
+    director.ready = True
+    return director
+
+
+def test_batches_run_concurrently_and_keep_order(tmp_path, mock_gemini):
+    mock_gemini.limit = 1000
+    transcript = tmp_path / "transcript.json"
+    total = make_transcript(transcript)
+    director = make_director(tmp_path, mock_gemini.url, TokenBucket(1000, capacity=6))
+
+    started = time.perf_counter()
+    assert director.process(transcript, tmp_path / "script.json", [])
+    elapsed = time.perf_counter() - started
+
+    script = json.loads((tmp_path / "script.json").read_text())
+    assert [shot["segment_id"] for shot in script] == list(range(total))
+    assert mock_gemini.max_in_flight > 1
+    # 24 батча по 50 мс последовательно - 1.2 с
+    assert elapsed < 24 * mock_gemini.latency
+
+
+def test_throttling_backs_off_and_recovers(tmp_path, mock_gemini):
+    mock_gemini.limit = 8
+    transcript = tmp_path / "transcript.json"
+    total = make_transcript(transcript, batches=24)
+    bucket = RecordingBucket(40, capacity=6, recovery=0.5)
+    director = make_director(tmp_path, mock_gemini.url, bucket)
+
+    assert director.process(transcript, tmp_path / "script.json", [])
+
+    script = json.loads((tmp_path / "script.json").read_text())
+    assert [shot["segment_id"] for shot in script] == list(range(total))
+    assert mock_gemini.throttled > 0
+    # AIMD: после 429 скорость падала, успешные ответы поднимают ее обратно
+    assert bucket.min_seen < bucket.max_rate / 2
+    assert bucket.rate > bucket.min_seen
+
+
+def test_throttle_does_not_credit_old_time_at_new_rate():
+    bucket = TokenBucket(10, capacity=10)
+    for _ in range(10):
+        bucket.acquire()
+    time.sleep(0.3)  # при 10/с это 3 токена - их "сгорание" и есть сброс запаса
+    bucket.on_throttle()
+
+    # После 429 новый токен появляется не раньше, чем через 1 / 5 с
+    started = time.perf_counter()
+    bucket.acquire()
+    assert time.perf_counter() - started >= 0.15
@@ -0,0 +1,130 @@
+import re
+import json
+import threading
+
+from src.analysis.director_agent import DirectorAgent
+from src.utils.gemini_client import GeminiClient
+from src.utils.llm_providers import LocalProvider
+
+
+class RecordingProvider(LocalProvider):
+    """LocalProvider, который запоминает, какие сегменты были в каждом запросе."""
+
+    _ids_re = re.compile(r'"segment_id":(\d+)')
+
+    def __init__(self):
+        super().__init__("mock")
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def generate(self, contents):
+        prompt = self._text(contents)
+        segments_line = self._segments_re.search(prompt).group(1)
+        with self.lock:
+            self.requests.append([int(i) for i in self._ids_re.findall(segments_line)])
+        return super().generate(contents)
+
+
+def make_director(library):
+    director = DirectorAgent(library, concurrency=2, context_tokens=None)
+    director.client = GeminiClient(model_name="mock", use_cache=False, provider="local")
+    director.client.provider = RecordingProvider()
+    director.ready = True
+    return director
+
+
+def write_transcript(path, texts, per_batch=5):
+    segments = [
+        {"segment_id": i, "start": i * 2.0, "end": i * 2.0 + 2.0, "text": text}
+        for i, text in enumerate(texts)
+    ]
+    batches = [
+        {"batch_id": b, "segments": segments[b * per_batch:(b + 1) * per_batch]}
+        for b in range((len(segments) + per_batch - 1) // per_batch)
+    ]
+    path.write_text(json.dumps(batches))
+
+
+def add_character(library, movie, names):
+    (library / movie).mkdir(parents=True, exist_ok=True)
+    mapping = {f"person_{i}": name for i, name in enumerate(names)}
+    (library / movie / "character_map.json").write_text(json.dumps(mapping))
+
+
+TEXTS = [f"Sentence {i} about the detective walking through the snowy city." for i in range(15)]
+
+
+def test_edit_redirects_only_changed_segments(tmp_path):
+    transcript, script = tmp_path / "transcript.json", tmp_path / "script.json"
+    write_transcript(transcript, TEXTS)
+    director = make_director(tmp_path)
+    assert director.process(transcript, script, [])
+    first = json.loads(script.read_text())
+    assert len(director.client.provider.requests) == 3
+
+    edited = list(TEXTS)
+    edited[7] = "A completely rewritten line about an empty apartment."
+    write_transcript(transcript, edited)
+    director = make_director(tmp_path)
+    assert director.process(transcript, script, [])
+    second = json.loads(script.read_text())
+
+    # Один запрос и только с измененным сегментом, а не весь батч из пяти
+    assert director.client.provider.requests == [[7]]
+    assert [shot["segment_id"] for shot in second] == list(range(15))
+    assert second[7]["text"] == edited[7]
+    for i in range(15):
+        if i != 7:
+            assert second[i]["visual_query"] == first[i]["visual_query"]
+
+
+def test_partial_prompt_shows_neighbours_as_context(tmp_path):
+    director = make_director(tmp_path)
+    segments = [{"segment_id": i, "text": t} for i, t in enumerate(TEXTS[:5])]
+    previous = {0: {}, 1: {}, 3: {}, 4: {}}
+    context = director._context_text(segments, range(5), previous)
+    assert context == " ".join(TEXTS[i] for i in (0, 1, 3, 4))
+
+    prompt = director._build_prompt({"segments": [segments[2]]}, [], context)
+    assert "do NOT create shots" in prompt
+    assert director._build_prompt({"segments": [segments[2]]}, []).count("Surrounding text") == 0
+
+
+def test_reused_shots_drop_characters_of_removed_sources(tmp_path):
+    transcript, script = tmp_path / "transcript.json", tmp_path / "script.json"
+    write_transcript(transcript, TEXTS)
+    add_character(tmp_path, "old_movie", ["Old Hero"])
+    director = make_director(tmp_path)
+    assert director.process(transcript, script, ["old_movie"])
+    assert any(shot.get("character") == "Old Hero" for shot in json.loads(script.read_text()))
+
+    # Фильм убрали из источников: текст тот же, шоты переиспользуются без его персонажей
+    director = make_director(tmp_path)
+    assert director.process(transcript, script, [])
+    assert director.client.provider.requests == []
+    assert all(shot.get("character") is None for shot in json.loads(script.read_text()))
+
+
+def test_resume_after_crash_skips_journaled_batches(tmp_path):
+    transcript, script = tmp_path / "transcript.json", tmp_path / "script.json"
+    write_transcript(transcript, TEXTS)
+    journal = tmp_path / "script.journal.jsonl"
+
+    # "Падение" после двух батчей: сценарий не записан, журнал остался
+    director = make_director(tmp_path)
+    director.concurrency = 1
+    requests = director.client.provider.requests
+    assert not director.process(transcript, script, [], should_stop=lambda: len(requests) >= 2)
+    assert not script.exists()
+    journaled = [json.loads(line)["batch_id"] for line in journal.read_text().splitlines()]
+    assert sorted(journaled) == [0, 1]
+    # Оборванная последняя строка, как после kill посреди записи
+    with open(journal, "a") as f:
+        f.write('{"batch_id": 2, "input_ha')
+
+    director = make_director(tmp_path)
+    assert director.process(transcript, script, [])
+    assert director.client.provider.requests == [[10, 11, 12, 13, 14]]
+    assert [shot["segment_id"] for shot in json.loads(script.read_text())] == list(range(15))
+    # После записи сценария журнал больше не нужен
+    assert not journal.exists()
@@ -0,0 +1,140 @@
+import json
+import time
+import asyncio
+
+from src.api.event_bus import EventBus
+
+
+async def run_clients(bus, senders):
+    tasks = [asyncio.create_task(bus.serve(send)) for send in senders]
+    await asyncio.sleep(0.05)
+    return tasks
+
+
+async def stop(tasks):
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def collector(store, delay=0.0):
+    async def send_text(text):
+        store.append(json.loads(text))
+        if delay:
+            await asyncio.sleep(delay)
+    return send_text
+
+
+def test_every_client_gets_the_whole_stream():
+    async def scenario():
+        bus = EventBus()
+        bus.attach(asyncio.get_running_loop())
+        inboxes = [[] for _ in range(5)]
+        tasks = await run_clients(bus, [collector(inbox) for inbox in inboxes])
+
+        for n in range(100):
+            bus.publish({"type": "log", "message": f"line {n}", "level": "INFO"})
+        await asyncio.sleep(0.1)
+        await stop(tasks)
+        return inboxes
+
+    for inbox in asyncio.run(scenario()):
+        assert [m["message"] for m in inbox] == [f"line {n}" for n in range(100)]
+
+
+def test_progress_is_coalesced_per_job():
+    async def scenario():
+        bus = EventBus()
+        bus.attach(asyncio.get_running_loop())
+        inbox = []
+        tasks = await run_clients(bus, [collector(inbox)])
+
+        # Один синхронный всплеск: до отправки клиенту доходит одна пачка
+        for percent in range(100):
+            bus.publish({"type": "progress", "alias": "a", "percent": percent, "status": "work"})
+            bus.publish({"type": "progress", "alias": "b", "percent": percent, "status": "work"})
+        await asyncio.sleep(0.1)
+        await stop(tasks)
+        return inbox
+
+    inbox = asyncio.run(scenario())
+    assert sorted((m["alias"], m["percent"]) for m in inbox) == [("a", 99), ("b", 99)]
+
+
+def test_reconnecting_client_gets_last_status():
+    async def scenario():
+        bus = EventBus()
+        bus.attach(asyncio.get_running_loop())
+        # Никого нет: джоба закончилась, пока UI был отключен
+        bus.publish({"type": "progress", "alias": "film", "percent": 50, "status": "work"})
+        bus.publish({"type": "progress", "alias": "film", "percent": 100, "status": "done"})
+        bus.publish({"type": "log", "message": "lost", "level": "INFO"})
+
+        inbox = []
+        tasks = await run_clients(bus, [collector(inbox)])
+        await asyncio.sleep(0.05)
+        await stop(tasks)
+        return inbox
+
+    inbox = asyncio.run(scenario())
+    assert inbox == [{"type": "progress", "alias": "film", "percent": 100, "status": "done"}]
+
+
+def test_replay_is_bounded():
+    bus = EventBus(replay_size=3)
+    for i in range(10):
+        bus.publish({"type": "progress", "alias": f"job{i}", "percent": 100, "status": "done"})
+    assert list(bus._last_status) == ["job7", "job8", "job9"]
+
+
+def test_load_many_clients_high_rate():
+    """200 клиентов, 2000 логов/с + прогресс; медленные клиенты не тормозят быстрых."""
+    clients, slow_clients, rate, seconds = 200, 20, 2000, 1.5
+
+    async def scenario():
+        bus = EventBus()
+        bus.attach(asyncio.get_running_loop())
+        received = [0] * clients
+        last_progress = [dict() for _ in range(clients)]
+
+        def make_sender(i):
+            delay = 0.05 if i < slow_clients else 0.0
+
+            async def send_text(text):
+                received[i] += 1
+                message = json.loads(text)
+                if message["type"] == "progress":
+                    last_progress[i][message["alias"]] = message["percent"]
+                if delay:
+                    await asyncio.sleep(delay)
+            return send_text
+
+        tasks = await run_clients(bus, [make_sender(i) for i in range(clients)])
+
+        def producer():
+            interval = 1.0 / rate
+            deadline = time.perf_counter() + seconds
+            n = 0
+            while time.perf_counter() < deadline:
+                bus.publish({"type": "log", "message": f"line {n}", "level": "INFO"})
+                bus.publish({"type": "progress", "alias": f"job{n % 3}", "percent": n, "status": "work"})
+                n += 1
+                time.sleep(interval)
+            return n
+
+        published = await asyncio.to_thread(producer)
+        await asyncio.sleep(1.0)
+        await stop(tasks)
+        return published, received, last_progress
+
+    published, received, last_progress = asyncio.run(scenario())
+    fast, slow = received[slow_clients:], received[:slow_clients]
+
+    # Быстрые клиенты получают каждый лог
+    assert min(fast) >= published
+    # Медленные не копят очередь: буфер ограничен, прогресс схлопнут
+    assert max(slow) < published
+    # Но последний прогресс каждой джобы доходит до всех
+    final = {f"job{k}": max(n for n in range(published) if n % 3 == k) for k in range(3)}
+    for progress in last_progress[slow_clients:]:
+        assert progress == final
@@ -0,0 +1,127 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("sklearn")
+pytest.importorskip("scipy")
+
+from src.ingestion.face_processor import FaceProcessor, FACE_CROP_SIZE
+
+
+class FakeDetector:
+    """Вместо InsightFace: лица и эмбеддинги заданы заранее по имени кейфрейма."""
+
+    def __init__(self, faces_by_frame):
+        self.faces_by_frame = faces_by_frame
+        self.current = None
+
+    def get(self, img):
+        return self.faces_by_frame.get(self.current, [])
+
+
+def identity(rng, base, noise=0.02):
+    vector = base + rng.normal(0, noise, size=base.shape)
+    return vector / np.linalg.norm(vector)
+
+
+def test_only_representatives_are_cropped_from_keyframes(tmp_path):
+    keyframes = tmp_path / "keyframes"
+    keyframes.mkdir()
+    rng = np.random.default_rng(0)
+    people = [rng.normal(size=64) for _ in range(2)]
+
+    faces_by_frame = {}
+    for i in range(8):
+        name = f"scene_{i:03d}_1.jpg"
+        img = np.full((360, 640, 3), 40 * (i % 4), dtype=np.uint8)
+        cv2.imwrite(str(keyframes / name), img)
+        person = i % 2
+        faces_by_frame[name] = [SimpleNamespace(
+            det_score=0.7 + i / 100,
+            embedding=identity(rng, people[person]),
+            bbox=np.array([100 + person * 300, 100, 180 + person * 300, 200], dtype=np.float32)
+        )]
+
+    fp = FaceProcessor(tmp_path)
+    fp.app = FakeDetector(faces_by_frame)
+    fp._reset_state()
+    for path in sorted(keyframes.glob("*.jpg")):
+        fp.app.current = path.name
+        fp.consume(path, path.read_bytes())
+
+    # В памяти только координаты, никаких JPEG-кропов на каждое лицо
+    assert not hasattr(fp, "face_crops")
+    assert len(fp.face_boxes) == 8
+
+    fp.finalize()
+
+    reps = json.loads((tmp_path / "face_representatives.json").read_text())
+    assert len(reps) == 2
+    for pid, rep in reps.items():
+        # Лучшее лицо кластера - последнее по det_score
+        assert rep["path"] in ("scene_006_1.jpg", "scene_007_1.jpg")
+        crop = cv2.imread(str(tmp_path / rep["crop"]))
+        assert crop.shape == (FACE_CROP_SIZE, FACE_CROP_SIZE, 3)
+    assert (tmp_path / "faces_sprite.jpg").exists()
+
+
+def fragments(rng, base, clusters, per_cluster=4, spread=0.4, noise=0.005):
+    """Несколько кластеров-фрагментов одного лица: центроиды сдвинуты на ~spread от базы."""
+    X, labels = [], []
+    base = base / np.linalg.norm(base)
+    for c in clusters:
+        center = base + rng.normal(0, spread / np.sqrt(base.size), size=base.shape)
+        for _ in range(per_cluster):
+            X.append(identity(rng, center, noise))
+            labels.append(c)
+    return X, labels
+
+
+def test_merge_fragments_groups_same_person_only(tmp_path):
+    rng = np.random.default_rng(1)
+    dim = 128
+    anna, boris = rng.normal(size=dim), rng.normal(size=dim)
+
+    xa, la = fragments(rng, anna, [0, 1, 2], per_cluster=5)
+    xb, lb = fragments(rng, boris, [3, 4], per_cluster=3)
+    # Фрагменты одного человека заметно разные (иначе DBSCAN их бы не разбил)
+    assert np.dot(np.mean(xa[:5], axis=0), np.mean(xa[5:10], axis=0)) < 0.95
+    X = np.array(xa + xb + [identity(rng, rng.normal(size=dim))])
+    labels = la + lb + [-1]  # шум DBSCAN в группы не попадает
+
+    groups = FaceProcessor(tmp_path).merge_fragments(X, labels)
+
+    assert sorted(sorted(members) for members in groups.values()) == [
+        ["person_0", "person_1", "person_2"], ["person_3", "person_4"]
+    ]
+    # Представитель - самый крупный фрагмент группы (при равенстве - первый)
+    assert set(groups) == {"person_0", "person_3"}
+
+
+def test_merge_fragments_is_transitive_and_respects_threshold(tmp_path):
+    dim = 64
+    rng = np.random.default_rng(2)
+    a = rng.normal(size=dim)
+    a /= np.linalg.norm(a)
+    orth = rng.normal(size=dim)
+    orth -= orth.dot(a) * a
+    orth /= np.linalg.norm(orth)
+
+    def at(angle):
+        return np.cos(angle) * a + np.sin(angle) * orth
+
+    # Цепочка A - B - C: соседи ближе порога (0.30), а A и C - дальше
+    step = np.arccos(1 - 0.25)
+    X = np.array([at(0), at(0), at(step), at(step), at(2 * step), at(2 * step)])
+    labels = [0, 0, 1, 1, 2, 2]
+    assert X[0] @ X[4] < 1 - 0.30
+
+    groups = FaceProcessor(tmp_path).merge_fragments(X, labels, threshold=0.30)
+    assert list(groups.values()) == [["person_0", "person_1", "person_2"]]
+
+    # Строже порог - цепочка рвется
+    groups = FaceProcessor(tmp_path).merge_fragments(X, labels, threshold=0.20)
+    assert len(groups) == 3
@@ -0,0 +1,102 @@
+import json
+
+from src.utils.gemini_client import GeminiClient
+from src.utils.llm_providers import LLMProvider, LLMResponse
+from src.utils.response_cache import ResponseCache
+
+
+class StubProvider(LLMProvider):
+    """Отдает заранее заданные ответы по очереди и считает вызовы."""
+
+    name = "stub"
+
+    def __init__(self, replies):
+        super().__init__("stub-model")
+        self.replies = list(replies)
+        self.calls = 0
+
+    def generate(self, contents):
+        self.calls += 1
+        return LLMResponse(self.replies.pop(0))
+
+
+def make_client(tmp_path, replies, max_mb=200):
+    client = GeminiClient(model_name="stub-model", use_cache=False, provider="local")
+    client.provider = StubProvider(replies)
+    client.cache = ResponseCache(tmp_path / "cache", max_mb=max_mb)
+    return client
+
+
+def is_json_dict(text):
+    return isinstance(json.loads(text), dict)
+
+
+def test_hit_skips_provider(tmp_path):
+    client = make_client(tmp_path, ['{"a": 1}'])
+
+    first = client.generate_content("prompt")
+    second = client.generate_content("prompt")
+
+    assert first.text == second.text == '{"a": 1}'
+    assert client.provider.calls == 1
+
+
+def test_key_covers_prompt_and_image_bytes(tmp_path):
+    cache = ResponseCache(tmp_path)
+    assert cache.make_key("m", ["p", b"\x01"]) == cache.make_key("m", ["p", b"\x01"])
+    assert cache.make_key("m", ["p", b"\x01"]) != cache.make_key("m", ["p", b"\x02"])
+    assert cache.make_key("m", "p") != cache.make_key("other", "p")
+
+
+def test_bypass_cache_goes_to_provider(tmp_path):
+    client = make_client(tmp_path, ['{"a": 1}', '{"a": 2}'])
+
+    client.generate_content("prompt")
+    fresh = client.generate_content("prompt", bypass_cache=True)
+
+    assert fresh.text == '{"a": 2}'
+    assert client.provider.calls == 2
+    # Результат обхода кэша тоже кэшируется
+    assert client.generate_content("prompt").text == '{"a": 2}'
+
+
+def test_invalid_response_is_not_cached(tmp_path):
+    client = make_client(tmp_path, ['{"a": 1', '{"a": 1}'])
+
+    broken = client.generate_content("prompt", validate=is_json_dict)
+    repaired = client.generate_content("prompt", validate=is_json_dict)
+
+    assert broken.text == '{"a": 1'
+    assert repaired.text == '{"a": 1}'
+    assert client.provider.calls == 2
+    assert client.generate_content("prompt", validate=is_json_dict).text == '{"a": 1}'
+    assert client.provider.calls == 2
+
+
+def test_invalid_cached_entry_is_evicted(tmp_path):
+    client = make_client(tmp_path, ['not json', '{"ok": true}'])
+
+    # Записано без валидатора (например, старой версией)
+    client.generate_content("prompt")
+    response = client.generate_content("prompt", validate=is_json_dict)
+
+    assert response.text == '{"ok": true}'
+    assert client.provider.calls == 2
+
+
+def test_ttl_expiry(tmp_path):
+    cache = ResponseCache(tmp_path, ttl_hours=0)
+    cache.put("k", "v")
+    assert cache.get("k") is None
+    assert not (tmp_path / "k.json").exists()
+
+
+def test_size_eviction_keeps_recent_entries(tmp_path):
+    # ~1 KB на запись, лимит - три с половиной записи
+    cache = ResponseCache(tmp_path, max_mb=3.5 / 1024)
+    for i in range(6):
+        cache.put(f"k{i}", "x" * 1000)
+
+    kept = sorted(p.stem for p in tmp_path.glob("*.json"))
+    assert kept == ["k3", "k4", "k5"]
+    assert cache._total == sum(p.stat().st_size for p in tmp_path.glob("*.json"))
@@ -0,0 +1,172 @@
+import os
+import time
+import threading
+
+from src.utils.job_executor import JobExecutor
+from src.utils.job_registry import Job, JobCancelled, READY, FAILED, CANCELLED, QUEUED
+
+
+class FakeManager:
+    """Вместо ProjectManager в воркере: джобы без моделей и диска."""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def sleep_job(self, seconds, job=None):
+        try:
+            deadline = time.time() + seconds
+            while time.time() < deadline:
+                job.update(50, "Sleeping...", stage="sleep")
+                time.sleep(0.02)
+            job.finish(READY, "Done")
+        except JobCancelled:
+            job.finish(CANCELLED, "Cancelled")
+
+    def crash(self, job=None):
+        # Как OOM-kill или segfault в нативной библиотеке
+        os._exit(1)
+
+
+class Tracker:
+    """Собирает итоговые состояния джоб из on_finish."""
+
+    def __init__(self):
+        self.done = {}
+        self.lock = threading.Lock()
+        self.finished = threading.Condition(self.lock)
+
+    def progress(self, percent, text):
+        pass
+
+    def on_finish(self, job):
+        with self.lock:
+            self.done[job.id] = job.state
+            self.finished.notify_all()
+
+    def wait(self, count, timeout=60):
+        deadline = time.time() + timeout
+        with self.lock:
+            while len(self.done) < count:
+                left = deadline - time.time()
+                assert left > 0, f"only {len(self.done)} of {count} jobs finished"
+                self.finished.wait(left)
+
+
+def wait_idle(executor, timeout=5):
+    # on_finish приходит из потока событий раньше, чем _on_done освободит слот
+    deadline = time.time() + timeout
+    while any(executor._running.values()):
+        assert time.time() < deadline, f"slots still busy: {executor._running}"
+        time.sleep(0.01)
+
+
+class FailingOnce:
+    """Пул, у которого первый submit падает (например, пул уже закрыт)."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.failed = False
+
+    def submit(self, *args):
+        if not self.failed:
+            self.failed = True
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        return self.pool.submit(*args)
+
+    def shutdown(self, **kwargs):
+        self.pool.shutdown(**kwargs)
+
+
+def make_executor(workers=2, slots=None):
+    executor = JobExecutor(".", workers=workers, slots=slots, manager_factory=FakeManager)
+    executor.start()
+    return executor
+
+
+def submit(executor, tracker, method, args, kind="ingest"):
+    job = Job(kind, f"{method}-{time.monotonic_ns()}")
+    return executor.submit(job, method, args, progress_callback=tracker.progress, on_finish=tracker.on_finish)
+
+
+def test_worker_crash_does_not_stall_the_queue():
+    executor = make_executor(workers=1)
+    tracker = Tracker()
+    try:
+        crashed = submit(executor, tracker, "crash", ())
+        queued = [submit(executor, tracker, "sleep_job", (0.05,)) for _ in range(3)]
+        tracker.wait(4)
+
+        assert tracker.done[crashed.id] == FAILED
+        assert [tracker.done[job.id] for job in queued] == [READY] * 3
+        wait_idle(executor)
+
+        # После пересоздания пула джобы снова идут
+        later = submit(executor, tracker, "sleep_job", (0.01,))
+        tracker.wait(5)
+        assert tracker.done[later.id] == READY
+    finally:
+        executor.shutdown()
+
+
+def test_submit_failure_marks_job_failed_and_frees_slot():
+    executor = make_executor(workers=1)
+    executor._pool = FailingOnce(executor._pool)
+    tracker = Tracker()
+    try:
+        bad = submit(executor, tracker, "sleep_job", (0.01,))
+        tracker.wait(1)
+        assert tracker.done[bad.id] == FAILED
+        wait_idle(executor)
+
+        # Диспетчер жив: следующая джоба выполняется
+        good = submit(executor, tracker, "sleep_job", (0.01,))
+        tracker.wait(2)
+        assert tracker.done[good.id] == READY
+    finally:
+        executor.shutdown()
+
+
+def test_slots_limit_concurrency():
+    executor = make_executor(workers=3, slots={"ingest": 1, "build": 1})
+    tracker = Tracker()
+    peak = {"ingest": 0, "build": 0}
+    stop = threading.Event()
+
+    def sample():
+        while not stop.is_set():
+            with executor._cond:
+                for kind in peak:
+                    peak[kind] = max(peak[kind], executor._running[kind])
+            time.sleep(0.005)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    try:
+        jobs = [submit(executor, tracker, "sleep_job", (0.2,), kind=kind)
+                for kind in ("ingest", "ingest", "ingest", "build", "build")]
+        tracker.wait(len(jobs))
+    finally:
+        stop.set()
+        sampler.join()
+        executor.shutdown()
+
+    assert all(tracker.done[job.id] == READY for job in jobs)
+    # Три воркера, но одновременно не больше одной джобы каждого вида
+    assert peak == {"ingest": 1, "build": 1}
+
+
+def test_cancel_queued_job_never_starts():
+    executor = make_executor(workers=1)
+    tracker = Tracker()
+    try:
+        running = submit(executor, tracker, "sleep_job", (0.5,))
+        queued = submit(executor, tracker, "sleep_job", (0.5,))
+        assert queued.state == QUEUED
+        assert executor.cancel(queued.id)
+        tracker.wait(2)
+
+        assert tracker.done[queued.id] == CANCELLED
+        assert queued.started_at is None
+        assert tracker.done[running.id] == READY
+    finally:
+        executor.shutdown()
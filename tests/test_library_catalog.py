@@ -0,0 +1,71 @@
+import json
+import time
+
+from src.api.library_catalog import LibraryCatalog
+
+
+def make_movie(library, alias, status=None):
+    folder = library / alias
+    folder.mkdir()
+    (folder / "master_index.json").write_text(json.dumps({"movie_name": alias}))
+    if status:
+        (folder / ".ingest_status.json").write_text(json.dumps(status))
+    return folder
+
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def aliases(catalog):
+    return [movie["alias"] for movie in catalog.snapshot()[1]]
+
+
+def test_snapshot_does_not_touch_disk(tmp_path):
+    make_movie(tmp_path, "alpha")
+    catalog = LibraryCatalog(tmp_path, rescan_interval=60)
+    etag, movies = catalog.snapshot()
+    assert [m["alias"] for m in movies] == ["alpha"]
+
+    def fail(*args):
+        raise AssertionError("snapshot() read the disk")
+    catalog._stamp = fail
+    catalog._read_movie = fail
+
+    make_movie(tmp_path, "beta")
+    for _ in range(100):
+        assert catalog.snapshot() == (etag, movies)
+
+
+def test_invalidate_refreshes_in_background(tmp_path):
+    make_movie(tmp_path, "alpha")
+    catalog = LibraryCatalog(tmp_path, rescan_interval=60, coalesce_delay=0.01)
+    catalog.start()
+    assert wait_for(lambda: aliases(catalog) == ["alpha"])
+    etag = catalog.snapshot()[0]
+
+    make_movie(tmp_path, "beta", status={"status": "processing", "percent": 40})
+    catalog.invalidate("beta")
+    assert wait_for(lambda: aliases(catalog) == ["alpha", "beta"])
+    assert catalog.snapshot()[0] != etag
+    beta = catalog.snapshot()[1][1]
+    assert beta["ingest_status"] == "processing" and beta["percent"] == 40
+
+
+def test_periodic_rescan_picks_up_outside_changes(tmp_path):
+    make_movie(tmp_path, "alpha")
+    make_movie(tmp_path, "beta")
+    catalog = LibraryCatalog(tmp_path, rescan_interval=0.05)
+    catalog.start()
+    assert wait_for(lambda: aliases(catalog) == ["alpha", "beta"])
+
+    # Папку удалили в обход сервера - без invalidate
+    for path in (tmp_path / "beta").iterdir():
+        path.unlink()
+    (tmp_path / "beta").rmdir()
+    assert wait_for(lambda: aliases(catalog) == ["alpha"])
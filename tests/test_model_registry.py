@@ -0,0 +1,50 @@
+import threading
+
+from src.utils.model_registry import ModelRegistry
+
+
+def test_get_loads_once():
+    registry = ModelRegistry()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return object()
+
+    threads = [threading.Thread(target=registry.get, args=("m", loader)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(loads) == 1
+
+
+def test_idle_model_is_evicted():
+    registry = ModelRegistry(idle_ttl_minutes=0)
+    registry.get("m", object)
+    assert registry.evict_idle() == ["m"]
+    assert registry.resident() == []
+
+
+def test_leased_model_survives_ttl():
+    registry = ModelRegistry(idle_ttl_minutes=0)
+    with registry.lease():
+        model = registry.get("m", object)
+        # Джоба дольше TTL не вызывала get(): модель все равно остается
+        assert registry.evict_idle() == []
+        assert registry.get("m", object) is model
+        assert registry.resident()[0]["leases"] == 1
+
+    assert registry.evict_idle() == ["m"]
+
+
+def test_lease_counts_nested_jobs():
+    registry = ModelRegistry(idle_ttl_minutes=0)
+    with registry.lease():
+        registry.get("m", object)
+        with registry.lease():
+            registry.get("m", object)
+            assert registry.resident()[0]["leases"] == 2
+        assert registry.evict_idle() == []
+    assert registry.evict_idle() == ["m"]
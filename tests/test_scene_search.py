@@ -0,0 +1,104 @@
+import json
+import time
+import threading
+
+import pytest
+
+from src.matching.scene_search import SceneSearch, _synthetic_entries
+
+
+class StubSearch(SceneSearch):
+    """SceneSearch без модели и диска: индексы - синтетика, сборка slow_alias ждет release."""
+
+    def __init__(self, entries, slow_alias=None):
+        super().__init__(".")
+        self.entries = dict(entries)
+        self.stamps = {alias: 1 for alias in self.entries}
+        self.slow_alias = slow_alias
+        self.building = threading.Event()
+        self.release = threading.Event()
+
+    def _get_matcher(self):
+        return None
+
+    def _encode(self, query):
+        return self.entries["film_000"]["matrix"][0]
+
+    def _stamp(self, source_dir):
+        return self.stamps.get(source_dir.name)
+
+    def available_sources(self):
+        return sorted(self.entries)
+
+    def _build_source(self, alias, stamp):
+        if alias == self.slow_alias:
+            self.building.set()
+            self.release.wait(5)
+        return dict(self.entries[alias], stamp=stamp)
+
+
+def test_search_does_not_wait_for_other_builds():
+    entries = _synthetic_entries(2, 50, 16)
+    search = StubSearch(entries, slow_alias="film_001")
+    search._get_source("film_000")
+
+    warm = threading.Thread(target=search.warm_up)
+    warm.start()
+    assert search.building.wait(2)
+
+    # film_001 еще строится, а поиск по загруженному film_000 отвечает сразу
+    started = time.perf_counter()
+    found = search.search("q", top_k=5, sources=["film_000"])
+    assert time.perf_counter() - started < 0.5
+    assert found["results"] and all(r["source"] == "film_000" for r in found["results"])
+
+    search.release.set()
+    warm.join(5)
+    assert set(search._sources) == {"film_000", "film_001"}
+
+
+def test_stale_index_served_during_rebuild():
+    entries = _synthetic_entries(1, 50, 16)
+    search = StubSearch(entries, slow_alias="film_000")
+    search.release.set()
+    old = search._get_source("film_000")
+
+    search.release.clear()
+    search.building.clear()
+    search.stamps["film_000"] = 2
+    rebuild = threading.Thread(target=search._get_source, args=("film_000",))
+    rebuild.start()
+    assert search.building.wait(2)
+
+    assert search._get_source("film_000") is old
+    search.release.set()
+    rebuild.join(5)
+    assert search._get_source("film_000")["stamp"] == 2
+
+
+def test_search_request_bounds_top_k():
+    pytest.importorskip("pydantic")
+    from pydantic import ValidationError
+    from src.api.models import SearchRequest
+
+    assert SearchRequest(query="q").top_k == 20
+    for bad in (0, -1, 201, 10 ** 9):
+        with pytest.raises(ValidationError):
+            SearchRequest(query="q", top_k=bad)
+
+
+def test_search_rejects_unknown_sources(monkeypatch):
+    pytest.importorskip("fastapi")
+    from src.api import server
+    from src.api.models import SearchRequest
+
+    search = StubSearch(_synthetic_entries(1, 20, 16))
+    monkeypatch.setattr(server, "get_scene_search", lambda: search)
+
+    for sources in (["../etc"], [".hidden"], ["missing"], ["film_000", "film_000/../x"]):
+        response = server.search_scenes(SearchRequest(query="q", sources=sources))
+        assert response.status_code == 400
+        assert "Unknown sources" in json.loads(response.body)["error"]
+
+    found = server.search_scenes(SearchRequest(query="q", top_k=3, sources=["film_000"]))
+    assert len(found["results"]) == 3
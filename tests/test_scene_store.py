@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.ingestion import scene_store
+from src.ingestion.scene_store import SceneStore
+
+
+def write_index(folder, count):
+    scenes = [
+        {"id": f"scene_{i:04d}", "time": {"start": i * 2.0, "end": i * 2.0 + 2.0},
+         "visual": {"shot_type": "Close-Up" if i % 3 == 0 else "Wide Angle"},
+         "content": {"characters": ["Neo"] if i % 4 == 0 else []}}
+        for i in range(count)
+    ]
+    (folder / "master_index.json").write_text(json.dumps({"scenes": scenes}))
+
+
+def build_in_process(folder):
+    SceneStore(folder).build()
+
+
+def leftovers(folder):
+    return sorted(p.name for p in folder.iterdir() if ".tmp" in p.name or p.suffix == ".lock")
+
+
+def test_concurrent_builds_do_not_interleave(tmp_path):
+    write_index(tmp_path, 400)
+
+    # Воркер ingest (другой процесс) и ленивые сборки сервера (потоки) одновременно
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=build_in_process, args=(tmp_path,)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda _: SceneStore(tmp_path).build(), range(4)))
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+
+    assert leftovers(tmp_path) == []
+    page = SceneStore(tmp_path).page(offset=395, limit=10, character="Neo")
+    assert page["total"] == 100
+    page = SceneStore(tmp_path).page(offset=395, limit=10)
+    assert [s["id"] for s in page["scenes"]] == [f"scene_{i:04d}" for i in range(395, 400)]
+
+
+def test_build_skips_when_store_is_fresh(tmp_path, monkeypatch):
+    write_index(tmp_path, 10)
+    store = SceneStore(tmp_path)
+    store.build()
+
+    calls = []
+    monkeypatch.setattr(store, "_write", lambda mtime: calls.append(mtime))
+    store.build()
+    assert calls == []
+
+    # Индекс изменился - собираем заново
+    time.sleep(0.01)
+    write_index(tmp_path, 12)
+    store.build()
+    assert len(calls) == 1
+
+
+def test_stale_lock_is_removed(tmp_path):
+    write_index(tmp_path, 5)
+    store = SceneStore(tmp_path)
+    store.lock_path.write_text("12345")
+    old = time.time() - scene_store.LOCK_STALE_SECONDS - 10
+    os.utime(store.lock_path, (old, old))
+
+    assert store.build()["count"] == 5
+    assert leftovers(tmp_path) == []
+
+
+def test_failed_build_leaves_no_temp_files(tmp_path, monkeypatch):
+    write_index(tmp_path, 5)
+    store = SceneStore(tmp_path)
+
+    def broken_save(path, array):
+        open(path, 'wb').close()
+        raise OSError("disk full")
+    monkeypatch.setattr(scene_store.np, "save", broken_save)
+
+    with pytest.raises(OSError):
+        store.build()
+    assert leftovers(tmp_path) == []
+
+
+def test_duplicate_character_names_count_once(tmp_path):
+    scenes = [
+        {"id": f"s{i}", "visual": {"shot_type": "Close-Up"},
+         # Два склеенных фрагмента одного персонажа в одной сцене
+         "content": {"characters": ["Neo", "Neo", "Trinity"] if i % 2 else ["Trinity"]}}
+        for i in range(6)
+    ]
+    (tmp_path / "master_index.json").write_text(json.dumps({"scenes": scenes}))
+    store = SceneStore(tmp_path)
+
+    page = store.page(character="Neo")
+    assert page["total"] == 3
+    assert [s["id"] for s in page["scenes"]] == ["s1", "s3", "s5"]
+
+    page = store.page(character="Neo", shot_type="Close-Up")
+    assert [s["id"] for s in page["scenes"]] == ["s1", "s3", "s5"]
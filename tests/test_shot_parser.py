@@ -0,0 +1,51 @@
+import json
+
+from src.analysis.shot_parser import salvage_json_objects, assign_shots, validate_shot
+
+SHOTS = [
+    {"segment_id": 0, "visual_query": "man in the rain", "shot_type": "Close-Up", "character": "Neo", "mood": "Dark"},
+    {"segment_id": 1, "visual_query": "city at night", "shot_type": "wide angle", "character": None, "mood": "Calm"},
+    {"segment_id": 2, "visual_query": "empty room", "shot_type": "Medium Shot", "character": "Ghost", "mood": "Tense"},
+]
+
+
+def test_plain_list():
+    assert salvage_json_objects(json.dumps(SHOTS)) == SHOTS
+
+
+def test_fenced_json():
+    text = "Here is the shot list:\n```json\n" + json.dumps(SHOTS, indent=2) + "\n```\nEnjoy!"
+    assert salvage_json_objects(text) == SHOTS
+
+
+def test_truncated_response_keeps_complete_objects():
+    text = json.dumps(SHOTS)
+    cut = text[:text.index('"empty room"')]
+    assert salvage_json_objects(cut) == SHOTS[:2]
+
+
+def test_wrapper_prefers_shots_key():
+    text = json.dumps({"notes": ["varied shot types"], "shots": SHOTS})
+    assert salvage_json_objects(text) == SHOTS
+
+
+def test_wrapper_takes_first_list_of_objects():
+    text = json.dumps({"notes": ["x", "y"], "count": 3, "items": SHOTS})
+    assert salvage_json_objects(text) == SHOTS
+
+
+def test_assign_and_validate():
+    segments = [{"segment_id": i} for i in range(3)]
+    assigned = assign_shots(segments, SHOTS, ["Neo"])
+    assert sorted(assigned) == [0, 1, 2]
+    assert assigned[1]["shot_type"] == "Wide Angle"
+    # Персонажа нет в касте -> B-Roll
+    assert assigned[2]["character"] is None
+    assert validate_shot({"visual_query": " ", "shot_type": "Close-Up"}, []) is None
+
+
+def test_anonymous_objects_fill_by_order_only_when_counts_match():
+    segments = [{"segment_id": i} for i in range(3)]
+    anonymous = [{k: v for k, v in shot.items() if k != "segment_id"} for shot in SHOTS]
+    assert sorted(assign_shots(segments, anonymous, [])) == [0, 1, 2]
+    assert assign_shots(segments, anonymous[:2], []) == {}
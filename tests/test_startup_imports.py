@@ -0,0 +1,21 @@
+import pytest
+
+from src.utils.startup_profile import check_startup, DEFAULT_BUDGET_SECONDS
+
+
+def assert_cold_start(target):
+    ok, total, heavy_loaded, top = check_startup(target, DEFAULT_BUDGET_SECONDS)
+    assert not heavy_loaded, f"import {target} pulls in {heavy_loaded}"
+    assert total <= DEFAULT_BUDGET_SECONDS, f"import {target}: {total:.3f}s, top: {top}"
+    assert ok
+
+
+def test_project_manager_cold_start():
+    assert_cold_start("src.project_manager")
+
+
+def test_server_cold_start():
+    # Сам сервер без fastapi/uvicorn не импортируется - проверяем там, где они стоят
+    pytest.importorskip("fastapi")
+    pytest.importorskip("uvicorn")
+    assert_cold_start("src.api.server")
@@ -0,0 +1,136 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from src.utils.tmdb_client import TMDBClient
+
+POSTERS = {"the matrix": "/matrix.jpg"}
+
+
+class StandInTMDB(ThreadingHTTPServer):
+    """Локальный TMDB /search/movie: считает запросы и TCP-соединения."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.requests = 0
+        self.connections = 0
+        self.fail = False
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/3"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: одно соединение на много запросов
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+
+        if server.fail:
+            body = b"{}"
+            self.send_response(500)
+        else:
+            query = parse_qs(urlparse(self.path).query)["query"][0].lower()
+            poster = POSTERS.get(query)
+            results = [{"poster_path": poster}] if poster else []
+            body = json.dumps({"results": results}).encode("utf-8")
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def tmdb():
+    server = StandInTMDB()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(tmdb, tmp_path, **kwargs):
+    return TMDBClient("test-key", base_url=tmdb.base_url, image_base="https://img",
+                      cache_path=tmp_path / "tmdb.json", **kwargs)
+
+
+def test_hit_is_cached_and_persisted(tmdb, tmp_path):
+    client = make_client(tmdb, tmp_path)
+
+    assert client.get_poster_url("The Matrix") == "https://img/matrix.jpg"
+    assert client.get_poster_url("the  matrix") == "https://img/matrix.jpg"
+    assert tmdb.requests == 1
+
+    # Новый клиент (перезапуск сервера) берет ответ из файла кэша
+    assert make_client(tmdb, tmp_path).get_poster_url("The Matrix") == "https://img/matrix.jpg"
+    assert tmdb.requests == 1
+
+
+def test_miss_is_cached(tmdb, tmp_path):
+    client = make_client(tmdb, tmp_path)
+
+    assert client.get_poster_url("Home Video 2019") is None
+    assert client.get_poster_url("Home Video 2019") is None
+    assert tmdb.requests == 1
+    assert client.cached("Home Video 2019") == (True, None)
+
+
+def test_ttl_expiry(tmdb, tmp_path):
+    client = make_client(tmdb, tmp_path, hit_ttl_hours=0, miss_ttl_hours=0)
+
+    client.get_poster_url("The Matrix")
+    client.get_poster_url("The Matrix")
+    client.get_poster_url("Home Video 2019")
+    client.get_poster_url("Home Video 2019")
+    assert tmdb.requests == 4
+
+
+def test_errors_are_not_cached(tmdb, tmp_path):
+    client = make_client(tmdb, tmp_path)
+
+    tmdb.fail = True
+    assert client.get_poster_url("The Matrix") is None
+    tmdb.fail = False
+    assert client.get_poster_url("The Matrix") == "https://img/matrix.jpg"
+    assert tmdb.requests == 2
+
+
+def test_connection_is_reused(tmdb, tmp_path):
+    client = make_client(tmdb, tmp_path)
+
+    for i in range(10):
+        client.get_poster_url(f"Film {i}")
+    assert tmdb.requests == 10
+    assert tmdb.connections == 1
+
+
+def test_prefetch_resolves_in_background(tmdb, tmp_path):
+    client = make_client(tmdb, tmp_path)
+    done = threading.Event()
+    results = {}
+
+    def on_poster(key, url):
+        results[key] = url
+        done.set()
+
+    client.prefetch("matrix", lambda: "The Matrix", on_poster)
+    assert done.wait(5)
+    assert results == {"matrix": "https://img/matrix.jpg"}
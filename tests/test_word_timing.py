@@ -0,0 +1,67 @@
+from collections import namedtuple
+
+from src.analysis.word_timing import group_by_script_words
+
+# Те же поля, что у whisper.timing.WordTiming
+WordTiming = namedtuple("WordTiming", "word tokens start end probability")
+
+
+def split_like_whisper(script_words):
+    """
+    Имитация find_alignment: по 1-2 токена на слово, пунктуация в конце
+    слова - отдельная "словоформа" со своим токеном (split_tokens_on_spaces).
+    """
+    timings, counts, token, clock = [], [], 0, 0.0
+    for word in script_words:
+        body = word.rstrip(",.!?;:")
+        punct = word[len(body):]
+        pieces = []
+        if body:
+            body_tokens = [token, token + 1] if len(body) > 4 else [token]
+            token += len(body_tokens)
+            pieces.append((" " + body, body_tokens))
+        for mark in punct:
+            pieces.append((mark if body else " " + mark, [token]))
+            token += 1
+        counts.append(sum(len(tokens) for _, tokens in pieces))
+        for text, tokens in pieces:
+            timings.append(WordTiming(text, tokens, clock, clock + 0.3, 0.9))
+            clock += 0.3
+    return timings, counts
+
+
+def test_punctuation_is_merged_into_script_words():
+    script = "Hello, world. This is — a test!".split()
+    timings, counts = split_like_whisper(script)
+    assert len(timings) > len(script)  # ",", ".", "!" пришли отдельными "словами"
+
+    words = group_by_script_words(timings, counts)
+
+    assert [w["word"] for w in words] == [" " + w for w in script]
+    assert len(words) == len(script)
+    # "Hello," начинается с "Hello" и заканчивается на ","
+    assert words[0]["start"] == timings[0].start
+    assert words[0]["end"] == timings[1].end
+
+
+def test_word_index_does_not_drift_across_windows():
+    # Длинный текст с запятой почти в каждом предложении, "окна" по 7 слов
+    script = ("One, two. Three four, five! Six seven; eight nine, ten. " * 20).split()
+    word_idx = 0
+    while word_idx < len(script):
+        chunk = script[word_idx:word_idx + 7]
+        timings, counts = split_like_whisper(chunk)
+        words = group_by_script_words(timings, counts)
+        # Принимаем первые 5 слов окна, как при tail_margin
+        accepted = words[:5]
+        assert [w["word"].strip() for w in accepted] == chunk[:5]
+        word_idx += len(accepted)
+    assert word_idx == len(script)
+
+
+def test_short_alignment_returns_complete_words_only():
+    script = ["Alpha,", "beta."]
+    timings, counts = split_like_whisper(script)
+    # find_alignment вернул меньше, чем ждали: незавершенное слово не отдаем
+    words = group_by_script_words(timings[:-1], counts)
+    assert [w["word"] for w in words] == [" Alpha,"]